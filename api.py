@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - JSON API
+
+Calculations behind the /api/runout route, for scripts that need numbers
+rather than figures. POST a JSON array of cases (a single case object is
+also accepted); each case is run on its own and gets a result with the same
+id, so one bad case doesn't fail the batch.
+
+Case keys (all optional except the geometry):
+    id                      - echoed in the result (default: position in the array)
+    standoff, swell_factor, bund_height, runout_angle, direction, project
+    slope, failure          - [[x, y], ...] pairs or x, y text as pasted into the app
+or, for the parameterised geometry, instead of slope and failure:
+    slope_height, slope_angle, crest_width, failure_height, failure_angle, backscarp, backscarp_dist
+    failure_shape           - planar (default), circular or logspiral (see curves.py), with
+    failure_depth, spiral_angle, curve_tolerance
+
+Query parameters:
+    polygons=1      - include bund, failure volume and catch capacity polygons
+    format=ndjson   - one result per line, streamed as cases finish (or Accept: application/x-ndjson)
+    engine=numpy    - geometry engine (default: runout.ENGINE)
+    precision=3     - decimal places of the results
+
+Requests may be gzipped (Content-Encoding: gzip), and responses are gzipped
+for clients that send Accept-Encoding: gzip.
+
+"""
+import gzip
+import json
+import math
+import zlib
+
+import metrics
+from curves import failure_curve
+from runout import compute_section, parameterised_geometry, textarea_to_list
+
+# Default parameters, as in the app
+DEFAULTS = {'standoff': 18, 'swell_factor': 1.3, 'bund_height': 2, 'runout_angle': 37, 'direction': 'left', 'project': 'yes'}
+PARAMETERISED = {'slope_height': 36, 'slope_angle': 65, 'crest_width': 10, 'failure_height': 12, 'failure_angle': 35, 'backscarp': 'no', 'backscarp_dist': 5,
+                 'failure_shape': 'planar', 'failure_depth': 3, 'spiral_angle': 20, 'curve_tolerance': 0.1}
+KEYS = set(DEFAULTS) | set(PARAMETERISED) | {'id', 'slope', 'failure'}
+
+# Cases from a request body, gunzipped if needed
+def read_cases(data, content_encoding=None):
+    if content_encoding == 'gzip':
+        data = gzip.decompress(data)
+    cases = json.loads(data)
+    if isinstance(cases, dict):
+        cases = [cases]
+    if not isinstance(cases, list):
+        raise ValueError('Expected a JSON array of cases')
+    return cases
+
+# Co-ordinates from [[x, y], ...] pairs or pasted text, rounded like textarea_to_list
+def read_coordinates(value):
+    if isinstance(value, str):
+        return textarea_to_list(value)
+    return [round(float(x), 1) for x, y in value], [round(float(y), 1) for x, y in value]
+
+# Rounded number, None for missing or non-finite values (which JSON can't hold)
+def compact(value, precision):
+    if value is None or not math.isfinite(value):
+        return None
+    return round(float(value), precision)
+
+# Polygon as rounded x and y lists
+def compact_polygon(x, y, precision):
+    if x is None:
+        return None
+    return {'x': [compact(v, precision) for v in x], 'y': [compact(v, precision) for v in y]}
+
+# Run one case, timed as one 'api' calculation
+def run_case(case, index, polygons=False, engine=None, precision=3):
+    with metrics.calculation('api', id=index):
+        return case_result(case, index, polygons, engine, precision)
+
+# Result of one case. Every error is captured in the result.
+def case_result(case, index, polygons=False, engine=None, precision=3):
+    result = {'id': case.get('id', index) if isinstance(case, dict) else index}
+    try:
+        if not isinstance(case, dict):
+            raise ValueError('Case must be a JSON object')
+        unknown = set(case) - KEYS
+        if unknown:
+            raise ValueError('Unknown keys: {0}'.format(', '.join(sorted(unknown))))
+
+        p = dict(DEFAULTS, **{k: case[k] for k in DEFAULTS if k in case})
+        if 'slope' in case:
+            with metrics.stage('parse'):
+                sp_x, sp_y = read_coordinates(case['slope'])
+                fs_x = fs_y = None
+                if case.get('failure') is not None:
+                    fs_x, fs_y = read_coordinates(case['failure'])
+            right = p['direction'] == 'right'
+        else:
+            g = dict(PARAMETERISED, **{k: case[k] for k in PARAMETERISED if k in case})
+            curve = failure_curve(g['failure_shape'], float(g['failure_depth']), float(g['spiral_angle']), float(g['curve_tolerance']))
+            with metrics.stage('profile'):
+                sp_x, sp_y, fs_x, fs_y = parameterised_geometry(float(g['slope_height']), float(g['slope_angle']), float(g['crest_width']),
+                                                                float(g['failure_height']), float(g['failure_angle']), g['backscarp'], float(g['backscarp_dist']), curve)
+            right = False
+        res = compute_section(float(p['standoff']), float(p['swell_factor']), float(p['bund_height']), float(p['runout_angle']),
+                              sp_x, sp_y, fs_x, fs_y, right, p['project'], engine)
+    except Exception as e:
+        metrics.error('invalid_case')
+        result.update(status='error', errors=['{0}: {1}'.format(type(e).__name__, e)])
+        return result
+
+    result.update(status='ok' if not res.errors else 'warning',
+                  failure_volume=compact(res.failure_volume, precision), swelled_volume=compact(res.swelled_volume, precision),
+                  catch_capacity=compact(res.catch_capacity, precision), margin=compact(res.margin, precision),
+                  ix=compact(res.ix, precision), iy=compact(res.iy, precision), errors=res.errors)
+    if polygons:
+        result['polygons'] = {'bund': compact_polygon(res.b_x, res.b_y, precision),
+                              'failure_volume': compact_polygon(res.fv_x, res.fv_y, precision),
+                              'catch_capacity': compact_polygon(res.cc_x, res.cc_y, precision)}
+    return result
+
+# Response body as text chunks: a JSON array, or one JSON object per line
+def encode_results(results, ndjson=False):
+    if ndjson:
+        for result in results:
+            yield json.dumps(result, separators=(',', ':')) + '\n'
+        return
+    yield '['
+    for i, result in enumerate(results):
+        yield (',' if i else '') + json.dumps(result, separators=(',', ':'))
+    yield ']'
+
+# Gzip a stream of text chunks. With flush, each chunk is sent as soon as it
+# is compressed (for streamed NDJSON), at some cost in compression.
+def gzip_chunks(chunks, flush=False):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if flush:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -7,44 +7,46 @@ Author : Jiwoo Ahn
 16/07/2022
 
 """
+import base64
+import json
 import math
 import numpy as np
 
+# dash and dbc build the layout on import, and dash already loads plotly
+# (graph_objects included), so these stay here; their cost is paid once in
+# the gunicorn master (preload_app, see gunicorn.conf.py), not per worker
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output , State
+from dash.dependencies import Input, Output , State, ClientsideFunction
 import dash_bootstrap_components as dbc
 
-from shapely.ops import split, linemerge
-from shapely.geometry import LineString, Polygon, Point
-
+import plotly
 import plotly.graph_objects as go
-import plotly.io as pio
-pio.renderers.default='browser'
 
 import flask
+import os
+import zlib
 from users import users_info
+import api
+import jobs
+import metrics
+from runout import compute_runout, load_engine, ENGINE, ENGINES
+from cascade import cascade_runout
+from figures import bmao, bmar, bmab, bkgr, RUNOUT_TRACES, runout_traces, runout_layout, runout_figure
+from cache import open_cache, input_key
+from results import open_store, result_shapes, row_record
+from profiles import read_upload, save_profile
+from fan import FAN_ANGLES, fan_angles, fan_runout
+from curves import SHAPES, TOLERANCE, failure_curve
+from surface import SLIDERS, SAMPLES, slider_sections
+from solver import solve_standoff, solve_bund_height
 user_pwd, user_names = users_info()
 _app_route = '/'
-    
-# Colors
-bmao = '#f7923a'
-bmar = '#ee3b34'
-bmab = '#004890'
-bkgr = '#f8f5f0'
-
-# Text area delimiter
-def textarea_to_list(textarea_string):
-    list0 = textarea_string.replace('\t',',').replace('\n',',').split(',')
-    list0_float = [round(float(x),1) for x in list0]
-    spx = list0_float[::2]
-    spy = list0_float[1::2]
-    return spx, spy
-
-# Returns index of point on slope profile that is closest to the defined point
-def minimum_distance(x0, y0, xl, yl):
-    dis = [((x0-x)**2+(y0-y)**2)**0.5 for x, y in zip(xl, yl)]
-    return dis.index(min(dis))
+
+# Where the run-out figure is drawn: 'server' sends the whole plotly figure
+# on every update, 'client' sends only the numbers and the browser builds the
+# figure from a template sent once with the page (assets/runout.js)
+RENDER = os.environ.get('RUNOUT_RENDER', 'server')
     
 def header_colors():
     return {
@@ -52,202 +54,158 @@ def header_colors():
         'font_color': 'white',
     }
 
-# Converts two lists into tuple pairs
-def merge(list1, list2):
-    merged_list = tuple(zip(list1, list2)) 
-    return merged_list
+# Figure shown before logging in, built on first use
+_login_figure = []
+
+def login_figure():
+    if not _login_figure:
+        fig = go.Figure()
+        fig.update_layout(template='simple_white', paper_bgcolor=bkgr)
+        fig.update_layout(
+        title=dict(text='Please log in',x=0.5,y=0.95,
+                   font=dict(family="Arial",size=20,color='#000000')
+                   )
+        )
+        _login_figure.append(fig)
+    return _login_figure[0]
+
+# Run-out result as the numbers the browser draws the figure from: the
+# title and each trace's style, name and co-ordinates (rounded to 0.1 mm)
+def runout_data(res, standoff, bund_height, decimals=4):
+    titletext, traces = runout_traces(res, standoff, bund_height)
+    return {'layout': 'runout', 'title': titletext,
+            'traces': [{'style': style, 'name': name, 'x': np.round(np.asarray(x, dtype=float), decimals).tolist(), 'y': np.round(np.asarray(y, dtype=float), decimals).tolist()}
+                       for style, name, x, y in traces]}
 
-# Convert shapely polygon into 2D numpy array for plotting purposes
-def polygon_to_patch(polygon):
-    x, y = polygon.exterior.xy
-    xn, yn = np.array(x), np.array(y)
-    return xn, yn
+# Live parameterised mode: the exact result for the slider values, and the
+# results along each slider (surface.py) for the browser to interpolate
+# while one is dragged. Sample geometry is rounded to 1 cm, as it is only
+# shown until the slider is released. curve bends the failure surface (curves.py).
+def runout_surface(standoff, swell_factor, bund_height, runout_angle, project, bkp, params, curve=None):
+    res = compute_runout(standoff, swell_factor, bund_height, runout_angle, '', '', 'left', project, 'parameterised',
+                         params['slopeheight'], params['slopeangle'], params['crestwidth'], params['failureheight'], params['failureangle'], bkp, params['backscarpdist'],
+                         curve=curve)
+    sections = {}
+    for name, section in slider_sections(standoff, swell_factor, bund_height, runout_angle, project, bkp, params, curve=curve).items():
+        sections[name] = {'values': [value for value, r in section],
+                          'samples': [runout_data(r, standoff, bund_height, 2) for value, r in section],
+                          'volume': [r.swelled_volume if r.volume_ok else None for value, r in section],
+                          'capacity': [r.catch_capacity if r.catch_ok else None for value, r in section]}
+    return {'sliders': list(SLIDERS), 'params': params, 'exact': runout_data(res, standoff, bund_height), 'sections': sections}
 
-# Main function
-def plot_runout(standoff, swell_factor, bund_height, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist):
+# Static parts of the figures for the browser: layouts (with the template
+# expanded) and trace styles. Sent once, with the page layout.
+def figure_template():
+    layouts = {'runout': runout_layout('').to_plotly_json()['layout'], 'login': login_figure().to_plotly_json()['layout']}
+    traces = {style: go.Scatter(**kwargs).to_plotly_json() for style, kwargs in RUNOUT_TRACES.items()}
+    return json.loads(json.dumps({'layouts': layouts, 'traces': traces}, cls=plotly.utils.PlotlyJSONEncoder))
+
+# Heatmap of catch capacity over standoff and bund height, with the contour where it equals the swelled failure volume
+def sweep_figure(res):
     
-    # Initiate plotly figure
     fig = go.Figure()
     fig.update_layout(template='simple_white', paper_bgcolor=bkgr)
     
-    # Round all co-ordinates to 1 decimal place for simplification
-    try:
-        if manual == 'manual':
-            sp_x, sp_y = textarea_to_list(spxy)
-        else:
-            adj = slopeheight/math.tan(math.radians(slopeangle))
-            dl_x = failureheight/math.tan(math.radians(slopeangle))
-            m = math.tan(math.radians(failureangle))
-            c = failureheight-m*dl_x
-            
-            crest_x = (slopeheight-c)/m
-            bkp_x = adj+backscarpdist
-            bkp_y1 = m*bkp_x + c
-            bkp_y2 = math.tan(math.radians(slopeangle))*bkp_x
-            
-            if bkp == 'yes' and bkp_x < crest_x:
-                if backscarpdist >= 0:
-                    sp_x, sp_y = [0, dl_x, adj, bkp_x, adj+crestwidth], [0, failureheight, slopeheight, slopeheight, slopeheight]
-                else:
-                    sp_x, sp_y = [0, dl_x, bkp_x, adj, adj+crestwidth], [0, failureheight, bkp_y2, slopeheight, slopeheight]
-            else:
-                sp_x, sp_y = [0, dl_x, adj, crest_x, adj+crestwidth], [0, failureheight, slopeheight, slopeheight, slopeheight]
-            
-        # Plot Slope profile
-        fig.add_trace(go.Scatter(x=sp_x, y=sp_y, name = 'Slope', mode='lines', line=dict(color='black'), opacity=1.0, marker_size=0))
-        
-        # Calculated Parameters
-        bund_width = 2*bund_height/math.tan(math.radians(37))
-        
-        # bund co-ordinates
-        if direction == 'right' and manual == 'manual':
-            b_x = [standoff+sp_x[0]]
-        else:
-            b_x = [-standoff+sp_x[0]]
-            
-        b_y = [sp_y[0]]
-        
-        # Start of run-out
-        if bund_height > 0:
-            if direction == 'right' and manual == 'manual':
-                b_x.extend([b_x[0]-0.5*bund_width,
-                       b_x[0]-1.0*bund_width])
-            else:
-                b_x.extend([b_x[0]+0.5*bund_width,
-                       b_x[0]+1.0*bund_width])
-                
-                
-            b_y.extend([b_y[0]+bund_height, b_y[0]])
-            
-            bt_x, bt_y = b_x[1], b_y[1]
+    catch_capacity = res.catch_capacity[:, :, 0].T
+    fig.add_trace(go.Heatmap(x=res.standoffs, y=res.bund_heights, z=catch_capacity, colorscale='Blues', colorbar=dict(title='Catch capacity (m³/m)'), hovertemplate='Standoff %{x:.1f}m<br>Bund %{y:.1f}m<br>Catch capacity %{z:.1f} m³/m<extra></extra>'))
     
-        else:
-            bt_x, bt_y = b_x[0], b_y[0]
-        
-    except:
-        print('No slope profile entered')
-        
-    try:
-        if manual == 'manual':
-            fs_x, fs_y = textarea_to_list(fsxy)
-        else:
-            if bkp == 'yes' and bkp_x < crest_x:
-                if backscarpdist >= 0:
-                    fs_x, fs_y = [dl_x, bkp_x, bkp_x], [failureheight, bkp_y1, slopeheight]
-                else:
-                    fs_x, fs_y = [dl_x, bkp_x, bkp_x], [failureheight, bkp_y1, bkp_y2]
-            else:
-                fs_x, fs_y = [dl_x, crest_x], [failureheight, slopeheight]
-            
-        # Plot Failure surface
-        fig.add_trace(go.Scatter(x=fs_x, y=fs_y, name = 'Failure', mode='lines', line=dict(color='red'), opacity=1.0, marker_size=0))
-    except:
-        print('No failure surface entered')
-
-    # Plot bund if bund height is greater than 0
-    if bund_height > 0:
-        fig.add_trace(go.Scatter(x=b_x, y=b_y, name = "Bund", mode='lines', line=dict(color=bmao), opacity=0.2, marker_size=0, fillcolor=bmao, fill='toself', hoverinfo='skip'))
-        titletext = "{0:.1f}m Bund at {1:.0f}m Standoff".format(bund_height, standoff)
+    swelled_volume = res.swelled_volume[0]
+    if not np.isnan(swelled_volume):
+        fig.add_trace(go.Contour(x=res.standoffs, y=res.bund_heights, z=catch_capacity, name='Catch capacity = swelled volume', showscale=False, hoverinfo='skip',
+                                 contours=dict(start=swelled_volume, end=swelled_volume, size=1, coloring='lines', showlabels=True),
+                                 line=dict(color=bmar, width=3)))
+        titletext = "Catch capacity vs. {0:.1f} m³/m Swelled Failure Volume".format(swelled_volume)
     else:
-        titletext = "Unbunded {0:.0f}m Standoff".format(standoff)
-            
+        titletext = "Catch capacity (failure volume error)"
     
-    # FAILURE VOLUME calculations
-    try:
-
-        # Intersection point 1
-        i_start = minimum_distance(fs_x[0], fs_y[0], sp_x, sp_y)
-        ix1, iy1 = sp_x[i_start], sp_y[i_start]
-        fs_x[0], fs_y[0] = ix1, iy1
-        i1 = Point(ix1, iy1)
-        
-        # Interseciton point 2
-        i_end = minimum_distance(fs_x[-1], fs_y[-1], sp_x, sp_y)
-        ix2, iy2 = sp_x[i_end], sp_y[i_end]
-        fs_x[-1], fs_y[-1] = ix2, iy2
-        i2 = Point(ix2, iy2)
-        
-        # Failure surface as LineString
-        fs_ls = LineString(merge(fs_x, fs_y))
-        
-        # Slope profile as line string
-        sp_ls = LineString(merge(sp_x, sp_y))
-        
-        # Line strings to combine
-        linestrings = []
-        
-        # Check if first point of failure surface co-incides with first point of slope profile
-        bool1 = (ix1 == sp_x[0] and iy1 == sp_y[0]) 
-        bool2 = (ix2 == sp_x[-1] and iy2 == sp_y[-1])
-        if bool1 and bool2: 
-            sp_lsf = sp_ls
-            linestrings = [fs_ls]
-        elif bool1:
-            sp_lsf, sp_lsc = split(sp_ls, i2)
-            linestrings = [fs_ls, sp_lsc]
-        elif bool2:
-            sp_lsc, sp_lsf = split(sp_ls, i1)
-            linestrings = [sp_lsc, fs_ls]
-        else:
-            sp_ls1, sp_ls2 = split(sp_ls, i1)
-            sp_lsf, sp_ls3 = split(sp_ls2, i2)
-            linestrings = [sp_ls1, fs_ls, sp_ls3]
-        
-        # Linestring with slope profile and failure surface combined
-        if project == 'yes':
-            line_combined = LineString(linemerge(linestrings))
-        else:
-            line_combined = LineString(merge(sp_x, sp_y))
-            
-        # Add failed volume to plotly figure
-        failure_volume = Polygon(linemerge([sp_lsf, fs_ls]))
-        fv_x_p, fv_y_p = polygon_to_patch(failure_volume)
-            
-        fig.add_trace(go.Scatter(x=fv_x_p, y=fv_y_p, name = "Failure volume = {0:.1f} m³/m".format(failure_volume.area*swell_factor), mode='lines', line=dict(color=bmar), opacity=0.2, marker_size=0, fillcolor=bmar, fill='toself', hoverinfo='skip'))
+    fig.update_xaxes(title='Standoff (m)')
+    fig.update_yaxes(title='Bund height (m)')
+    fig.update_layout(font={'size':16})
     
-    except:
-        print('Intersection error')
-        # Create slope profile as shapely linestring, as combined surface with failure surface didn't work out
-        line_combined = LineString(merge(sp_x, sp_y))
+    fig.update_layout(
+    title=dict(text=titletext,x=0.5,y=0.95,
+               font=dict(family="Arial",size=20,color='#000000')
+               )
+    )
+    
+    fig.update_layout(margin=dict(l=20, r=20, t=60, b=20))
+    
+    return fig
 
-    # CATCH CAPACITY calculations
-    try:
-        #  Find intersection point between run-out line and combined surface
-        runout_length = 1000
-        if direction == 'right' and manual=='manual': runout_angle = 180-runout_angle
-        ro_x = [bt_x, bt_x+runout_length*math.cos(math.radians(runout_angle))]
-        ro_y = [bt_y, bt_y+runout_length*math.sin(math.radians(runout_angle))]
-        line_runout = LineString(merge(ro_x, ro_y))
-        
-        # line_combined will be just the slope profile if FAILURE VOLUME calculations run successfully
-        intersect = line_runout.intersection(line_combined)
-        
-        # Try except to filter out cases where runout line encountered more than one intersection point
-        try:
-            intersect = intersect[0]
-        except:
-            intersect = intersect    
-        ix, iy = intersect.x, intersect.y
-        
-        # Calculate catch capacity
-        line_profile = split(line_combined,line_runout)[0]
-        if bund_height > 0:
-            line_profile2 = LineString([(b_x[2], b_y[2]), (bt_x, bt_y), (ix, iy)])
-        else:
-            line_profile2 = LineString([(bt_x, bt_y), (ix, iy)])
-        catch_capacity = Polygon(linemerge([line_profile, line_profile2]))
-        cc_x, cc_y = polygon_to_patch(catch_capacity)
-        fig.add_trace(go.Scatter(x=cc_x, y=cc_y, name = "Catch capacity = {0:.1f} m³/m".format(catch_capacity.area), mode='lines', line=dict(color=bmab), opacity=0.2, marker_size=0, fillcolor=bmab, fill='toself', hoverinfo='skip'))
-        
-    except:
-        print('Catch capacity error')
+# Section with the fan of run-out lines, next to catch capacity against
+# run-out angle with the swelled volume, the critical angle and the current
+# run-out angle marked
+def fan_figure(res, runout_angle):
+    from plotly.subplots import make_subplots
+    
+    fig = make_subplots(rows=1, cols=2, column_widths=[0.55, 0.45], horizontal_spacing=0.08)
+    fig.update_layout(template='simple_white', paper_bgcolor=bkgr)
+    
+    # Section, with every run-out line of the fan as one trace
+    fig.add_trace(go.Scatter(x=res.sp_x, y=res.sp_y, name='Slope', **RUNOUT_TRACES['slope']), row=1, col=1)
+    fig.add_trace(go.Scatter(x=res.fs_x, y=res.fs_y, name='Failure', **RUNOUT_TRACES['failure']), row=1, col=1)
+    if len(res.b_x) > 1:
+        fig.add_trace(go.Scatter(x=res.b_x, y=res.b_y, name='Bund', **RUNOUT_TRACES['bund']), row=1, col=1)
+    if res.fv_x is not None:
+        fig.add_trace(go.Scatter(x=res.fv_x, y=res.fv_y, name='Failure volume', **RUNOUT_TRACES['volume']), row=1, col=1)
+    hit = ~np.isnan(res.capacity)
+    rays_x = np.column_stack([np.full(hit.sum(), res.bt_x), res.ix[hit], np.full(hit.sum(), np.nan)]).ravel()
+    rays_y = np.column_stack([np.full(hit.sum(), res.bt_y), res.iy[hit], np.full(hit.sum(), np.nan)]).ravel()
+    fig.add_trace(go.Scatter(x=rays_x, y=rays_y, mode='lines', line=dict(color=bmab, width=1), opacity=0.4, name='Run-out lines', hoverinfo='skip'), row=1, col=1)
+    fig.update_xaxes(scaleanchor='y', scaleratio=1, row=1, col=1)
+    
+    # Capacity against angle
+    fig.add_trace(go.Scatter(x=res.runout_angles, y=res.capacity, mode='lines+markers', marker_size=4, line=dict(color=bmab), name='Catch capacity',
+                             hovertemplate='Runout angle %{x:.1f}°<br>Catch capacity %{y:.1f} m³/m<extra></extra>'), row=1, col=2)
+    if not np.isnan(res.swelled_volume):
+        fig.add_hline(y=res.swelled_volume, line=dict(color=bmar, dash='dash'), row=1, col=2)
+    if runout_angle is not None:
+        fig.add_vline(x=runout_angle, line=dict(color='grey', dash='dot'), row=1, col=2)
+    if res.critical_angle is not None:
+        fig.add_vline(x=res.critical_angle, line=dict(color=bmar, width=2), row=1, col=2)
+        fig.add_trace(go.Scatter(x=[res.critical_angle], y=[res.swelled_volume], mode='markers', marker=dict(color=bmar, size=10), name='Critical angle',
+                                 hovertemplate='Critical angle %{x:.1f}°<extra></extra>'), row=1, col=2)
+    fig.update_xaxes(title='Runout angle (°)', row=1, col=2)
+    fig.update_yaxes(title='Catch capacity (m³/m)', row=1, col=2)
+    
+    if np.isnan(res.swelled_volume):
+        titletext = "Catch capacity vs. Runout Angle (failure volume error)"
+    elif res.critical_angle is not None:
+        titletext = "Critical Runout Angle {0:.1f}° for {1:.1f} m³/m Swelled Failure Volume".format(res.critical_angle, res.swelled_volume)
+    elif np.nanmin(res.margin, initial=np.inf) >= 0:
+        titletext = "{0:.1f} m³/m Swelled Failure Volume Contained Across the Fan".format(res.swelled_volume)
+    else:
+        titletext = "{0:.1f} m³/m Swelled Failure Volume Overtops Across the Fan".format(res.swelled_volume)
     
-    # # plot extents
-    # fig.update_yaxes(range=[min(sp_y), max(sp_y)], fixedrange=True)
-    # fig.update_xaxes(range=[min(b_x), max(sp_x)])
+    fig.update_layout(font={'size':16}, showlegend=False)
+    
+    fig.update_layout(
+    title=dict(text=titletext,x=0.5,y=0.95,
+               font=dict(family="Arial",size=20,color='#000000')
+               )
+    )
+    
+    fig.update_layout(margin=dict(l=20, r=20, t=60, b=20))
+    
+    return fig
 
-    fig.update_xaxes(scaleanchor = "y", scaleratio = 1)
-    fig.update_layout(font={'size':16})
+# Histogram of the Monte Carlo catch capacity margin, with the overtopping probability in the title
+def montecarlo_figure(res):
+    
+    fig = go.Figure()
+    fig.update_layout(template='simple_white', paper_bgcolor=bkgr)
+    
+    if len(res.hist_counts):
+        centres = 0.5*(res.hist_edges[1:] + res.hist_edges[:-1])
+        colors = [bmar if c < 0 else bmab for c in centres]
+        fig.add_trace(go.Bar(x=centres, y=res.hist_counts, width=np.diff(res.hist_edges), marker_color=colors, opacity=0.6, name='Samples', hovertemplate='Margin %{x:.1f} m³/m<br>%{y} samples<extra></extra>'))
+        fig.add_vline(x=0, line=dict(color='black', dash='dash'))
+    
+    titletext = "P(overtopping) = {0:.2%} (95% CI {1:.2%} - {2:.2%}, {3:,} samples)".format(res.probability, res.ci_low, res.ci_high, res.n_valid)
+    
+    fig.update_xaxes(title='Catch capacity - swelled failure volume (m³/m)')
+    fig.update_yaxes(title='Samples')
+    fig.update_layout(font={'size':16}, bargap=0)
     
     fig.update_layout(
     title=dict(text=titletext,x=0.5,y=0.95,
@@ -259,6 +217,60 @@ def plot_runout(standoff, swell_factor, bund_height, runout_angle, spxy, fsxy, d
     
     return fig
 
+# Run-out result of the app inputs, or the bench cascade with cascade set
+# (always on the numpy engine). curve is a curved failure surface for the
+# parameterised geometry (see curves.py); with tolerance, a single section
+# is simplified first (see simplify.py).
+def calculate_runout(standoff, swell_factor, bund_height, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, cascade=False, windrow_height=0.0, curve=None, tolerance=None, simplify_method='dp'):
+    if cascade:
+        return cascade_runout(standoff, swell_factor, bund_height, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, windrow_height or 0.0, curve)
+    return compute_runout(standoff, swell_factor, bund_height, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, tolerance=tolerance, simplify_method=simplify_method, curve=curve)
+
+# Curved failure surface of the app inputs, or None for a planar one (or
+# inputs out of range)
+def app_curve(manual, shape, depth, spiral_angle, tolerance):
+    if manual != 'parameterised':
+        return None
+    try:
+        return failure_curve(shape, depth, spiral_angle or 0.0, tolerance or TOLERANCE)
+    except ValueError:
+        return None
+
+# Simplification tolerance of the app inputs, or None for no simplification
+def app_tolerance(method, tolerance):
+    if method not in ('dp', 'vw') or not tolerance or tolerance <= 0:
+        return None
+    return tolerance
+
+# Add a run-out result of the app inputs to the results store (see results.py)
+def store_result(key, res, standoff, swell_factor, bund_height, runout_angle, direction, project, manual):
+    row = dict(key=key, section_id=manual, standoff=standoff, swell_factor=swell_factor, bund_height=bund_height, runout_angle=runout_angle,
+               direction=direction, project=project, failure_volume=res.failure_volume, swelled_volume=res.swelled_volume,
+               catch_capacity=res.catch_capacity, margin=res.margin, ix=res.ix, iy=res.iy,
+               errors='; '.join(res.errors), status='ok' if not res.errors else 'warning', **result_shapes(res))
+    try:
+        result_store.append([row_record(row)])
+    except OSError as e:
+        metrics.error('results_store', str(e))
+
+# Main function. With store_key, the result is also added to the results store.
+def plot_runout(standoff, swell_factor, bund_height, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, cascade=False, windrow_height=0.0, store_key=None, curve=None, tolerance=None, simplify_method='dp'):
+    with metrics.calculation('plot_runout', mode=manual, engine='numpy' if cascade else ENGINE, cascade=bool(cascade)):
+        res = calculate_runout(standoff, swell_factor, bund_height, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, cascade, windrow_height, curve, tolerance, simplify_method)
+        if store_key and result_store is not None:
+            store_result(store_key, res, standoff, swell_factor, bund_height, runout_angle, direction, project, manual)
+        with metrics.stage('figure'):
+            return runout_figure(res, standoff, bund_height)
+
+# Main function for client-side rendering: the numbers of the figure only
+def plot_runout_data(standoff, swell_factor, bund_height, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, cascade=False, windrow_height=0.0, store_key=None, curve=None, tolerance=None, simplify_method='dp'):
+    with metrics.calculation('plot_runout', mode=manual, engine='numpy' if cascade else ENGINE, cascade=bool(cascade), render='client'):
+        res = calculate_runout(standoff, swell_factor, bund_height, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, cascade, windrow_height, curve, tolerance, simplify_method)
+        if store_key and result_store is not None:
+            store_result(store_key, res, standoff, swell_factor, bund_height, runout_angle, direction, project, manual)
+        with metrics.stage('figure'):
+            return runout_data(res, standoff, bund_height)
+
 # Initiate the app
 external_stylesheets = [dbc.themes.SANDSTONE]
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
@@ -266,6 +278,12 @@ app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 server = app.server
 app.title = 'Runout Calculator'
 
+# Cache of run-out figures, shared across workers with RUNOUT_CACHE set to a file (see cache.py)
+result_cache = open_cache()
+
+# Store of every result calculated, with RUNOUT_RESULTS set to a directory (see results.py)
+result_store = open_store()
+
 # Create a login route
 @app.server.route('/login', methods=['POST'])
 def route_login():
@@ -293,6 +311,46 @@ def route_logout():
     rep.set_cookie('custom-auth-session', '', expires=0)
     return rep
 
+# Result cache size and hit/miss counters
+@app.server.route('/cache-stats')
+def route_cache_stats():
+    if not flask.request.cookies.get('custom-auth-session'):
+        return flask.redirect('/login')
+    return flask.jsonify(result_cache.stats())
+
+# Stage timings and error counters in Prometheus format (see metrics.py)
+@app.server.route('/metrics')
+def route_metrics():
+    return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# JSON API for scripted calculations (see api.py). Log in with the app
+# cookie or HTTP basic auth; results are streamed as cases finish.
+@app.server.route('/api/runout', methods=['POST'])
+def route_api_runout():
+    request = flask.request
+    auth = request.authorization
+    if not request.cookies.get('custom-auth-session') and not (auth and auth.username in user_pwd and user_pwd[auth.username] == auth.password):
+        return flask.Response('Login required', 401, {'WWW-Authenticate': 'Basic realm="runout"'})
+
+    try:
+        cases = api.read_cases(request.get_data(), request.headers.get('Content-Encoding'))
+        engine = request.args.get('engine') or None
+        if engine is not None and engine not in ENGINES:
+            raise ValueError('Unknown engine: {0}'.format(engine))
+        precision = int(request.args.get('precision', 3))
+    except (ValueError, OSError, zlib.error) as e:
+        return flask.jsonify(error=str(e)), 400
+    polygons = request.args.get('polygons', '').lower() in ('1', 'true', 'yes')
+    ndjson = request.args.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+
+    results = (api.run_case(case, i, polygons, engine, precision) for i, case in enumerate(cases))
+    body = api.encode_results(results, ndjson)
+    headers = {}
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = api.gzip_chunks(body, flush=ndjson)
+        headers['Content-Encoding'] = 'gzip'
+    return flask.Response(body, mimetype='application/x-ndjson' if ndjson else 'application/json', headers=headers)
+
 # App HTML layout
 styledict = {'display':'inline-block','vertical-align':'left', 'margin-top':'10px','margin-left':'20px','font-size':10,'font-family':'Verdana','textAlign':'center'}
 
@@ -334,6 +392,29 @@ fsxy = dcc.Textarea(
         value = "6.4	11.6\n14.3	17.7\n18.6	22.9\n22.1	35.6",
         style={'width': '90%', 'height': 104})
 
+# Simplification of dense manual sections (see simplify.py): method and tolerance
+simplifymethods = [{'label': 'Off', 'value': 'none'}, {'label': 'Douglas-Peucker (m)', 'value': 'dp'}, {'label': 'Visvalingam-Whyatt (m²)', 'value': 'vw'}]
+simplifymethod = dbc.RadioItems(id='simplifymethod-state', options=simplifymethods, value='none', inline=True)
+
+simplifytolerance = dcc.Input(id='simplifytolerance-state', type='number', value=0.05, min=0.001, max=10, step=0.001, style={'height' : '20px', 'width': '60px', 'display':'inline-block', 'margin-left':'5px','vertical-align':'middle'})
+
+# Import co-ordinates from CSV/TSV files, kept server-side (see profiles.py)
+upload_style = {'font-size':12, 'text-decoration':'underline', 'cursor':'pointer', 'text-align':'center'}
+spxy_upload = dcc.Upload(id='spxy-upload', children=html.A('Upload CSV/TSV'), accept='.csv,.tsv,.txt', style=upload_style)
+fsxy_upload = dcc.Upload(id='fsxy-upload', children=html.A('Upload CSV/TSV'), accept='.csv,.tsv,.txt', style=upload_style)
+
+# Bench cascade mode (cascade.py): fill the berms below the failure one
+# after the other, down to the toe bund, with an optional windrow on each
+cascade = dbc.Checklist(
+    id="cascade-state",
+    options=[{"label": "Bench cascade", "value": "yes"}],
+    value=[],
+    switch=True,
+    inline=True
+)
+
+windrowheight = dcc.Input(id='windrowheight-state', type='number', value=0, min=0, max=5, style={'height' : '20px', 'width': '50px', 'display':'inline-block', 'margin-left':'5px','vertical-align':'middle'})
+
 # Slope Generator 
 manuals = ['manual', 'parameterised']
 manual = dbc.RadioItems(
@@ -364,6 +445,38 @@ backscarp = dbc.Checklist(
 
 backscarpdist = dcc.Input(id='backscarpdist-state', type='number', value=5, min=-100, max=100, step=1, style={'height' : '20px', 'width': '50px', 'display':'inline-block', 'margin-left':'5px','vertical-align':'middle'})
 
+# Curved failure surface for the parameterised geometry: the basal structure
+# is the chord, and the curve hangs below it to the depth (see curves.py)
+failureshape = dbc.RadioItems(
+                id="failureshape-state",
+                options=[{"label": label, "value": x} for x, label in SHAPES.items()],
+                value="planar",
+                inline=True
+            )
+
+failuredepth = dcc.Input(id='failuredepth-state', type='number', value=3, min=0, max=50, step=0.5, style={'height' : '20px', 'width': '50px', 'display':'inline-block', 'margin-left':'5px','vertical-align':'middle'})
+
+spiralangle = dcc.Input(id='spiralangle-state', type='number', value=20, min=0, max=60, step=1, style={'height' : '20px', 'width': '50px', 'display':'inline-block', 'margin-left':'5px','vertical-align':'middle'})
+
+curvetolerance = dcc.Input(id='curvetolerance-state', type='number', value=TOLERANCE, min=0.001, max=10, step=0.001, style={'height' : '20px', 'width': '50px', 'display':'inline-block', 'margin-left':'5px','vertical-align':'middle'})
+
+# Live sliders for the parameterised geometry, kept in step with the inputs above
+live = dbc.Checklist(
+    id="live-state",
+    options=[{"label": "Live sliders", "value": "yes"}],
+    value=[],
+    switch=True,
+    inline=True
+)
+
+live_inputs = {'slopeheight': ('Slope height (m)', slopeheight), 'slopeangle': ('Slope angle (°)', slopeangle), 'crestwidth': ('Crest width (m)', crestwidth),
+               'failureheight': ('Daylighting height (m)', failureheight), 'failureangle': ('Basal structure angle (°)', failureangle), 'backscarpdist': ('Crack distance (m)', backscarpdist)}
+
+live_sliders = html.Div([html.Div([html.Label(live_inputs[name][0], style={'font-size':12}),
+                                   dcc.Slider(id=name+'-slider', min=low, max=high, step=step, value=live_inputs[name][1].value, marks={low: str(low), high: str(high)}, updatemode='mouseup')])
+                         for name, (low, high, step) in SLIDERS.items()],
+                        id='live-sliders', style={'display':'none'})
+
 # Simple dash component login form.
 login_form = html.Div(
     [
@@ -444,13 +557,18 @@ inputscard = dbc.Card(color='light',children=[
                                       dbc.Col([html.Div([html.Label(["Standoff (m):",standoff])], style=htmlright),
                                                html.Div([html.Label(["Bund height (m):",bundheight])], style=htmlright),
                                                html.Div([html.Label(["Swell factor:",swellfactor])], style=htmlright),
-                                               html.Div([html.Label(["Runout angle (°):",runoutangle])], style=htmlright)
+                                               html.Div([html.Label(["Runout angle (°):",runoutangle])], style=htmlright),
+                                               html.Div([html.Label(["Windrow height (m):",windrowheight])], style=htmlright)
                                            ]),
                                       dbc.Col([html.Div([html.Label([project])], style=htmlcent),
+                                               html.Div([html.Label([cascade])], style=htmlcent),
                                                html.Div([html.Label([manual])], style=htmlcent),
-                                               html.Div([dbc.Button('Update Graph', id='update_button', n_clicks=0, color="primary", style={"margin": "5px"})], style=htmlcent)
+                                               html.Div([dbc.Button('Update Graph', id='update_button', n_clicks=0, color="primary", style={"margin": "5px"})], style=htmlcent),
+                                               html.Div([dbc.Button('Min standoff', id='solvestandoff_button', n_clicks=0, color="secondary", size="sm", style={"margin": "2px"}),
+                                                         dbc.Button('Min bund height', id='solvebundheight_button', n_clicks=0, color="secondary", size="sm", style={"margin": "2px"})], style=htmlcent)
                                            ])
                                       ]),
+                                  html.Div(id='solver-frame', style={'font-size':12, 'text-align':'center'}),
                                   
                                   html.Hr(),
                                   
@@ -461,9 +579,12 @@ inputscard = dbc.Card(color='light',children=[
                                                                      dbc.Col([direction], md=7)
                                                                 ]),
                                                             dbc.Row([
-                                                                dbc.Col([html.H6("Slope (x,y)", style=htmlcent),spxy]),
-                                                                dbc.Col([html.H6("Failure (x,y)", style=htmlcent),fsxy])
-                                                                ])
+                                                                dbc.Col([html.H6("Slope (x,y)", style=htmlcent),spxy,spxy_upload]),
+                                                                dbc.Col([html.H6("Failure (x,y)", style=htmlcent),fsxy,fsxy_upload])
+                                                                ]),
+                                                            html.Div(id='upload-frame', style={'font-size':12, 'text-align':'center'}),
+                                                            html.Div([html.H6("Simplify", style=htmlcent), simplifymethod,
+                                                                      html.Label(["Tolerance:", simplifytolerance])], style=htmlcent)
                                                             ])),
                                           dbc.Col([html.Div([html.H5("Parameterised")], style=htmlcent),
                                                   html.Div([html.Label(["Slope height (m):",slopeheight])], style=htmlright),
@@ -474,7 +595,15 @@ inputscard = dbc.Card(color='light',children=[
                                                   html.Div([html.Label(["Basal structure angle (°):",failureangle])], style=htmlright),
                                                   html.Hr(),
                                                   html.Div([html.Label([backscarp])], style=htmlright),
-                                                  html.Div([html.Label(["Crack distance (m):",backscarpdist])], style=htmlright)
+                                                  html.Div([html.Label(["Crack distance (m):",backscarpdist])], style=htmlright),
+                                                  html.Hr(),
+                                                  html.Div([failureshape], style=htmlright),
+                                                  html.Div([html.Label(["Failure depth (m):",failuredepth])], style=htmlright),
+                                                  html.Div([html.Label(["Spiral angle (°):",spiralangle])], style=htmlright),
+                                                  html.Div([html.Label(["Area tolerance (m²/m):",curvetolerance])], style=htmlright),
+                                                  html.Hr(),
+                                                  html.Div([html.Label([live])], style=htmlright),
+                                                  live_sliders
                                                   ])
                                       ])
                                   ])
@@ -483,12 +612,133 @@ inputscard = dbc.Card(color='light',children=[
                       ])
         
         
+# Filled in by page_layout, as building the template takes longer than the rest of the import
+runout_template = dcc.Store(id='runout-template')
+
 runoutgraph = dbc.Card(color='light',children=[dbc.CardHeader("Output", style={'font-weight':'bold'}),
                         dcc.Graph('dashboard',style={'height': '65vh'},
                                   config={'displayModeBar': True, 
                                           'displaylogo':False,
                                           'toImageButtonOptions': {'format': 'svg','filename': 'runout_calculator'},
-                                          'modeBarButtonsToRemove':['hoverClosestPie']})])
+                                          'modeBarButtonsToRemove':['hoverClosestPie']}),
+                        dcc.Graph('livegraph',style={'height': '65vh', 'display': 'none'},
+                                  config={'displayModeBar': True, 
+                                          'displaylogo':False,
+                                          'toImageButtonOptions': {'format': 'svg','filename': 'runout_calculator'},
+                                          'modeBarButtonsToRemove':['hoverClosestPie']}),
+                        dcc.Store(id='runout-store'),
+                        dcc.Store(id='surface-store'),
+                        runout_template])
+
+# Progress bar, cancel button and status of a background job (jobs.py),
+# with the id of the job in name-job and the timer that polls it
+def job_controls(name):
+    return html.Div([dbc.Row([dbc.Col(dbc.Progress(id=name+'-progress', value=0, label='', striped=True, style={'height':'20px', 'margin-top':'8px'})),
+                              dbc.Col(dbc.Button('Cancel', id=name+'-cancel', n_clicks=0, color="secondary", size="sm", disabled=True, style={"margin": "2px"}), md='auto')]),
+                     html.Div(id=name+'-status', style={'font-size':12, 'text-align':'center'}),
+                     dcc.Store(id=name+'-job'),
+                     dcc.Interval(id=name+'-interval', interval=500, disabled=True)])
+
+# Standoff and bund height ranges for the sweep
+sweep_input_style = {'height' : '20px', 'width': '50px', 'display':'inline-block', 'margin-left':'5px','vertical-align':'middle'}
+sweepstandoff = [dcc.Input(id='sweepstandoffmin-state', type='number', value=0, min=0, max=50, style=sweep_input_style),
+                 dcc.Input(id='sweepstandoffmax-state', type='number', value=50, min=0, max=50, style=sweep_input_style)]
+sweepbundheight = [dcc.Input(id='sweepbundheightmin-state', type='number', value=0, min=0, max=5, style=sweep_input_style),
+                   dcc.Input(id='sweepbundheightmax-state', type='number', value=5, min=0, max=5, style=sweep_input_style)]
+
+# Number of steps across each sweep range
+sweep_steps = 51
+
+sweepgraph = dbc.Card(color='light',children=[dbc.CardHeader("Standoff / Bund Height Sweep", style={'font-weight':'bold'}),
+                        dbc.CardBody([
+                            dbc.Row([
+                                dbc.Col(html.Div([html.Label(["Standoff from / to (m):"] + sweepstandoff)], style=htmlcent)),
+                                dbc.Col(html.Div([html.Label(["Bund height from / to (m):"] + sweepbundheight)], style=htmlcent)),
+                                dbc.Col(html.Div([dbc.Button('Run Sweep', id='sweep_button', n_clicks=0, color="primary", style={"margin": "5px"})], style=htmlcent))
+                                ]),
+                            job_controls('sweep'),
+                            dcc.Graph('sweepgraph',style={'height': '50vh'},
+                                      config={'displayModeBar': True, 
+                                              'displaylogo':False,
+                                              'toImageButtonOptions': {'format': 'svg','filename': 'runout_sweep'},
+                                              'modeBarButtonsToRemove':['hoverClosestPie']})
+                            ])])
+
+# Run-out angle range and step of the fan
+fanangles = [dcc.Input(id='fanmin-state', type='number', value=FAN_ANGLES[0], min=1, max=89, style=sweep_input_style),
+             dcc.Input(id='fanmax-state', type='number', value=FAN_ANGLES[1], min=1, max=89, style=sweep_input_style)]
+fanstep = dcc.Input(id='fanstep-state', type='number', value=FAN_ANGLES[2], min=0.1, max=10, step=0.1, style=sweep_input_style)
+
+fangraph = dbc.Card(color='light',children=[dbc.CardHeader("Runout Angle Fan", style={'font-weight':'bold'}),
+                        dbc.CardBody([
+                            dbc.Row([
+                                dbc.Col(html.Div([html.Label(["Runout angle from / to (°):"] + fanangles)], style=htmlcent)),
+                                dbc.Col(html.Div([html.Label(["Step (°):", fanstep])], style=htmlcent)),
+                                dbc.Col(html.Div([dbc.Button('Run Fan', id='fan_button', n_clicks=0, color="primary", style={"margin": "5px"})], style=htmlcent))
+                                ]),
+                            dcc.Graph('fangraph',style={'height': '50vh'},
+                                      config={'displayModeBar': True, 
+                                              'displaylogo':False,
+                                              'toImageButtonOptions': {'format': 'svg','filename': 'runout_fan'},
+                                              'modeBarButtonsToRemove':['hoverClosestPie']})
+                            ])])
+
+# Standard deviations of the uncertain inputs for the probabilistic mode
+mcsamples = dcc.Input(id='mcsamples-state', type='number', value=100000, min=1000, max=1000000, step=1000, style={'height' : '20px', 'width': '80px', 'display':'inline-block', 'margin-left':'5px','vertical-align':'middle'})
+mcswellfactor = dcc.Input(id='mcswellfactor-state', type='number', value=0.1, min=0, max=1, style=sweep_input_style)
+mcrunoutangle = dcc.Input(id='mcrunoutangle-state', type='number', value=3, min=0, max=20, style=sweep_input_style)
+mcfailureangle = dcc.Input(id='mcfailureangle-state', type='number', value=3, min=0, max=20, style=sweep_input_style)
+mcfailureheight = dcc.Input(id='mcfailureheight-state', type='number', value=2, min=0, max=20, style=sweep_input_style)
+
+montecarlograph = dbc.Card(color='light',children=[dbc.CardHeader("Overtopping Probability (Parameterised Geometry)", style={'font-weight':'bold'}),
+                        dbc.CardBody([
+                            html.Div(html.H6("Normal distributions about the current inputs, standard deviation:", style=htmlcent)),
+                            dbc.Row([
+                                dbc.Col(html.Div([html.Label(["Swell factor:",mcswellfactor])], style=htmlcent)),
+                                dbc.Col(html.Div([html.Label(["Runout angle (°):",mcrunoutangle])], style=htmlcent)),
+                                dbc.Col(html.Div([html.Label(["Basal structure angle (°):",mcfailureangle])], style=htmlcent)),
+                                dbc.Col(html.Div([html.Label(["Daylighting height (m):",mcfailureheight])], style=htmlcent)),
+                                dbc.Col(html.Div([html.Label(["Samples:",mcsamples])], style=htmlcent)),
+                                dbc.Col(html.Div([dbc.Button('Run Monte Carlo', id='montecarlo_button', n_clicks=0, color="primary", style={"margin": "5px"})], style=htmlcent))
+                                ]),
+                            html.Div(id='montecarlo-note', style={'font-size':12, 'text-align':'center'}),
+                            job_controls('montecarlo'),
+                            dcc.Graph('montecarlograph',style={'height': '50vh'},
+                                      config={'displayModeBar': True, 
+                                              'displaylogo':False,
+                                              'toImageButtonOptions': {'format': 'svg','filename': 'runout_probability'},
+                                              'modeBarButtonsToRemove':['hoverClosestPie']})
+                            ])])
+
+# Multi-section batch (batch.py) of an uploaded long-format CSV/TSV file,
+# with the current parameters as the defaults: a results table, or a report
+# of every section's figure (report.py)
+batchoutputs = [{'label': 'Results CSV', 'value': 'csv'}, {'label': 'Report (SVG figures)', 'value': 'svg'}, {'label': 'Report (interactive)', 'value': 'html'}]
+batchoutput = dbc.RadioItems(id='batchoutput-state', options=batchoutputs, value='csv', inline=True)
+
+batchcard = dbc.Card(color='light',children=[dbc.CardHeader("Batch (Multi-Section CSV/TSV)", style={'font-weight':'bold'}),
+                        dbc.CardBody([
+                            html.Div(html.H6("Columns section_id, part (slope / failure), x, y; optional standoff, swell_factor, bund_height, runout_angle, direction, project", style=htmlcent)),
+                            html.Div([batchoutput], style=htmlcent),
+                            dcc.Upload(id='batch-upload', children=html.A('Upload sections and run'), accept='.csv,.tsv,.txt', style=upload_style),
+                            job_controls('batch'),
+                            dcc.Download(id='batch-download')
+                            ])])
+
+# Pit-wide queries of the results store (results.py): the sections that
+# overtop, and the bund height needed at a chainage with the current
+# standoff, swell factor and run-out angle
+storechainage = dcc.Input(id='storechainage-state', type='number', value=0, min=0, style={'height' : '20px', 'width': '80px', 'display':'inline-block', 'margin-left':'5px','vertical-align':'middle'})
+
+storecard = dbc.Card(color='light',children=[dbc.CardHeader("Results Store", style={'font-weight':'bold'}),
+                        dbc.CardBody([
+                            dbc.Row([
+                                dbc.Col(html.Div([dbc.Button('Overtopping sections', id='storeovertop_button', n_clicks=0, color="secondary", size="sm", style={"margin": "2px"})], style=htmlcent)),
+                                dbc.Col(html.Div([html.H6("Chainage (m)", style={'display':'inline-block'}), storechainage,
+                                                  dbc.Button('Bund height needed', id='storebundheight_button', n_clicks=0, color="secondary", size="sm", style={"margin": "2px"})], style=htmlcent))
+                                ]),
+                            html.Div(id='store-frame', style={'font-size':12, 'text-align':'center'})
+                            ])])
 
 markdowncard = html.Div(dcc.Markdown('''
                                      Disclaimer: This is a cut-fill calculator and does not predict failure mechanisms or run-out distances. Only applicable to slumping events where there is no rotational movement of the falling material. This tool does not replace assessment by a Geotechnical Engineer.
@@ -498,7 +748,7 @@ markdowncard = html.Div(dcc.Markdown('''
                                      Contact: jiwoo.ahn@bhp.com
                                      '''), style = {'font-size':12,'font-family':'Verdana','textAlign':'center'})
 
-app.layout = dbc.Container(
+layout = dbc.Container(
     [
         header,
         
@@ -511,14 +761,55 @@ app.layout = dbc.Container(
         
         html.Hr(),
         
+        sweepgraph,
+        
+        html.Hr(),
+        
+        fangraph,
+        
+        html.Hr(),
+        
+        montecarlograph,
+        
+        html.Hr(),
+        
+        batchcard,
+        
+        html.Hr(),
+        
+        storecard,
+        
+        html.Hr(),
+        
         html.Div(id='markdown-frame')
     ],
     fluid=True
 )
 
+# Page layout, with the figure template filled in the first time a page is
+# served rather than on import. The static tree validates the callbacks, so
+# Dash doesn't call this when it is set.
+def page_layout():
+    if getattr(runout_template, 'data', None) is None:
+        runout_template.data = figure_template()
+    return layout
+
+app.validation_layout = layout
+app.layout = page_layout
+
+# Do the work deferred from import: the geometry engine's imports, the
+# figure template, the login figure and Dash's own setup on its first
+# request. gunicorn.conf.py runs it in the master, so forked workers start
+# with it done.
+def warm():
+    load_engine(ENGINE)
+    page_layout()
+    login_figure()
+    app.server.test_client().get('/')
+
 
 @app.callback(
-    Output('dashboard', 'figure'),
+    Output('runout-store', 'data') if RENDER == 'client' else Output('dashboard', 'figure'),
     Output('custom-auth-frame-1', 'children'),
     Output('markdown-frame','children'),
     Input('update_button', 'n_clicks'),
@@ -537,26 +828,28 @@ app.layout = dbc.Container(
     State('failureheight-state','value'),
     State('failureangle-state','value'),
     State('backscarp-state','value'),
-    State('backscarpdist-state','value')
+    State('backscarpdist-state','value'),
+    State('cascade-state','value'),
+    State('windrowheight-state','value'),
+    State('failureshape-state','value'),
+    State('failuredepth-state','value'),
+    State('spiralangle-state','value'),
+    State('curvetolerance-state','value'),
+    State('simplifymethod-state','value'),
+    State('simplifytolerance-state','value')
 )
 
 
-def update_graph(n_clicks, standoff, swellfactor, bundheight, runoutangle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, backscarp, backscarpdist):
+def update_graph(n_clicks, standoff, swellfactor, bundheight, runoutangle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, backscarp, backscarpdist, cascade, windrowheight,
+                 failureshape='planar', failuredepth=0, spiralangle=0, curvetolerance=TOLERANCE, simplifymethod='none', simplifytolerance=None):
     
     session_cookie = flask.request.cookies.get('custom-auth-session')
     
     if not session_cookie:
         # If there's no cookie we need to login.
-        # Initiate plotly figure
-        fig = go.Figure()
-        fig.update_layout(template='simple_white', paper_bgcolor=bkgr)
-        fig.update_layout(
-        title=dict(text='Please log in',x=0.5,y=0.95,
-                   font=dict(family="Arial",size=20,color='#000000')
-                   )
-        )
-        
-        return [fig, login_form, '']
+        if RENDER == 'client':
+            return [{'layout': 'login', 'title': 'Please log in', 'traces': []}, login_form, '']
+        return [login_figure(), login_form, '']
     else:
         
         logout_output = html.Form(
@@ -575,18 +868,507 @@ def update_graph(n_clicks, standoff, swellfactor, bundheight, runoutangle, spxy,
         
         if n_clicks >= 0:
             
-            print(n_clicks)
-            
             if project: prj = 'yes'
             else: prj= 'no'
             
             if backscarp: bkp = 'yes'
             else: bkp = 'no'
     
-            fig = plot_runout(standoff, swellfactor, bundheight, runoutangle, spxy, fsxy, direction, prj, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist)
+            curve = app_curve(manual, failureshape, failuredepth, spiralangle, curvetolerance)
+            options = [curve.shape, curve.depth, curve.spiral_angle, curve.tolerance] if curve else []
+            tolerance = None if cascade else app_tolerance(simplifymethod, simplifytolerance)
+            options += ['simplify', simplifymethod, tolerance] if tolerance else []
+
+            # Reuse the figure from an earlier calculation with the same inputs
+            key = input_key(standoff, swellfactor, bundheight, runoutangle, spxy, fsxy, direction, prj, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist,
+                            extra=[ENGINE, RENDER] + (['cascade', windrowheight] if cascade else []) + options)
+            fig = result_cache.get(key)
+            if fig is None:
+                # Single-bench results go to the results store, keyed on the inputs alone
+                store_key = None if cascade else input_key(standoff, swellfactor, bundheight, runoutangle, spxy, fsxy, direction, prj, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, extra=options)
+                if RENDER == 'client':
+                    fig = json.dumps(plot_runout_data(standoff, swellfactor, bundheight, runoutangle, spxy, fsxy, direction, prj, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, bool(cascade), windrowheight, store_key, curve, tolerance, simplifymethod))
+                else:
+                    fig = plot_runout(standoff, swellfactor, bundheight, runoutangle, spxy, fsxy, direction, prj, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, bool(cascade), windrowheight, store_key, curve, tolerance, simplifymethod).to_json()
+                result_cache.put(key, fig)
+            fig = json.loads(fig)
                             
         return [fig, logout_output, markdowncard]
 
+# Store an uploaded slope profile or failure surface and put its handle in the text area
+@app.callback(
+    Output('spxy-state', 'value'),
+    Output('fsxy-state', 'value'),
+    Output('upload-frame', 'children'),
+    Input('spxy-upload', 'contents'),
+    Input('fsxy-upload', 'contents'),
+    State('spxy-upload', 'filename'),
+    State('fsxy-upload', 'filename'),
+    prevent_initial_call=True
+)
+
+
+def upload_profile(spxy_contents, fsxy_contents, spxy_filename, fsxy_filename):
+    
+    session_cookie = flask.request.cookies.get('custom-auth-session')
+    
+    if not session_cookie:
+        raise dash.exceptions.PreventUpdate
+    
+    triggered = dash.callback_context.triggered[0]['prop_id']
+    if triggered.startswith('spxy-upload'):
+        part, contents, filename = 'slope', spxy_contents, spxy_filename
+    else:
+        part, contents, filename = 'failure', fsxy_contents, fsxy_filename
+    
+    try:
+        x, y = read_upload(contents, part)
+    except (ValueError, IndexError) as e:
+        return dash.no_update, dash.no_update, 'Upload error ({0}): {1}'.format(filename, e)
+    
+    handle = save_profile(x, y, filename)
+    if part == 'slope':
+        return handle, dash.no_update, ''
+    return dash.no_update, handle, ''
+
+# Build the run-out figure in the browser from the numbers in runout-store
+if RENDER == 'client':
+    app.clientside_callback(
+        ClientsideFunction(namespace='runout', function_name='figure'),
+        Output('dashboard', 'figure'),
+        Input('runout-store', 'data'),
+        State('runout-template', 'data')
+    )
+
+# Keep each live slider and its input in step
+for name in SLIDERS:
+    app.clientside_callback(
+        ClientsideFunction(namespace='runout', function_name='sync'),
+        Output(name+'-state', 'value'),
+        Output(name+'-slider', 'value'),
+        Input(name+'-state', 'value'),
+        Input(name+'-slider', 'value'),
+        prevent_initial_call=True
+    )
+
+# Show the live sliders and graph in live parameterised mode
+app.clientside_callback(
+    ClientsideFunction(namespace='runout', function_name='show_live'),
+    Output('live-sliders', 'style'),
+    Output('dashboard', 'style'),
+    Output('livegraph', 'style'),
+    Input('live-state', 'value'),
+    Input('manual-state', 'value')
+)
+
+# Draw the live graph: the exact result, or while a slider is dragged, the
+# response interpolated from surface-store (no request until it is released)
+app.clientside_callback(
+    ClientsideFunction(namespace='runout', function_name='live'),
+    Output('livegraph', 'figure'),
+    Input('surface-store', 'data'),
+    *[Input(name+'-slider', 'drag_value') for name in SLIDERS],
+    State('runout-template', 'data'),
+    *[State(name+'-slider', 'value') for name in SLIDERS]
+)
+
+@app.callback(
+    Output('surface-store', 'data'),
+    Input('live-state', 'value'),
+    Input('manual-state', 'value'),
+    Input('standoff-state', 'value'),
+    Input('swellfactor-state', 'value'),
+    Input('bundheight-state', 'value'),
+    Input('runoutangle-state', 'value'),
+    Input('project-state','value'),
+    Input('backscarp-state','value'),
+    Input('failureshape-state','value'),
+    Input('failuredepth-state','value'),
+    Input('spiralangle-state','value'),
+    Input('curvetolerance-state','value'),
+    *[Input(name+'-state', 'value') for name in SLIDERS]
+)
+
+
+def update_live(live, manual, standoff, swellfactor, bundheight, runoutangle, project, backscarp, failureshape, failuredepth, spiralangle, curvetolerance, *values):
+    
+    session_cookie = flask.request.cookies.get('custom-auth-session')
+    
+    if not session_cookie or not live or manual != 'parameterised' or None in (standoff, swellfactor, bundheight, runoutangle) + values:
+        raise dash.exceptions.PreventUpdate
+    
+    if project: prj = 'yes'
+    else: prj= 'no'
+    
+    if backscarp: bkp = 'yes'
+    else: bkp = 'no'
+    
+    params = dict(zip(SLIDERS, values))
+    curve = app_curve(manual, failureshape, failuredepth, spiralangle, curvetolerance)
+    options = [curve.shape, curve.depth, curve.spiral_angle, curve.tolerance] if curve else []
+    key = input_key(standoff, swellfactor, bundheight, runoutangle, '', '', 'left', prj, 'parameterised', *values[:5], bkp, values[5], extra=['surface', ENGINE, SAMPLES] + options)
+    data = result_cache.get(key)
+    if data is None:
+        with metrics.calculation('live_surface', engine=ENGINE):
+            data = json.dumps(runout_surface(standoff, swellfactor, bundheight, runoutangle, prj, bkp, params, curve))
+        result_cache.put(key, data)
+    return json.loads(data)
+
+# Queue a sweep as a background job
+@app.callback(
+    Output('sweep-job', 'data'),
+    Input('sweep_button', 'n_clicks'),
+    State('sweepstandoffmin-state', 'value'),
+    State('sweepstandoffmax-state', 'value'),
+    State('sweepbundheightmin-state', 'value'),
+    State('sweepbundheightmax-state', 'value'),
+    State('swellfactor-state', 'value'),
+    State('runoutangle-state', 'value'),
+    State('spxy-state', 'value'),
+    State('fsxy-state', 'value'),
+    State('direction-state','value'),
+    State('project-state','value'),
+    State('manual-state','value'),
+    State('slopeheight-state', 'value'),
+    State('slopeangle-state', 'value'),
+    State('crestwidth-state', 'value'),
+    State('failureheight-state','value'),
+    State('failureangle-state','value'),
+    State('backscarp-state','value'),
+    State('backscarpdist-state','value'),
+    State('failureshape-state','value'),
+    State('failuredepth-state','value'),
+    State('spiralangle-state','value'),
+    State('curvetolerance-state','value'),
+    prevent_initial_call=True
+)
+
+
+def update_sweep(n_clicks, standoffmin, standoffmax, bundheightmin, bundheightmax, swellfactor, runoutangle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, backscarp, backscarpdist, failureshape, failuredepth, spiralangle, curvetolerance):
+    
+    session_cookie = flask.request.cookies.get('custom-auth-session')
+    
+    if not session_cookie:
+        raise dash.exceptions.PreventUpdate
+    
+    if project: prj = 'yes'
+    else: prj= 'no'
+    
+    if backscarp: bkp = 'yes'
+    else: bkp = 'no'
+    
+    try:
+        standoffs = np.linspace(standoffmin, standoffmax, sweep_steps)
+        bundheights = np.linspace(bundheightmin, bundheightmax, sweep_steps)
+    except TypeError:
+        raise dash.exceptions.PreventUpdate
+    
+    return jobs.submit('sweep', {'standoffs': standoffs, 'args': [swellfactor, bundheights, runoutangle, spxy, fsxy, direction, prj, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist,
+                                                             app_curve(manual, failureshape, failuredepth, spiralangle, curvetolerance)]})
+
+@app.callback(
+    Output('fangraph', 'figure'),
+    Input('fan_button', 'n_clicks'),
+    State('fanmin-state', 'value'),
+    State('fanmax-state', 'value'),
+    State('fanstep-state', 'value'),
+    State('standoff-state', 'value'),
+    State('swellfactor-state', 'value'),
+    State('bundheight-state', 'value'),
+    State('runoutangle-state', 'value'),
+    State('spxy-state', 'value'),
+    State('fsxy-state', 'value'),
+    State('direction-state','value'),
+    State('project-state','value'),
+    State('manual-state','value'),
+    State('slopeheight-state', 'value'),
+    State('slopeangle-state', 'value'),
+    State('crestwidth-state', 'value'),
+    State('failureheight-state','value'),
+    State('failureangle-state','value'),
+    State('backscarp-state','value'),
+    State('backscarpdist-state','value'),
+    State('failureshape-state','value'),
+    State('failuredepth-state','value'),
+    State('spiralangle-state','value'),
+    State('curvetolerance-state','value'),
+    prevent_initial_call=True
+)
+
+
+def update_fan(n_clicks, fanmin, fanmax, fanstep, standoff, swellfactor, bundheight, runoutangle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, backscarp, backscarpdist, failureshape, failuredepth, spiralangle, curvetolerance):
+    
+    session_cookie = flask.request.cookies.get('custom-auth-session')
+    
+    if not session_cookie or not fanstep or fanstep <= 0:
+        raise dash.exceptions.PreventUpdate
+    
+    if project: prj = 'yes'
+    else: prj= 'no'
+    
+    if backscarp: bkp = 'yes'
+    else: bkp = 'no'
+    
+    try:
+        with metrics.calculation('fan', mode=manual):
+            res = fan_runout(standoff, swellfactor, bundheight, fan_angles(fanmin, fanmax, fanstep), spxy, fsxy, direction, prj, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist,
+                             curve=app_curve(manual, failureshape, failuredepth, spiralangle, curvetolerance))
+    except (ValueError, TypeError, ZeroDivisionError):
+        raise dash.exceptions.PreventUpdate
+    
+    return fan_figure(res, runoutangle)
+
+@app.callback(
+    Output('standoff-state', 'value'),
+    Output('bundheight-state', 'value'),
+    Output('solver-frame', 'children'),
+    Input('solvestandoff_button', 'n_clicks'),
+    Input('solvebundheight_button', 'n_clicks'),
+    State('standoff-state', 'value'),
+    State('swellfactor-state', 'value'),
+    State('bundheight-state', 'value'),
+    State('runoutangle-state', 'value'),
+    State('spxy-state', 'value'),
+    State('fsxy-state', 'value'),
+    State('direction-state','value'),
+    State('project-state','value'),
+    State('manual-state','value'),
+    State('slopeheight-state', 'value'),
+    State('slopeangle-state', 'value'),
+    State('crestwidth-state', 'value'),
+    State('failureheight-state','value'),
+    State('failureangle-state','value'),
+    State('backscarp-state','value'),
+    State('backscarpdist-state','value'),
+    State('failureshape-state','value'),
+    State('failuredepth-state','value'),
+    State('spiralangle-state','value'),
+    State('curvetolerance-state','value'),
+    prevent_initial_call=True
+)
+
+
+def update_solver(n_standoff, n_bundheight, standoff, swellfactor, bundheight, runoutangle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, backscarp, backscarpdist, failureshape, failuredepth, spiralangle, curvetolerance):
+    
+    session_cookie = flask.request.cookies.get('custom-auth-session')
+    
+    if not session_cookie:
+        raise dash.exceptions.PreventUpdate
+    
+    if project: prj = 'yes'
+    else: prj= 'no'
+    
+    if backscarp: bkp = 'yes'
+    else: bkp = 'no'
+    
+    curve = app_curve(manual, failureshape, failuredepth, spiralangle, curvetolerance)
+    triggered = dash.callback_context.triggered[0]['prop_id']
+    try:
+        if triggered.startswith('solvestandoff_button'):
+            res = solve_standoff(bundheight, swellfactor, runoutangle, spxy, fsxy, direction, prj, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, curve=curve)
+        else:
+            res = solve_bund_height(standoff, swellfactor, runoutangle, spxy, fsxy, direction, prj, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, curve=curve)
+    except (ValueError, TypeError, ZeroDivisionError):
+        return dash.no_update, dash.no_update, 'Solver error: check geometry'
+    
+    label = 'standoff' if res.parameter == 'standoff' else 'bund height'
+    if res.value is None:
+        return dash.no_update, dash.no_update, '{0}: {1}'.format(res.status, label)
+    
+    # Round up to the input precision so the answer still contains the swelled volume
+    value = math.ceil(res.value*10)/10
+    message = 'Minimum {0} = {1:.1f} m ({2}, {3} evaluations)'.format(label, value, res.status.lower(), len(res.history))
+    if res.parameter == 'standoff':
+        return value, dash.no_update, message
+    return dash.no_update, value, message
+
+# Queue a Monte Carlo run as a background job
+@app.callback(
+    Output('montecarlo-job', 'data'),
+    Input('montecarlo_button', 'n_clicks'),
+    State('mcsamples-state', 'value'),
+    State('mcswellfactor-state', 'value'),
+    State('mcrunoutangle-state', 'value'),
+    State('mcfailureangle-state', 'value'),
+    State('mcfailureheight-state', 'value'),
+    State('standoff-state', 'value'),
+    State('swellfactor-state', 'value'),
+    State('bundheight-state', 'value'),
+    State('runoutangle-state', 'value'),
+    State('project-state','value'),
+    State('slopeheight-state', 'value'),
+    State('slopeangle-state', 'value'),
+    State('crestwidth-state', 'value'),
+    State('failureheight-state','value'),
+    State('failureangle-state','value'),
+    State('backscarp-state','value'),
+    State('backscarpdist-state','value'),
+    State('failureshape-state','value'),
+    State('failuredepth-state','value'),
+    State('spiralangle-state','value'),
+    State('curvetolerance-state','value'),
+    prevent_initial_call=True
+)
+
+
+def update_montecarlo(n_clicks, samples, sd_swellfactor, sd_runoutangle, sd_failureangle, sd_failureheight, standoff, swellfactor, bundheight, runoutangle, project, slopeheight, slopeangle, crestwidth, failureheight, failureangle, backscarp, backscarpdist, failureshape, failuredepth, spiralangle, curvetolerance):
+    
+    session_cookie = flask.request.cookies.get('custom-auth-session')
+    
+    if not session_cookie:
+        raise dash.exceptions.PreventUpdate
+    
+    if project: prj = 'yes'
+    else: prj= 'no'
+    
+    if backscarp: bkp = 'yes'
+    else: bkp = 'no'
+    
+    if samples is None or app_curve('parameterised', failureshape, failuredepth, spiralangle, curvetolerance):
+        raise dash.exceptions.PreventUpdate
+    
+    return jobs.submit('montecarlo', dict(standoff=standoff, bund_height=bundheight, slopeheight=slopeheight, slopeangle=slopeangle, crestwidth=crestwidth,
+                                          bkp=bkp, backscarpdist=backscarpdist, project=prj,
+                                          swell_factor=('normal', swellfactor, sd_swellfactor), runout_angle=('normal', runoutangle, sd_runoutangle),
+                                          failureangle=('normal', failureangle, sd_failureangle), failureheight=('normal', failureheight, sd_failureheight),
+                                          n=int(samples)))
+
+# The Monte Carlo sampler only has the planar failure surface, so it is
+# turned off while a curved one is selected
+@app.callback(
+    Output('montecarlo_button', 'disabled'),
+    Output('montecarlo-note', 'children'),
+    Input('failureshape-state','value'),
+    Input('failuredepth-state','value'),
+    Input('spiralangle-state','value'),
+    Input('curvetolerance-state','value')
+)
+
+
+def update_montecarlo_note(failureshape, failuredepth, spiralangle, curvetolerance):
+    if app_curve('parameterised', failureshape, failuredepth, spiralangle, curvetolerance):
+        return True, 'Planar failure surfaces only: set the failure surface shape to planar to run'
+    return False, ''
+
+# Queue a batch of uploaded sections as a background job
+@app.callback(
+    Output('batch-job', 'data'),
+    Input('batch-upload', 'contents'),
+    State('batch-upload', 'filename'),
+    State('batchoutput-state', 'value'),
+    State('standoff-state', 'value'),
+    State('swellfactor-state', 'value'),
+    State('bundheight-state', 'value'),
+    State('runoutangle-state', 'value'),
+    State('direction-state','value'),
+    State('project-state','value'),
+    prevent_initial_call=True
+)
+
+
+def update_batch(contents, filename, batchoutput, standoff, swellfactor, bundheight, runoutangle, direction, project):
+    
+    session_cookie = flask.request.cookies.get('custom-auth-session')
+    
+    if not session_cookie or not contents:
+        raise dash.exceptions.PreventUpdate
+    
+    if project: prj = 'yes'
+    else: prj= 'no'
+    
+    text = base64.b64decode(contents.split(',', 1)[1]).decode('utf-8-sig')
+    defaults = {'standoff': standoff, 'swell_factor': swellfactor, 'bund_height': bundheight, 'runout_angle': runoutangle, 'direction': direction, 'project': prj}
+    if batchoutput in ('svg', 'html'):
+        return jobs.submit('report', {'text': text, 'filename': filename, 'defaults': defaults, 'format': batchoutput})
+    return jobs.submit('batch', {'text': text, 'filename': filename, 'defaults': defaults})
+
+# Rows of the results store as a table
+def store_table(rows):
+    columns = [('section_id', 'Section'), ('chainage', 'Chainage'), ('standoff', 'Standoff (m)'), ('bund_height', 'Bund height (m)'),
+               ('swelled_volume', 'Failure volume (m³/m)'), ('catch_capacity', 'Catch capacity (m³/m)'), ('margin', 'Margin (m³/m)')]
+    cells = lambda value: '' if value is None else '{0:.1f}'.format(value) if isinstance(value, float) else str(value)
+    return dbc.Table([html.Thead(html.Tr([html.Th(heading) for key, heading in columns])),
+                      html.Tbody([html.Tr([html.Td(cells(row[key])) for key, heading in columns]) for row in rows])],
+                     size='sm', bordered=True, style={'font-size':12})
+
+# Query the results store
+@app.callback(
+    Output('store-frame', 'children'),
+    Input('storeovertop_button', 'n_clicks'),
+    Input('storebundheight_button', 'n_clicks'),
+    State('storechainage-state', 'value'),
+    State('standoff-state', 'value'),
+    State('swellfactor-state', 'value'),
+    State('runoutangle-state', 'value'),
+    prevent_initial_call=True
+)
+
+
+def update_store(n_overtop, n_bundheight, chainage, standoff, swellfactor, runoutangle):
+    
+    session_cookie = flask.request.cookies.get('custom-auth-session')
+    
+    if not session_cookie:
+        raise dash.exceptions.PreventUpdate
+    
+    if result_store is None:
+        return 'No results store: set RUNOUT_RESULTS to a directory to keep one'
+    result_store.refresh()
+    
+    if dash.callback_context.triggered[0]['prop_id'].startswith('storeovertop_button'):
+        rows = result_store.where(margin=('<', 0))
+        rows = rows[np.argsort(result_store.column('chainage')[rows], kind='stable')]
+        records = result_store.records(rows[:100])
+        message = '{0} of {1} stored results overtop'.format(len(rows), len(result_store)) + (' (first 100 by chainage)' if len(rows) > 100 else '')
+        return [html.Div(message), store_table(records)] if records else message
+    
+    if chainage is None or None in (standoff, swellfactor, runoutangle):
+        raise dash.exceptions.PreventUpdate
+    found = result_store.bund_height_needed(chainage, standoff=standoff, swell_factor=swellfactor, runout_angle=runoutangle)
+    if found is None:
+        return 'No stored result near chainage {0} holds the failure at this standoff, swell factor and run-out angle'.format(chainage)
+    height, i = found
+    return [html.Div('Bund height needed: {0:.1f} m'.format(height)), store_table(result_store.records([i]))]
+
+# Batch results CSV or report for dcc.Download
+def batch_download(res):
+    return dict(content=res['content'], filename=res['filename'])
+
+# Follow the job of a panel: progress while it runs, cancel on request and
+# the result (through show) once it's done
+def job_callback(name, output, show):
+    @app.callback(
+        output,
+        Output(name+'-interval', 'disabled'),
+        Output(name+'-progress', 'value'),
+        Output(name+'-progress', 'label'),
+        Output(name+'-cancel', 'disabled'),
+        Output(name+'-status', 'children'),
+        Input(name+'-job', 'data'),
+        Input(name+'-interval', 'n_intervals'),
+        Input(name+'-cancel', 'n_clicks'),
+        prevent_initial_call=True
+    )
+    def poll_job(job_id, n_intervals, n_cancel):
+        if not job_id or not flask.request.cookies.get('custom-auth-session'):
+            raise dash.exceptions.PreventUpdate
+        if dash.callback_context.triggered[0]['prop_id'].startswith(name+'-cancel'):
+            jobs.cancel(job_id)
+        
+        job = jobs.job(job_id)
+        if job is None:
+            return dash.no_update, True, 0, '', True, 'Job expired, run it again'
+        percent = round(100*job.progress)
+        if not job.done:
+            return dash.no_update, False, percent, '{0}%'.format(percent), False, job.message
+        if job.status == jobs.DONE:
+            return show(jobs.result(job_id)), True, 100, '100%', True, 'Done in {0:.1f} s'.format(job.seconds)
+        return dash.no_update, True, percent, '', True, job.message
+
+job_callback('sweep', Output('sweepgraph', 'figure'), sweep_figure)
+job_callback('montecarlo', Output('montecarlograph', 'figure'), montecarlo_figure)
+job_callback('batch', Output('batch-download', 'data'), batch_download)
+
 if __name__ == '__main__':
     app.run_server()
     
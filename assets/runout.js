@@ -0,0 +1,117 @@
+/*
+Run-out calculator - client-side figure
+
+Builds the run-out figure from the numbers update_graph sends to
+runout-store (RUNOUT_RENDER=client) and the layouts and trace styles sent
+once in runout-template, so each update carries only the geometry.
+
+In live parameterised mode, the live graph is drawn from surface-store:
+the exact result for the slider values, or while a slider is dragged, the
+result interpolated between the two nearest samples along that slider.
+*/
+
+// Linear interpolation of two equal length arrays
+function runoutLerp(a, b, t) {
+    return a.map(function(v, i) { return v + t*(b[i] - v); });
+}
+
+// Run-out figure numbers at value along one slider section of surface-store.
+// Traces with the same number of vertices either side are interpolated, the
+// others are taken from the nearest sample. Volumes are interpolated too.
+function runoutInterpolate(section, value) {
+    var values = section.values;
+    var i = 0;
+    while (i < values.length - 2 && value > values[i+1]) {
+        i++;
+    }
+    var t = Math.min(1, Math.max(0, (value - values[i])/(values[i+1] - values[i])));
+    var a = section.samples[i], b = section.samples[i+1];
+    var nearest = t < 0.5 ? a : b;
+
+    var traces = nearest.traces.map(function(trace) {
+        var ta = a.traces.find(function(u) { return u.style === trace.style; });
+        var tb = b.traces.find(function(u) { return u.style === trace.style; });
+        var out = Object.assign({}, trace);
+        if (ta && tb && ta.x.length === tb.x.length) {
+            out.x = runoutLerp(ta.x, tb.x, t);
+            out.y = runoutLerp(ta.y, tb.y, t);
+        }
+
+        // Names as in runout_traces
+        var volumes = trace.style === 'volume' ? section.volume : trace.style === 'catch' ? section.capacity : null;
+        if (volumes && volumes[i] !== null && volumes[i+1] !== null) {
+            var v = (volumes[i] + t*(volumes[i+1] - volumes[i])).toFixed(1);
+            out.name = (trace.style === 'volume' ? 'Failure volume = ' : 'Catch capacity = ') + v + ' m³/m';
+        }
+        return out;
+    });
+    return {layout: nearest.layout, title: nearest.title, traces: traces};
+}
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    runout: {
+        figure: function(data, template) {
+            if (!data || !template) {
+                return window.dash_clientside.no_update;
+            }
+
+            // Copy the layout, as plotly keeps and changes the one it is given
+            var layout = JSON.parse(JSON.stringify(template.layouts[data.layout]));
+            layout.title = Object.assign({}, layout.title, {text: data.title});
+
+            var traces = data.traces.map(function(trace) {
+                return Object.assign(JSON.parse(JSON.stringify(template.traces[trace.style])),
+                                     {name: trace.name, x: trace.x, y: trace.y});
+            });
+            return {data: traces, layout: layout};
+        },
+
+        // Copy whichever of a slider and its input changed to the other
+        sync: function(input, slider) {
+            var triggered = window.dash_clientside.callback_context.triggered;
+            var no_update = window.dash_clientside.no_update;
+            if (!triggered.length) {
+                return [no_update, no_update];
+            }
+            if (triggered[0].prop_id.endsWith('-slider.value')) {
+                return [slider, no_update];
+            }
+            return [no_update, input === null || input === undefined ? no_update : input];
+        },
+
+        show_live: function(live, manual) {
+            var on = live && live.length > 0 && manual === 'parameterised';
+            return [{display: on ? 'block' : 'none'},
+                    on ? {height: '65vh', display: 'none'} : {height: '65vh'},
+                    on ? {height: '65vh'} : {height: '65vh', display: 'none'}];
+        },
+
+        // Live graph from surface-store, the slider drag values and the
+        // slider values (both in surface.sliders order). A dragged slider is
+        // previewed from its section of the surface. A surface computed for
+        // values the sliders have since left (a request overtaken by a later
+        // release) is not drawn; the one for the latest values follows.
+        live: function(surface) {
+            var n = surface ? surface.sliders.length : 0;
+            var template = arguments[n + 1];
+            var no_update = window.dash_clientside.no_update;
+            if (!surface || !template) {
+                return no_update;
+            }
+            var triggered = window.dash_clientside.callback_context.triggered;
+            var prop = triggered.length ? triggered[0].prop_id : '';
+            for (var k = 0; k < n; k++) {
+                var name = surface.sliders[k];
+                var value = arguments[k + 1];
+                if (prop === name + '-slider.drag_value' && value !== surface.params[name]) {
+                    return window.dash_clientside.runout.figure(runoutInterpolate(surface.sections[name], value), template);
+                }
+            }
+            for (k = 0; k < n; k++) {
+                if (arguments[n + 2 + k] !== surface.params[surface.sliders[k]]) {
+                    return no_update;
+                }
+            }
+            return window.dash_clientside.runout.figure(surface.exact, template);
+        }
+    }
+});
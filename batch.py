@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - multi-section batch runner
+
+Runs the run-out calculation over many surveyed cross-sections across all
+cores and streams the results out as sections finish.
+
+Input is either a single long-format CSV/TSV file with columns
+
+    section_id, part, x, y
+
+where part is 'slope' or 'failure', or a directory of CSV/TSV files, one
+section per file (section id = file name, section_id column optional).
+Optional columns standoff, swell_factor, bund_height, runout_angle,
+direction and project override the command line defaults for a section,
+and chainage is passed through to the results; the first non-blank value
+in a section is used.
+
+Output is CSV, or Parquet when the output path ends in .parquet. Parquet
+output is a directory of part files, one per chunk of finished sections,
+so a crash part way through keeps the completed ones. With --store the
+results, failure and catch polygons included, are also added to a results
+store (see results.py) for pit-wide queries.
+
+Usage:
+    python batch.py sections.csv -o results.csv
+    python batch.py sections/ -o results.parquet --workers 8 --bund-height 3
+    python batch.py sections.csv -o results.csv --store pit-results/
+
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import results
+import runout
+
+# Per-section parameters that can be given as columns, with their types
+PARAMETERS = {
+    'standoff': float,
+    'swell_factor': float,
+    'bund_height': float,
+    'runout_angle': float,
+    'direction': str,
+    'project': str,
+    'chainage': float,
+}
+
+# Columns of the result file
+RESULT_FIELDS = ['section_id', 'chainage', 'status', 'standoff', 'swell_factor', 'bund_height', 'runout_angle', 'direction', 'project',
+                 'failure_volume', 'swelled_volume', 'catch_capacity', 'margin', 'ix', 'iy',
+                 'simplify_error', 'profile_ok', 'failure_ok', 'volume_ok', 'catch_ok', 'errors']
+
+# Rows of a delimited text file as dicts, delimiter sniffed from the header
+def read_rows(path):
+    with open(path, newline='') as f:
+        header = f.readline()
+        f.seek(0)
+        delimiter = '\t' if '\t' in header else ','
+        for row in csv.DictReader(f, delimiter=delimiter):
+            yield {k.strip().lower(): (v or '').strip() for k, v in row.items() if k is not None}
+
+# Group long-format rows into sections, keeping the order they first appear in
+def rows_to_sections(rows, default_id=None):
+    sections = {}
+    for row in rows:
+        section_id = row.get('section_id') or default_id
+        section = sections.setdefault(section_id, {'section_id': section_id, 'slope': ([], []), 'failure': ([], []), 'parameters': {}})
+
+        # Bad rows are recorded against their section rather than stopping the batch
+        try:
+            part = row.get('part', '').lower()
+            if part not in ('slope', 'failure'):
+                raise ValueError("part must be 'slope' or 'failure', not '{0}'".format(part))
+            xs, ys = section[part]
+            xs.append(round(float(row['x']), 1))
+            ys.append(round(float(row['y']), 1))
+
+            for name, kind in PARAMETERS.items():
+                if row.get(name) and name not in section['parameters']:
+                    section['parameters'][name] = kind(row[name])
+        except (ValueError, KeyError) as e:
+            section.setdefault('error', '{0}: {1}'.format(type(e).__name__, e))
+    return list(sections.values())
+
+# Sections from a long-format file or a directory of section files
+def read_sections(path):
+    if not os.path.isdir(path):
+        return rows_to_sections(read_rows(path))
+
+    sections = []
+    for name in sorted(os.listdir(path)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in ('.csv', '.tsv', '.txt'):
+            sections.extend(rows_to_sections(read_rows(os.path.join(path, name)), default_id=stem))
+    return sections
+
+# Run one section and flatten its result into an output row. Runs in a
+# worker process, so every error is captured in the row.
+def run_section(section, defaults, engine=None, tolerance=None, simplify_method='dp'):
+    return section_result(section, defaults, engine, tolerance, simplify_method)[0]
+
+# As run_section, with the store fields of the result (see store_fields)
+def run_stored_section(section, defaults, engine=None, tolerance=None, simplify_method='dp'):
+    row, res = section_result(section, defaults, engine, tolerance, simplify_method)
+    return row, store_fields(section, defaults, res, tolerance, simplify_method)
+
+# Inputs hash and polygons of a section's result for a results store, kept
+# out of the output row (None if the section couldn't be read)
+def store_fields(section, defaults, res, tolerance=None, simplify_method='dp'):
+    if 'error' in section:
+        return None
+    parameters = dict(defaults, **section['parameters'])
+    try:
+        sp_x, sp_y = section['slope']
+        fs_x, fs_y = section['failure']
+        key = results.section_key(sp_x, sp_y, fs_x, fs_y, parameters, [section['section_id'], parameters.get('chainage'), tolerance, simplify_method if tolerance else None])
+    except Exception:
+        return None
+    return dict(key=key, **results.result_shapes(res)) if res is not None else {'key': key}
+
+# Output row and RunoutResult of one section (None if it couldn't be run)
+def section_result(section, defaults, engine=None, tolerance=None, simplify_method='dp'):
+    parameters = dict(defaults, **section['parameters'])
+    row = {'section_id': section['section_id']}
+    row.update(parameters)
+    if 'error' in section:
+        row.update(status='error', errors=section['error'])
+        return row, None
+    try:
+        sp_x, sp_y = section['slope']
+        fs_x, fs_y = section['failure']
+        right = parameters['direction'] == 'right'
+        res = runout.compute_section(parameters['standoff'], parameters['swell_factor'], parameters['bund_height'], parameters['runout_angle'],
+                                     sp_x, sp_y, fs_x or None, fs_y or None, right, parameters['project'], engine, tolerance, simplify_method)
+    except Exception as e:
+        row.update(status='error', errors='{0}: {1}'.format(type(e).__name__, e))
+        return row, None
+
+    row.update(failure_volume=res.failure_volume, swelled_volume=res.swelled_volume, catch_capacity=res.catch_capacity,
+               margin=res.margin, ix=res.ix, iy=res.iy, simplify_error=res.simplify_error,
+               profile_ok=res.profile_ok, failure_ok=res.failure_ok, volume_ok=res.volume_ok, catch_ok=res.catch_ok,
+               errors='; '.join(res.errors), status='ok' if not res.errors else 'warning')
+    return row, res
+
+# Writes result rows to CSV as they arrive
+class CSVWriter:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, row, stored=None):
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+# Writes result rows to a directory of Parquet part files, one per chunk
+class ParquetWriter:
+    def __init__(self, path, chunk=100):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit('Parquet output needs pyarrow (pip install pyarrow)')
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.path, self.chunk = path, chunk
+
+        # Fixed schema so every part file has the same column types
+        kinds = {'section_id': pyarrow.string(), 'status': pyarrow.string(), 'direction': pyarrow.string(),
+                 'project': pyarrow.string(), 'errors': pyarrow.string(), 'profile_ok': pyarrow.bool_(),
+                 'failure_ok': pyarrow.bool_(), 'volume_ok': pyarrow.bool_(), 'catch_ok': pyarrow.bool_()}
+        self.schema = pyarrow.schema([(k, kinds.get(k, pyarrow.float64())) for k in RESULT_FIELDS])
+        self.rows, self.part = [], 0
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, row, stored=None):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        table = self.pa.Table.from_pylist([{k: row.get(k) for k in RESULT_FIELDS} for row in self.rows], schema=self.schema)
+        self.pq.write_table(table, os.path.join(self.path, 'part-{0:05d}.parquet'.format(self.part)))
+        self.rows, self.part = [], self.part+1
+
+    def close(self):
+        self.flush()
+
+# Adds result rows with their store fields to a results store in chunks,
+# passing the rows on to another writer. Rows without store fields (sections
+# that couldn't be read) are left out of the store.
+class StoreWriter:
+    def __init__(self, path, writer, chunk=500):
+        self.store = results.ResultStore(path)
+        self.writer, self.chunk = writer, chunk
+        self.rows = []
+        self.added = 0
+
+    def write(self, row, stored=None):
+        self.writer.write(row)
+        if stored:
+            self.rows.append(results.row_record(dict(row, **stored)))
+        if len(self.rows) >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        self.added += self.store.append(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+# Run all sections over a process pool, writing each result as it finishes
+# (with its store fields, only for a StoreWriter). Returns the number of sections with status ok, warning and error.
+def run_batch(sections, writer, defaults, workers=None, engine=None, progress=True, tolerance=None, simplify_method='dp'):
+    counts = {'ok': 0, 'warning': 0, 'error': 0}
+    start = time.time()
+
+    # Store fields cost a hash and the polygons per section, so they are only
+    # worked out (and sent back from the workers) for a results store
+    stored = isinstance(writer, StoreWriter)
+    run = run_stored_section if stored else run_section
+
+    def report(i, result):
+        row, fields = result if stored else (result, None)
+        counts[row['status']] += 1
+        writer.write(row, fields)
+        if progress:
+            message = ' ({0})'.format(row['errors']) if row.get('errors') else ''
+            print('[{0}/{1} {2:.1f}s] {3} {4}{5}'.format(i, len(sections), time.time()-start, row['section_id'], row['status'], message), file=sys.stderr)
+
+    # The writer is closed even if the run stops early, so rows still
+    # buffered (Parquet chunks, results store) are written
+    try:
+        if workers == 1:
+            for i, section in enumerate(sections, 1):
+                report(i, run(section, defaults, engine, tolerance, simplify_method))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(run, section, defaults, engine, tolerance, simplify_method) for section in sections]
+                try:
+                    for i, future in enumerate(as_completed(futures), 1):
+                        report(i, future.result())
+                except BaseException:
+                    # Interrupted (Ctrl-C, or a cancelled job): drop the sections not started yet
+                    for future in futures:
+                        future.cancel()
+                    raise
+    finally:
+        writer.close()
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the run-out calculator over many cross-sections.')
+    parser.add_argument('input', help='long-format CSV/TSV file or directory of section files')
+    parser.add_argument('-o', '--output', default='results.csv', help='results file (.csv or .parquet)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--engine', choices=sorted(runout.ENGINES), default=None, help='geometry engine (default: {0})'.format(runout.ENGINE))
+    parser.add_argument('--standoff', type=float, default=18)
+    parser.add_argument('--swell-factor', type=float, default=1.3)
+    parser.add_argument('--bund-height', type=float, default=2)
+    parser.add_argument('--runout-angle', type=float, default=37)
+    parser.add_argument('--direction', choices=['left', 'right'], default='left')
+    parser.add_argument('--project', choices=['yes', 'no'], default='yes', help='project run-out to backscarp')
+    parser.add_argument('--simplify', type=float, default=None, metavar='TOL', help='simplify dense sections first (see simplify.py)')
+    parser.add_argument('--simplify-method', choices=['dp', 'vw'], default='dp', help='Douglas-Peucker (TOL in m) or Visvalingam-Whyatt (TOL in m²)')
+    parser.add_argument('--store', default=None, metavar='PATH', help='also add the results to a results store (see results.py)')
+    parser.add_argument('--quiet', action='store_true', help='no per-section progress')
+    args = parser.parse_args(argv)
+
+    defaults = {'standoff': args.standoff, 'swell_factor': args.swell_factor, 'bund_height': args.bund_height,
+                'runout_angle': args.runout_angle, 'direction': args.direction, 'project': args.project}
+
+    sections = read_sections(args.input)
+    if args.output.lower().endswith('.parquet'):
+        writer = ParquetWriter(args.output)
+    else:
+        writer = CSVWriter(args.output)
+    if args.store:
+        writer = StoreWriter(args.store, writer)
+
+    counts = run_batch(sections, writer, defaults, args.workers, args.engine, not args.quiet, args.simplify, args.simplify_method)
+    print('{0} sections: {1} ok, {2} with warnings, {3} errors -> {4}'.format(len(sections), counts['ok'], counts['warning'], counts['error'], args.output), file=sys.stderr)
+    if args.store:
+        print('{0} new results added to {1} ({2} in all)'.format(writer.added, args.store, len(writer.store)), file=sys.stderr)
+    return 1 if counts['error'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - benchmark suite
+
+Times the calculation stages on the synthetic sections of synthetic.py
+(10 to 10k vertices, manual and parameterised, left/right, bunded/unbunded,
+with and without a backscarp):
+
+    textarea_to_list             - parsing the slope profile text
+    minimum_distance             - snapping both failure surface ends
+    <engine>.failure_geometry    - failure volume polygon and post-failure surface
+    <engine>.catch_geometry      - run-out intersection and catch capacity polygon
+    <engine>.compute_runout      - the whole calculation
+    plot_runout                  - calculation and figure, as the app does it
+
+Results are saved as JSON and can be compared against a saved baseline;
+timings slower than the baseline by more than the threshold are flagged
+and the exit status is 1. With --check, the same sections are instead run
+through both geometry engines and any disagreement is reported.
+
+Usage:
+    python benchmark.py --save baseline.json
+    python benchmark.py --baseline baseline.json --threshold 0.25
+    python benchmark.py --check
+
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import warnings
+
+import numpy as np
+
+import runout
+import synthetic
+
+# Per-call time of fn: the median (and minimum) of repeat runs, each called
+# enough times to take at least min_time
+def measure(fn, min_time=0.02, repeat=5):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(1.2*min_time/elapsed)))
+
+    times = [elapsed/number]
+    for _ in range(repeat-1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start)/number)
+    return {'median': statistics.median(times), 'min': min(times), 'number': number, 'repeat': repeat}
+
+# The timed calls of one section, as (measurement name, function)
+def stage_calls(args, engines, figure):
+    standoff, swell_factor, bund_height, runout_angle, spxy, fsxy, direction, project, manual = args[:9]
+    right = direction == 'right' and manual == 'manual'
+    sp_x, sp_y, fs_x, fs_y = runout.section_geometry(spxy, fsxy, manual, *args[9:])
+    b_x, b_y, bt_x, bt_y = runout.bund_geometry(sp_x, sp_y, standoff, bund_height, right)
+
+    calls = []
+    if manual == 'manual':
+        calls.append(('textarea_to_list', lambda: runout.textarea_to_list(spxy)))
+    calls.append(('minimum_distance', lambda: (runout.minimum_distance(fs_x[0], fs_y[0], sp_x, sp_y), runout.minimum_distance(fs_x[-1], fs_y[-1], sp_x, sp_y))))
+
+    for engine in engines:
+        failure_fn, catch_fn, profile_fn = runout.ENGINES[engine]
+        line_combined = failure_fn(sp_x, sp_y, fs_x, fs_y, project)[3]
+        calls.append((engine + '.failure_geometry', lambda f=failure_fn: f(sp_x, sp_y, fs_x, fs_y, project)))
+        calls.append((engine + '.catch_geometry', lambda f=catch_fn, l=line_combined: f(l, b_x, b_y, bt_x, bt_y, bund_height, runout_angle, right)))
+        calls.append((engine + '.compute_runout', lambda e=engine: runout.compute_runout(*args, engine=e)))
+
+    if figure:
+        from app import plot_runout
+        calls.append(('plot_runout', lambda: plot_runout(*args)))
+    return calls
+
+# Time every stage of every synthetic section. Returns {name: timing}, with
+# names '<section>/<measurement>'.
+def run_benchmarks(sizes, engines, figure=True, min_time=0.02, repeat=5, progress=True):
+    results = {}
+    for name, n, args in synthetic.corpus(sizes):
+        for stage, fn in stage_calls(args, engines, figure):
+            key = '{0}/{1}'.format(name, stage)
+            results[key] = dict(measure(fn, min_time, repeat), vertices=n)
+            if progress:
+                print('{0:70s} {1:12.1f} us'.format(key, 1e6*results[key]['median']), file=sys.stderr)
+    return results
+
+# Timings slower than the baseline by more than threshold (as a fraction),
+# as (name, baseline, current, ratio)
+def regressions(results, baseline, threshold):
+    slower = []
+    for key, timing in results.items():
+        if key in baseline:
+            ratio = timing['median']/baseline[key]['median']
+            if ratio > 1 + threshold:
+                slower.append((key, baseline[key]['median'], timing['median'], ratio))
+    return slower
+
+# Run every synthetic section through both engines (runout.compare_engines)
+# and return the mismatches as (section, differing results)
+def check_engines(sizes, tol=1e-6):
+    mismatches = []
+    for name, n, args in synthetic.corpus(sizes):
+        differ = runout.compare_engines(*args, tol=tol)
+        if differ:
+            mismatches.append((name, differ))
+    return mismatches
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the run-out calculation stages on synthetic sections.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=synthetic.SIZES, help='profile sizes (vertices)')
+    parser.add_argument('--engines', nargs='+', choices=sorted(runout.ENGINES), default=None, help='geometry engines (default: all available)')
+    parser.add_argument('--no-figure', action='store_true', help="skip plot_runout (doesn't import the app)")
+    parser.add_argument('--min-time', type=float, default=0.02, help='minimum time of each timing run (s)')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs per measurement')
+    parser.add_argument('--save', default=None, help='save results as JSON')
+    parser.add_argument('--baseline', default=None, help='compare against a saved JSON result')
+    parser.add_argument('--threshold', type=float, default=0.25, help='flag timings slower than the baseline by more than this fraction')
+    parser.add_argument('--check', action='store_true', help='compare the engines on the synthetic sections instead of timing them')
+    parser.add_argument('--quiet', action='store_true', help='no per-measurement progress')
+    args = parser.parse_args(argv)
+
+    engines = args.engines or [e for e in sorted(runout.ENGINES) if e != 'shapely' or runout.SHAPELY]
+
+    # Only shapely's deprecation warnings (1.8, ahead of the 2.0 API) are
+    # silenced; anything else raised by the geometry being timed is shown
+    if runout.SHAPELY:
+        from shapely.errors import ShapelyDeprecationWarning
+        warnings.filterwarnings('ignore', category=ShapelyDeprecationWarning)
+
+    if args.check:
+        if not runout.SHAPELY:
+            parser.error('--check needs shapely to compare the engines')
+        mismatches = check_engines(args.sizes)
+        for name, differ in mismatches:
+            print('{0}: engines differ in {1}'.format(name, ', '.join(differ)))
+        print('{0} mismatches between the shapely and numpy engines'.format(len(mismatches)), file=sys.stderr)
+        return 1 if mismatches else 0
+
+    results = run_benchmarks(args.sizes, engines, not args.no_figure, args.min_time, args.repeat, not args.quiet)
+    if args.save:
+        meta = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'numpy': np.__version__,
+                'platform': platform.platform(), 'processor': platform.processor(), 'engines': engines}
+        with open(args.save, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        slower = regressions(results, baseline, args.threshold)
+        for key, before, after, ratio in slower:
+            print('REGRESSION {0}: {1:.1f} us -> {2:.1f} us ({3:+.0%})'.format(key, 1e6*before, 1e6*after, ratio-1))
+        compared = len(set(results) & set(baseline))
+        print('{0} of {1} timings more than {2:.0%} slower than the baseline'.format(len(slower), compared, args.threshold), file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
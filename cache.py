@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - result cache
+
+Bounded, least recently used cache of run-out figures in front of the
+Update Graph callback. Results are keyed on a canonical hash of the 16
+inputs: co-ordinates are parsed and rounded as textarea_to_list does,
+numbers are compared as floats and inputs the selected mode ignores are
+dropped, so re-clicking, reformatting a pasted profile or toggling back to
+an earlier design all hit the cache.
+
+Backends:
+    memory - per process (default)
+    sqlite - a SQLite file shared by every gunicorn worker on the host
+
+Set RUNOUT_CACHE to 'memory' or the path of a SQLite file, and
+RUNOUT_CACHE_SIZE to the number of results kept (default 256, 0 disables).
+
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from runout import textarea_to_list, HANDLE_PREFIX
+
+# Bumped whenever the cached figures change, so a shared cache file left
+# over from an older version isn't served
+CACHE_VERSION = 1
+
+# Number as a float, anything else (None, text) as is
+def number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+# Co-ordinate text as a list of rounded (x, y) values, or None if it can't be
+# read (which the calculation treats the same as no co-ordinates). An
+# uploaded profile is keyed on its content hash.
+def coordinates(textarea_string):
+    if isinstance(textarea_string, str) and textarea_string.startswith(HANDLE_PREFIX):
+        return textarea_string.split()[0]
+    try:
+        return textarea_to_list(textarea_string)
+    except Exception:
+        return None
+
+# Canonical form of the 16 run-out inputs, with only the inputs the selected
+# mode uses
+def canonical_inputs(standoff, swell_factor, bund_height, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist):
+    inputs = [number(standoff), number(swell_factor), number(bund_height), number(runout_angle), project, manual]
+    if manual == 'manual':
+        return inputs + [coordinates(spxy), coordinates(fsxy), direction]
+    return inputs + [number(slopeheight), number(slopeangle), number(crestwidth), number(failureheight), number(failureangle), bkp, number(backscarpdist)]
+
+# Cache key of a set of run-out inputs; extra values (e.g. the engine) are hashed in too
+def input_key(*args, extra=()):
+    key = json.dumps([CACHE_VERSION, canonical_inputs(*args), list(extra)])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+# Per-process LRU cache of strings
+class MemoryCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def stats(self):
+        return {'backend': 'memory', 'size': len(self.items), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+# LRU cache of strings in a SQLite file, shared by every process that opens
+# it. Counters are kept in the file too, so they cover all workers. The
+# connection is opened on first use, so the cache can be created before
+# gunicorn forks its workers.
+class SQLiteCache:
+    def __init__(self, path, maxsize=256):
+        self.path, self.maxsize = path, maxsize
+        self.connection = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.connection is None or self.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, used REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+            connection.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+            connection.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+            self.connection, self.pid = connection, os.getpid()
+        return self.connection
+
+    # A busy or broken cache file is treated as a miss rather than an error
+    def get(self, key):
+        with self.lock:
+            try:
+                db = self.connect()
+                row = db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    db.execute("UPDATE counters SET value = value + 1 WHERE name = 'misses'")
+                    return None
+                db.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+                db.execute("UPDATE counters SET value = value + 1 WHERE name = 'hits'")
+                return row[0]
+            except sqlite3.Error:
+                return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            try:
+                db = self.connect()
+                db.execute('BEGIN IMMEDIATE')
+                try:
+                    db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)', (key, value, time.time()))
+                    db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.maxsize,))
+                    db.execute('COMMIT')
+                except sqlite3.Error:
+                    db.execute('ROLLBACK')
+                    raise
+            except sqlite3.Error:
+                pass
+
+    # As for get, counts that can't be read are left as None
+    def stats(self):
+        counters, size = {}, None
+        with self.lock:
+            try:
+                db = self.connect()
+                counters = dict(db.execute('SELECT name, value FROM counters'))
+                size = db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+            except sqlite3.Error:
+                pass
+        return {'backend': 'sqlite', 'path': self.path, 'size': size, 'maxsize': self.maxsize, 'hits': counters.get('hits'), 'misses': counters.get('misses')}
+
+# Cache selected by RUNOUT_CACHE / RUNOUT_CACHE_SIZE (or the given values)
+def open_cache(backend=None, maxsize=None):
+    backend = backend or os.environ.get('RUNOUT_CACHE', 'memory')
+    maxsize = int(os.environ.get('RUNOUT_CACHE_SIZE', 256)) if maxsize is None else maxsize
+    if backend == 'memory':
+        return MemoryCache(maxsize)
+    return SQLiteCache(backend, maxsize)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - multi-bench cascade
+
+For a failure on a benched wall: the swelled failure volume lands on the
+first berm below the failure, fills it up to the run-out line cast from the
+berm crest (or the crest of a windrow on it), and whatever doesn't fit
+overflows down the face onto the next berm, and so on down to the toe bund
+on the pit floor. The result is the lowest level reached and the residual
+volume past the toe bund, if any.
+
+Berms are runs of profile segments flatter than max_angle and at least
+min_width wide; the berm crest is the outer (downslope) end of the run.
+
+The surface is updated incrementally: once a berm is full, its run-out line
+becomes the surface the next berm's run-out line is cast onto. Each berm's
+catch is worked out on a window of the profile from its crest up to the top
+of the fill above, so every step only touches the nodes of one bench. Only
+a run-out line that clears the fill above (a bench face flatter than the
+run-out angle) falls back to the whole surface above.
+
+The numpy geometry engine is used throughout.
+
+"""
+from dataclasses import dataclass, field
+
+import numpy as np
+
+import geometry
+from geometry import ProfileIndex
+from curves import curved_surface
+from runout import bund_geometry, textarea_to_list, parameterised_geometry
+
+# Berm detection: steepest segment (degrees) and narrowest berm (m)
+BERM_ANGLE = 15
+MIN_BERM_WIDTH = 2
+
+# One level of the cascade: a berm, or the pit floor with the toe bund
+@dataclass
+class CascadeLevel:
+    name: str
+    crest_x: float
+    crest_y: float
+
+    # Windrow (or toe bund) outline, catch capacity polygon and run-out intersection
+    b_x: list = None
+    b_y: list = None
+    cc_x: np.ndarray = None
+    cc_y: np.ndarray = None
+    ix: float = None
+    iy: float = None
+
+    # Catch capacity, and the volume arriving, kept and passed on (m³/m)
+    capacity: float = None
+    inflow: float = 0.0
+    retained: float = 0.0
+    overflow: float = 0.0
+
+# Result of a cascade. Levels are in the order the volume reaches them, down
+# to the lowest level reached.
+@dataclass
+class CascadeResult:
+    sp_x: list = None
+    sp_y: list = None
+    fs_x: list = None
+    fs_y: list = None
+
+    # Toe bund on the pit floor
+    b_x: list = None
+    b_y: list = None
+    bt_x: float = None
+    bt_y: float = None
+
+    fv_x: np.ndarray = None
+    fv_y: np.ndarray = None
+    failure_volume: float = None
+    swelled_volume: float = None
+
+    levels: list = field(default_factory=list)
+    residual: float = None
+
+    profile_ok: bool = False
+    failure_ok: bool = False
+    volume_ok: bool = False
+    errors: list = field(default_factory=list)
+
+    # Lowest level reached, None if the cascade couldn't be worked out
+    @property
+    def lowest(self):
+        return self.levels[-1] if self.levels else None
+
+    @property
+    def contained(self):
+        return self.residual is not None and self.residual <= 0
+
+# Berms of a profile as (crest node, inner end node), in profile order. A
+# flat run at the start of the profile is the pit floor, not a berm.
+def find_benches(px, py, max_angle=BERM_ANGLE, min_width=MIN_BERM_WIDTH):
+    px, py = np.asarray(px, dtype=float), np.asarray(py, dtype=float)
+    dx, dy = np.abs(np.diff(px)), np.abs(np.diff(py))
+    flat = np.degrees(np.arctan2(dy, dx)) < max_angle
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], flat.astype(np.int8), [0]])))
+    return [(int(s), int(e)) for s, e in zip(edges[::2], edges[1::2]) if s > 0 and abs(px[e]-px[s]) >= min_width]
+
+# Cascade for one section given as co-ordinate lists
+def cascade_section(standoff, swell_factor, bund_height, runout_angle, sp_x, sp_y, fs_x, fs_y, right, project, windrow_height=0.0,
+                    max_angle=BERM_ANGLE, min_width=MIN_BERM_WIDTH):
+    res = CascadeResult()
+
+    try:
+        res.b_x, res.b_y, res.bt_x, res.bt_y = bund_geometry(sp_x, sp_y, standoff, bund_height, right)
+        res.sp_x, res.sp_y = sp_x, sp_y
+        res.profile_ok = True
+    except Exception:
+        res.errors.append('No slope profile entered')
+        return res
+
+    if fs_x is None:
+        res.errors.append('No failure surface entered')
+        return res
+    res.fs_x, res.fs_y = fs_x, fs_y
+    res.failure_ok = True
+
+    try:
+        res.fv_x, res.fv_y, res.failure_volume, surface = geometry.failure_geometry(sp_x, sp_y, fs_x, fs_y, project)
+        res.swelled_volume = res.failure_volume*swell_factor
+        res.volume_ok = True
+    except Exception:
+        res.errors.append('Intersection error')
+        return res
+
+    # Berms below the toe of the failure, highest first, then the pit floor
+    px, py = (np.asarray(v, dtype=float) for v in surface)
+    toe = geometry.nearest_node(fs_x[0], fs_y[0], px, py)
+    berms = [b for b in find_benches(px, py, max_angle, min_width) if b[0] < toe][::-1] + [None]
+
+    volume = res.swelled_volume
+    above = None            # (crest node, fill points) of the berm filled last
+    chunks = []             # surface above that fill, lowest chunk first
+    for berm in berms:
+        if berm is None:
+            level = CascadeLevel('Toe bund', float(px[0]), float(py[0]), res.b_x, res.b_y)
+            c = start = 0
+            height, bt_x, bt_y = bund_height, res.bt_x, res.bt_y
+        else:
+            c, end = berm
+            height = windrow_height
+            b_x, b_y, bt_x, bt_y = bund_geometry(px[c:c+1], py[c:c+1], 0, windrow_height, right)
+            level = CascadeLevel('Bench RL {0:.1f}'.format(py[c]), float(px[c]), float(py[c]), b_x, b_y)
+
+            # The run-out line starts at the crest (or the windrow on it), so
+            # the catch starts on the berm behind it, like the pit floor
+            # behind the toe bund
+            start = c + 1 + int(np.count_nonzero(np.abs(px[c+1:end+1] - px[c]) <= abs(b_x[-1] - b_x[0])))
+        level.inflow = volume
+        res.levels.append(level)
+
+        # Window from behind this crest up to the top of the fill above
+        if above is None:
+            wx, wy = px[start:], py[start:]
+        else:
+            wx = np.concatenate([px[start:above[0]+1], above[1][0]])
+            wy = np.concatenate([py[start:above[0]+1], above[1][1]])
+        try:
+            try:
+                cc_x, cc_y, area, ix, iy = geometry.catch_geometry(ProfileIndex(wx, wy), level.b_x, level.b_y, bt_x, bt_y, height, runout_angle, right)
+            except ValueError:
+                if not chunks:
+                    raise
+                wx, wy = np.concatenate([wx] + [x for x, y in chunks]), np.concatenate([wy] + [y for x, y in chunks])
+                chunks = []
+                cc_x, cc_y, area, ix, iy = geometry.catch_geometry(ProfileIndex(wx, wy), level.b_x, level.b_y, bt_x, bt_y, height, runout_angle, right)
+        except ValueError:
+            res.errors.append('Catch capacity error ({0})'.format(level.name))
+            return res
+        level.cc_x, level.cc_y, level.capacity, level.ix, level.iy = cc_x, cc_y, area, ix, iy
+
+        level.retained = min(volume, area)
+        level.overflow = volume - level.retained
+        volume = level.overflow
+        if volume <= 0:
+            break
+
+        # The full berm's run-out line is now the surface: windrow crest (if
+        # any) to the intersection, then the rest of the window above it
+        k = hit_segment(wx, wy, ix, iy)
+        fill = ([bt_x, ix], [bt_y, iy]) if height > 0 else ([ix], [iy])
+        chunks.insert(0, (wx[k+1:], wy[k+1:]))
+        above = (c, (np.array(fill[0]), np.array(fill[1])))
+
+    res.residual = volume
+    return res
+
+# Segment of a window the run-out intersection lies on
+def hit_segment(wx, wy, ix, iy):
+    ex, ey = np.diff(wx), np.diff(wy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = ((ix-wx[:-1])*ex + (iy-wy[:-1])*ey)/(ex*ex + ey*ey)
+    t = np.clip(np.nan_to_num(t), 0, 1)
+    return int(np.argmin(np.hypot(wx[:-1] + t*ex - ix, wy[:-1] + t*ey - iy)))
+
+# Cascade from the app inputs (see runout.compute_runout)
+def cascade_runout(standoff, swell_factor, bund_height, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, windrow_height=0.0, curve=None):
+    right = direction == 'right' and manual == 'manual'
+    fs_x = fs_y = None
+    try:
+        if manual == 'manual':
+            sp_x, sp_y = textarea_to_list(spxy)
+        else:
+            sp_x, sp_y, fs_x, fs_y = parameterised_geometry(slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist)
+    except Exception:
+        res = CascadeResult()
+        res.errors.append('No slope profile entered')
+        return res
+
+    if manual == 'manual':
+        try:
+            fs_x, fs_y = textarea_to_list(fsxy)
+        except Exception:
+            pass
+
+    # As in compute_runout, a curve that doesn't fit leaves no failure surface
+    curve_error = None
+    if curve is not None and manual != 'manual':
+        try:
+            fs_x, fs_y = curved_surface(curve, fs_x, fs_y)
+        except ValueError as e:
+            fs_x = fs_y = None
+            curve_error = str(e)
+
+    res = cascade_section(standoff, swell_factor, bund_height, runout_angle, sp_x, sp_y, fs_x, fs_y, right, project, windrow_height)
+    if curve_error:
+        res.errors.insert(0, curve_error)
+    return res
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - curved failure surfaces
+
+Circular and log-spiral slip surfaces for the parameterised geometry. The
+planar basal structure (from the daylighting point on the face to where it
+meets the crest or the tension crack) is kept as the chord, and the curve
+is hung below it to the given depth:
+
+    circular  - an arc through both ends
+    logspiral - r = r0 exp(-tan(spiral angle) theta) through both ends, its
+                radius growing from the crest down to the toe, so it is
+                steepest under the crest; a spiral angle of 0 is the arc
+
+The curve is cut into as few straight segments as keep the area lost
+between it and the segments within the tolerance (m²/m). Segment ends are
+spaced so each segment loses about the same area (closer where the curve
+is tighter, as the area cut off goes with curvature times length cubed),
+and the smallest count that meets the tolerance is used. The area lost by
+each segment is exact (sector less triangle), so the failure volume is
+within the tolerance of the true curve's.
+
+"""
+import cmath
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+# Shapes of failure surface, with the labels used in the app
+SHAPES = {'planar': 'Planar', 'circular': 'Circular', 'logspiral': 'Log-spiral'}
+
+# Default area tolerance (m²/m) and the most segments a curve is cut into
+TOLERANCE = 0.1
+MAX_SEGMENTS = 4096
+
+# Curved failure surface: shape, depth below the chord (m), spiral angle
+# (degrees, log-spiral only) and area tolerance (m²/m)
+@dataclass(frozen=True)
+class FailureCurve:
+    shape: str
+    depth: float
+    spiral_angle: float = 0.0
+    tolerance: float = TOLERANCE
+
+    # Exponent of the spiral: r = r0 exp(rate theta)
+    @property
+    def rate(self):
+        if self.shape == 'logspiral':
+            return -math.tan(math.radians(self.spiral_angle))
+        return 0.0
+
+# Curve of the given shape, or None for a planar surface (or no depth)
+def failure_curve(shape, depth, spiral_angle=0.0, tolerance=TOLERANCE):
+    if shape in (None, 'planar') or not depth:
+        return None
+    if shape not in SHAPES:
+        raise ValueError('Unknown failure surface shape {0}'.format(shape))
+    if depth < 0 or tolerance is None or tolerance <= 0:
+        raise ValueError('Failure depth and tolerance must be positive')
+    if shape == 'logspiral' and not 0 <= spiral_angle < 80:
+        raise ValueError('Spiral angle must be between 0 and 80 degrees')
+    return FailureCurve(shape, float(depth), float(spiral_angle or 0.0), float(tolerance))
+
+# Spiral (or arc) turning counter-clockwise by sweep from p1 to p2, as
+# complex numbers: its centre, and the radius and angle at p1
+def spiral_through(p1, p2, sweep, rate):
+    centre = p1 - (p2-p1)/(math.exp(rate*sweep)*cmath.exp(1j*sweep) - 1)
+    return centre, abs(p1-centre), cmath.phase(p1-centre)
+
+# Points of a spiral at the angles theta (from its angle at p1)
+def spiral_points(centre, r1, theta1, rate, theta):
+    return centre + r1*np.exp(rate*theta)*np.exp(1j*(theta1+theta))
+
+# Greatest depth of the spiral below the chord from p1 to p2: at the ends
+# or where its tangent is parallel to the chord
+def spiral_depth(p1, p2, sweep, rate):
+    centre, r1, theta1 = spiral_through(p1, p2, sweep, rate)
+    chord = (p2-p1)/abs(p2-p1)
+    parallel = (cmath.phase(chord) - theta1 - math.pi/2 + math.atan(rate)) % (2*math.pi)
+    theta = np.array([0.0, sweep, min(parallel, sweep)])
+    return float(np.max(-((spiral_points(centre, r1, theta1, rate, theta) - p1)/chord).imag))
+
+# Sweep of the spiral from p1 to p2 that hangs depth below the chord (by
+# bisection; depth grows with the sweep, up to half a turn)
+def spiral_sweep(p1, p2, depth, rate, iterations=60):
+    low, high = 0.0, math.pi
+    if spiral_depth(p1, p2, high, rate) < depth:
+        raise ValueError('Failure depth too large for the failure surface')
+    for i in range(iterations):
+        middle = 0.5*(low+high)
+        if spiral_depth(p1, p2, middle, rate) < depth:
+            low = middle
+        else:
+            high = middle
+    return 0.5*(low+high)
+
+# Area between the spiral and the chord of each segment between the angles
+# theta (sector less triangle)
+def segment_areas(r1, rate, theta):
+    a, b = theta[:-1], theta[1:]
+    if rate == 0:
+        sector = 0.5*r1**2*(b-a)
+    else:
+        sector = r1**2/(4*rate)*(np.exp(2*rate*b) - np.exp(2*rate*a))
+    triangle = 0.5*r1**2*np.exp(rate*(a+b))*np.sin(b-a)
+    return sector - triangle
+
+# n+1 angles from 0 to sweep spaced evenly in the integral of r^(2/3),
+# which gives each segment about the same lost area
+def segment_angles(sweep, rate, n):
+    u = np.linspace(0.0, 1.0, n+1)
+    if rate == 0:
+        return sweep*u
+    g = 2*rate/3
+    return np.log1p(u*np.expm1(g*sweep))/g
+
+# Fewest segment angles that lose no more than tolerance in all
+def fewest_angles(r1, rate, sweep, tolerance):
+    lost = lambda n: segment_areas(r1, rate, segment_angles(sweep, rate, n)).sum()
+    high = 1
+    while lost(high) > tolerance:
+        if high >= MAX_SEGMENTS:
+            raise ValueError('Curve tolerance too small')
+        high = min(2*high, MAX_SEGMENTS)
+    low = high//2
+    while high - low > 1:
+        middle = (low+high)//2
+        if lost(middle) > tolerance:
+            low = middle
+        else:
+            high = middle
+    return segment_angles(sweep, rate, high)
+
+# Vertices of the curve from p1 to p2 ((x, y) pairs), hung below the chord
+# as it runs from p1 to p2 (to its right). Returns x, y lists with both ends
+# exactly as given, and the area lost to the segments (m²/m).
+def curve_vertices(curve, p1, p2):
+    z1, z2 = complex(*p1), complex(*p2)
+    sweep = spiral_sweep(z1, z2, curve.depth, curve.rate)
+    centre, r1, theta1 = spiral_through(z1, z2, sweep, curve.rate)
+    theta = fewest_angles(r1, curve.rate, sweep, curve.tolerance)
+
+    points = spiral_points(centre, r1, theta1, curve.rate, theta)
+    x, y = points.real.tolist(), points.imag.tolist()
+    x[0], y[0], x[-1], y[-1] = p1[0], p1[1], p2[0], p2[1]
+    return x, y, float(segment_areas(r1, curve.rate, theta).sum())
+
+# Failure surface with its first segment (the basal structure from the
+# daylighting point) replaced by the curve
+def curved_surface(curve, fs_x, fs_y):
+    x, y, lost = curve_vertices(curve, (fs_x[0], fs_y[0]), (fs_x[1], fs_y[1]))
+    return x + list(fs_x[2:]), y + list(fs_y[2:])
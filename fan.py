@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - run-out angle fan
+
+Catch capacity over a range of run-out angles for one section, standoff and
+bund height. The run-out angle is the least certain input, so the app shows
+capacity against angle next to the section, with the critical angle (where
+the capacity equals the swelled failure volume) marked.
+
+The geometry is parsed and the failure polygon is built once. Every angle
+is then cast from the bund crest onto the same profile index with
+geometry.catch_capacity_fan, so no run-out line or catch polygon is built
+per angle.
+
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+import geometry
+from runout import section_geometry, bund_geometry
+
+# Default fan: 25 to 45 degrees in 0.5 degree steps
+FAN_ANGLES = (25, 45, 0.5)
+
+# Result of a run-out angle fan. capacity, ix and iy have one entry per
+# angle and are NaN where the run-out line misses the profile.
+@dataclass
+class FanResult:
+    runout_angles: np.ndarray
+    capacity: np.ndarray
+    ix: np.ndarray
+    iy: np.ndarray
+    failure_volume: float
+    swelled_volume: float
+    critical_angle: float
+
+    # Section, failure polygon and bund the fan is cast from
+    sp_x: list
+    sp_y: list
+    fs_x: list
+    fs_y: list
+    fv_x: np.ndarray
+    fv_y: np.ndarray
+    b_x: list
+    b_y: list
+    bt_x: float
+    bt_y: float
+
+    # Spare catch capacity per angle (m³/m)
+    @property
+    def margin(self):
+        return self.capacity - self.swelled_volume
+
+# Run-out angles from first to last in steps, both ends included
+def fan_angles(first=FAN_ANGLES[0], last=FAN_ANGLES[1], step=FAN_ANGLES[2]):
+    count = int(round((last-first)/step)) + 1
+    return first + step*np.arange(max(count, 1))
+
+# Critical run-out angle: where the capacity rises to the swelled volume
+# above the steepest angle of the fan that overtops, interpolated between
+# angles. Flatter run-out lines catch less, so the bund overtops below it.
+# None if the fan doesn't cross the volume (or the volume is unknown).
+def critical_angle(runout_angles, capacity, swelled_volume):
+    margin = np.asarray(capacity, dtype=float) - swelled_volume
+    valid = ~np.isnan(margin)
+    angles, margin = np.asarray(runout_angles, dtype=float)[valid], margin[valid]
+    below = np.flatnonzero(margin < 0)
+    if not len(below) or below[-1] == len(margin)-1:
+        return None
+    i = below[-1]
+    return float(angles[i] + (angles[i+1]-angles[i])*margin[i]/(margin[i]-margin[i+1]))
+
+# Fan of run-out angles over one geometry, with the plot_runout parameters
+# (curve as for runout.compute_runout)
+def fan_runout(standoff, swell_factor, bund_height, runout_angles, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, curve=None):
+    runout_angles = np.atleast_1d(np.asarray(runout_angles, dtype=float))
+    right = direction == 'right' and manual == 'manual'
+
+    sp_x, sp_y, fs_x, fs_y = section_geometry(spxy, fsxy, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, curve)
+    b_x, b_y, bt_x, bt_y = bund_geometry(sp_x, sp_y, standoff, bund_height, right)
+
+    # Failure volume is the same for every angle
+    try:
+        fv_x, fv_y, failure_volume, line_combined = geometry.failure_geometry(sp_x, sp_y, fs_x, fs_y, project)
+    except ValueError:
+        fv_x = fv_y = None
+        failure_volume, line_combined = np.nan, geometry.profile_line(sp_x, sp_y)
+    swelled_volume = failure_volume*swell_factor
+
+    capacity, ix, iy = geometry.catch_capacity_fan(line_combined, b_x, b_y, bt_x, bt_y, bund_height, runout_angles, right)
+    return FanResult(runout_angles, capacity, ix, iy, failure_volume, swelled_volume, critical_angle(runout_angles, capacity, swelled_volume),
+                     sp_x, sp_y, fs_x, fs_y, fv_x, fv_y, b_x, b_y, bt_x, bt_y)
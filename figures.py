@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - run-out figure
+
+The plotly figure of a run-out result (or a bench cascade), shared by the
+app, the client-side figure template and the batch report.
+
+"""
+import plotly.graph_objects as go
+
+from cascade import CascadeResult
+
+# Colors
+bmao = '#f7923a'
+bmar = '#ee3b34'
+bmab = '#004890'
+bkgr = '#f8f5f0'
+
+# Trace styles of the run-out figure, shared by the server-side figure and
+# the template the browser builds it from (RUNOUT_RENDER=client)
+RUNOUT_TRACES = {
+    'slope': dict(mode='lines', line=dict(color='black'), opacity=1.0, marker_size=0),
+    'failure': dict(mode='lines', line=dict(color='red'), opacity=1.0, marker_size=0),
+    'bund': dict(mode='lines', line=dict(color=bmao), opacity=0.2, marker_size=0, fillcolor=bmao, fill='toself', hoverinfo='skip'),
+    'volume': dict(mode='lines', line=dict(color=bmar), opacity=0.2, marker_size=0, fillcolor=bmar, fill='toself', hoverinfo='skip'),
+    'catch': dict(mode='lines', line=dict(color=bmab), opacity=0.2, marker_size=0, fillcolor=bmab, fill='toself', hoverinfo='skip'),
+}
+
+# Title and traces of a calculated run-out result, as (style, name, x, y)
+def runout_traces(res, standoff, bund_height):
+    if isinstance(res, CascadeResult):
+        return cascade_traces(res, standoff, bund_height)
+    traces = []
+    
+    # Plot Slope profile
+    if res.profile_ok:
+        traces.append(('slope', 'Slope', res.sp_x, res.sp_y))
+    
+    # Plot Failure surface
+    if res.failure_ok:
+        traces.append(('failure', 'Failure', res.fs_x, res.fs_y))
+
+    # Plot bund if bund height is greater than 0
+    if bund_height > 0:
+        if res.profile_ok:
+            traces.append(('bund', 'Bund', res.b_x, res.b_y))
+        titletext = "{0:.1f}m Bund at {1:.0f}m Standoff".format(bund_height, standoff)
+    else:
+        titletext = "Unbunded {0:.0f}m Standoff".format(standoff)
+    if res.simplify_error is not None:
+        titletext += " (simplified, area error {0:.2f} m²/m)".format(res.simplify_error)
+    
+    # Add failed volume to plotly figure
+    if res.volume_ok:
+        traces.append(('volume', "Failure volume = {0:.1f} m³/m".format(res.swelled_volume), res.fv_x, res.fv_y))
+    
+    # Add catch capacity to plotly figure
+    if res.catch_ok:
+        traces.append(('catch', "Catch capacity = {0:.1f} m³/m".format(res.catch_capacity), res.cc_x, res.cc_y))
+    
+    return titletext, traces
+
+# Title and traces of a bench cascade (cascade.py): the catch of each level
+# reached, with the volume it kept, and the windrows on the berms
+def cascade_traces(res, standoff, bund_height):
+    traces = []
+    if res.profile_ok:
+        traces.append(('slope', 'Slope', res.sp_x, res.sp_y))
+    if res.failure_ok:
+        traces.append(('failure', 'Failure', res.fs_x, res.fs_y))
+    if res.volume_ok:
+        traces.append(('volume', "Failure volume = {0:.1f} m³/m".format(res.swelled_volume), res.fv_x, res.fv_y))
+
+    for level in res.levels:
+        if level.b_x is not None and len(level.b_x) > 1 and (level.name != 'Toe bund' or bund_height > 0):
+            traces.append(('bund', 'Bund' if level.name == 'Toe bund' else 'Windrow', level.b_x, level.b_y))
+        if level.capacity is not None:
+            name = "{0}: {1:.1f} of {2:.1f} m³/m".format(level.name, level.retained, level.capacity)
+            traces.append(('catch', name, level.cc_x, level.cc_y))
+
+    if res.errors or res.lowest is None:
+        titletext = "Bench cascade ({0})".format(', '.join(res.errors) or 'no failure volume')
+    elif res.contained:
+        titletext = "Bench cascade contained on {0}".format(res.lowest.name)
+    elif bund_height > 0:
+        titletext = "Bench cascade: {0:.1f} m³/m past {1:.1f}m Bund at {2:.0f}m Standoff".format(res.residual, bund_height, standoff)
+    else:
+        titletext = "Bench cascade: {0:.1f} m³/m past Unbunded {1:.0f}m Standoff".format(res.residual, standoff)
+    return titletext, traces
+
+# Empty run-out figure with its layout and title
+def runout_layout(titletext):
+    
+    # Initiate plotly figure
+    fig = go.Figure()
+    fig.update_layout(template='simple_white', paper_bgcolor=bkgr)
+    
+    # # plot extents
+    # fig.update_yaxes(range=[min(sp_y), max(sp_y)], fixedrange=True)
+    # fig.update_xaxes(range=[min(b_x), max(sp_x)])
+
+    fig.update_xaxes(scaleanchor = "y", scaleratio = 1)
+    fig.update_layout(font={'size':16})
+    
+    fig.update_layout(
+    title=dict(text=titletext,x=0.5,y=0.95,
+               font=dict(family="Arial",size=20,color='#000000')
+               )
+    )
+    
+    fig.update_layout(margin=dict(l=20, r=20, t=60, b=20))
+    
+    return fig
+
+# Draw a calculated run-out result as a plotly figure
+def runout_figure(res, standoff, bund_height):
+    titletext, traces = runout_traces(res, standoff, bund_height)
+    fig = runout_layout(titletext)
+    for style, name, x, y in traces:
+        fig.add_trace(go.Scatter(x=x, y=y, name=name, **RUNOUT_TRACES[style]))
+    return fig
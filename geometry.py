@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - NumPy geometry engine
+
+Array based replacement for the shapely split/linemerge/Polygon chain in
+runout.py. Profiles are handled as x, y float arrays; the failure volume and
+catch capacity are cut out of them by index slicing at the snapped nodes and
+the first hit of the run-out line (both looked up through a ProfileIndex),
+and areas come from the shoelace formula.
+
+"""
+import heapq
+import math
+
+import numpy as np
+
+from metrics import stage
+
+# Side slope of the bund (degrees)
+BUND_ANGLE = 37
+
+# Length of the run-out line cast from the bund crest (m)
+RUNOUT_LENGTH = 1000
+
+# Shoelace area of a polygon ring (open or closed)
+def shoelace_area(x, y):
+    return 0.5*abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+# Returns index of the profile node closest to the defined point
+def nearest_node(x0, y0, xl, yl):
+    return int(np.argmin((xl-x0)**2 + (yl-y0)**2))
+
+# Slope profile index, used when the failure surface can't be combined with it
+def profile_line(sp_x, sp_y):
+    return ProfileIndex(sp_x, sp_y)
+
+# Intersections of the ray (x0, y0) + t*(dx, dy), 0 <= t <= length, with each
+# segment of a polyline. Returns segment indices, ray distances t and segment
+# parameters u of every hit, in profile order.
+def ray_intersections(px, py, x0, y0, dx, dy, length):
+    ex, ey = np.diff(px), np.diff(py)
+    wx, wy = px[:-1]-x0, py[:-1]-y0
+    denom = dx*ey - dy*ex
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (wx*ey - wy*ex)/denom
+        u = (wx*dy - wy*dx)/denom
+    hit = (denom != 0) & (t >= 0) & (t <= length) & (u >= 0) & (u <= 1)
+    k = np.flatnonzero(hit)
+    return k, t[k], u[k]
+
+# Nearest-node and first ray hit lookups on one profile, built once and
+# reused across parameter evaluations. Nodes are kept sorted by x for the
+# nearest-node search, and runs of consecutive segments are boxed into a
+# bounding box hierarchy so a ray only tests the segments along its path.
+# Short profiles are scanned directly, which is quicker below a few hundred
+# segments (and a few tens of thousands of nodes for snapping). Unpacks as
+# px, py like the (2, n) profile arrays.
+class ProfileIndex:
+    # Profiles with up to this many nodes / segments are scanned directly
+    SCAN_NODES = 32768
+    SCAN_SEGMENTS = 256
+
+    # Consecutive segments per leaf box
+    LEAF_SIZE = 32
+
+    def __init__(self, x, y):
+        self.x, self.y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        self.order = self.sorted_x = self.levels = self.cross = None
+
+    def __iter__(self):
+        return iter((self.x, self.y))
+
+    def __len__(self):
+        return len(self.x)
+
+    # Index of the node closest to (x0, y0), the lowest index on ties
+    def nearest(self, x0, y0):
+        n = len(self.x)
+        if n <= self.SCAN_NODES:
+            return nearest_node(x0, y0, self.x, self.y)
+        if self.order is None:
+            self.order = np.argsort(self.x, kind='stable')
+            self.sorted_x = self.x[self.order]
+
+        # Widen a window of x-sorted nodes around x0 until the next node on
+        # either side is further away in x alone than the best found
+        lo = hi = int(np.searchsorted(self.sorted_x, x0))
+        best_d2, best = np.inf, -1
+        width = 32
+        while True:
+            nodes = np.concatenate([self.order[max(lo-width, 0):lo], self.order[hi:hi+width]])
+            lo, hi = max(lo-width, 0), min(hi+width, n)
+            if len(nodes):
+                d2 = (self.x[nodes]-x0)**2 + (self.y[nodes]-y0)**2
+                m = d2.min()
+                i = nodes[d2 == m].min()
+                if m < best_d2 or (m == best_d2 and i < best):
+                    best_d2, best = m, i
+            gap = min(x0-self.sorted_x[lo-1] if lo > 0 else np.inf, self.sorted_x[hi]-x0 if hi < n else np.inf)
+            if gap*gap > best_d2:
+                return int(best)
+            width *= 2
+
+    # First hit of the ray (x0, y0) + t*(dx, dy), 0 <= t <= length, as
+    # (segment index, t), or None if it misses. A hit on a shared node goes
+    # to the lower segment.
+    def first_hit(self, x0, y0, dx, dy, length):
+        n_seg = len(self.x)-1
+        if n_seg <= self.SCAN_SEGMENTS:
+            hit = self.scan(0, n_seg, x0, y0, dx, dy, length)
+            return None if hit is None else hit[::-1]
+        if self.levels is None:
+            self.levels = self.build_levels()
+
+        # Best-first walk down the hierarchy in order of ray entry distance
+        top = len(self.levels)-1
+        t = self.ray_enter(self.levels[top][0], x0, y0, dx, dy, length)
+        heap = [] if t is None else [(t, top, 0)]
+        best = None
+        while heap:
+            t, level, i = heapq.heappop(heap)
+            if best is not None and t > best[0]:
+                break
+            if level == 0:
+                hit = self.scan(i*self.LEAF_SIZE, min((i+1)*self.LEAF_SIZE, n_seg), x0, y0, dx, dy, length)
+                if hit is not None and (best is None or hit < best):
+                    best = hit
+                continue
+            for c in range(2*i, min(2*i+2, len(self.levels[level-1]))):
+                t = self.ray_enter(self.levels[level-1][c], x0, y0, dx, dy, length)
+                if t is not None:
+                    heapq.heappush(heap, (t, level-1, c))
+        return None if best is None else best[::-1]
+
+    # Shoelace sums of the profile walked back from each node to the first,
+    # so the area of a ring closed along the profile is O(1) per node
+    def cross_sums(self):
+        if self.cross is None:
+            seg_cross = self.x[1:]*self.y[:-1] - self.y[1:]*self.x[:-1]
+            self.cross = np.concatenate([[0.0], np.cumsum(seg_cross)])
+        return self.cross
+
+    # First hit as (t, segment index) on segments start to stop-1
+    def scan(self, start, stop, x0, y0, dx, dy, length):
+        k, t, u = ray_intersections(self.x[start:stop+1], self.y[start:stop+1], x0, y0, dx, dy, length)
+        if len(k) == 0:
+            return None
+        i = int(np.argmin(t))
+        return float(t[i]), start+int(k[i])
+
+    # Bounding boxes (xmin, ymin, xmax, ymax) of each level of the
+    # hierarchy, from leaves of LEAF_SIZE segments up to a single root box.
+    # Boxes are kept as tuples of floats; testing one or two at a time is
+    # quicker in plain Python than through numpy.
+    def build_levels(self):
+        x0, x1, y0, y1 = self.x[:-1], self.x[1:], self.y[:-1], self.y[1:]
+        pad = -len(x0) % self.LEAF_SIZE
+
+        # Grow the boxes slightly so rays grazing a box edge aren't lost to rounding
+        eps = 1e-9*(1 + np.abs(self.x).max() + np.abs(self.y).max())
+        boxes = []
+        for lo, hi, fill, reduce in [(x0, x1, np.inf, np.minimum), (y0, y1, np.inf, np.minimum),
+                                     (x0, x1, -np.inf, np.maximum), (y0, y1, -np.inf, np.maximum)]:
+            v = np.concatenate([reduce(lo, hi), np.full(pad, fill)]).reshape(-1, self.LEAF_SIZE)
+            boxes.append(reduce.reduce(v, axis=1) + (eps if fill < 0 else -eps))
+
+        levels = [list(zip(*(b.tolist() for b in boxes)))]
+        while len(boxes[0]) > 1:
+            odd = len(boxes[0]) % 2
+            boxes = [reduce.reduce(np.concatenate([b, np.full(odd, fill)]).reshape(-1, 2), axis=1)
+                     for b, fill, reduce in zip(boxes, [np.inf, np.inf, -np.inf, -np.inf], [np.minimum]*2 + [np.maximum]*2)]
+            levels.append(list(zip(*(b.tolist() for b in boxes))))
+        return levels
+
+    # Distance along the ray to where it enters a box, or None if it doesn't
+    # within 0 <= t <= length
+    @staticmethod
+    def ray_enter(box, x0, y0, dx, dy, length):
+        xmin, ymin, xmax, ymax = box
+        t_lo, t_hi = 0.0, length
+        for lo, hi, o, d in ((xmin, xmax, x0, dx), (ymin, ymax, y0, dy)):
+            if d == 0:
+                if o < lo or o > hi:
+                    return None
+            else:
+                t1, t2 = (lo-o)/d, (hi-o)/d
+                if t1 > t2: t1, t2 = t2, t1
+                t_lo, t_hi = max(t_lo, t1), min(t_hi, t2)
+        return t_lo if t_lo <= t_hi else None
+
+# Failure volume polygon and the post-failure surface the run-out is cast onto
+def failure_geometry(sp_x, sp_y, fs_x, fs_y, project):
+    sp_x, sp_y = np.asarray(sp_x, dtype=float), np.asarray(sp_y, dtype=float)
+    fs_x, fs_y = np.array(fs_x, dtype=float), np.array(fs_y, dtype=float)
+
+    # Snap failure surface end points to slope profile nodes
+    with stage('snap'):
+        index = ProfileIndex(sp_x, sp_y)
+        i_start = index.nearest(fs_x[0], fs_y[0])
+        i_end = index.nearest(fs_x[-1], fs_y[-1])
+    if i_end <= i_start:
+        raise ValueError('Failure surface end points snap to the same or reversed slope profile nodes')
+    fs_x[0], fs_y[0] = sp_x[i_start], sp_y[i_start]
+    fs_x[-1], fs_y[-1] = sp_x[i_end], sp_y[i_end]
+
+    with stage('failure_polygon'):
+        # Slope profile between the snap points, back along the failure surface
+        fv_x = np.concatenate([sp_x[i_start:i_end+1], fs_x[-2::-1]])
+        fv_y = np.concatenate([sp_y[i_start:i_end+1], fs_y[-2::-1]])
+
+        # Slope profile with the failure surface substituted between the snap points
+        if project == 'yes':
+            line_combined = ProfileIndex(np.concatenate([sp_x[:i_start], fs_x, sp_x[i_end+1:]]),
+                                         np.concatenate([sp_y[:i_start], fs_y, sp_y[i_end+1:]]))
+        else:
+            line_combined = index
+        area = shoelace_area(fv_x, fv_y)
+
+    return fv_x, fv_y, area, line_combined
+
+# Catch capacity polygon between the bund, the run-out line and the surface behind it
+def catch_geometry(line_combined, b_x, b_y, bt_x, bt_y, bund_height, runout_angle, right):
+    if right: runout_angle = 180-runout_angle
+    dx, dy = math.cos(math.radians(runout_angle)), math.sin(math.radians(runout_angle))
+
+    # First hit along the run-out line from the bund crest
+    with stage('intersection'):
+        if not isinstance(line_combined, ProfileIndex):
+            line_combined = ProfileIndex(*line_combined)
+        hit = line_combined.first_hit(bt_x, bt_y, dx, dy, RUNOUT_LENGTH)
+    if hit is None:
+        raise ValueError('Run-out line does not intersect the slope profile')
+    k, t = hit
+    px, py = line_combined
+    ix, iy = bt_x+t*dx, bt_y+t*dy
+
+    # Profile from the crossing back to the toe, then back to the bund
+    with stage('catch_polygon'):
+        if bund_height > 0:
+            cc_x = np.concatenate([[b_x[2], bt_x, ix], px[k::-1], [b_x[2]]])
+            cc_y = np.concatenate([[b_y[2], bt_y, iy], py[k::-1], [b_y[2]]])
+        else:
+            cc_x = np.concatenate([[bt_x, ix], px[k::-1], [bt_x]])
+            cc_y = np.concatenate([[bt_y, iy], py[k::-1], [bt_y]])
+        area = shoelace_area(cc_x, cc_y)
+
+    return cc_x, cc_y, area, ix, iy
+
+# Catch capacity for a fan of run-out angles cast from one bund crest, as
+# arrays of capacity and intersection x, y (NaN where the line misses).
+# Every angle shares the profile index: the first hit comes from its
+# hierarchy and the ring of catch_geometry is summed from the profile's
+# prefix sums, so no polygon is built per angle.
+def catch_capacity_fan(line_combined, b_x, b_y, bt_x, bt_y, bund_height, runout_angles, right):
+    if not isinstance(line_combined, ProfileIndex):
+        line_combined = ProfileIndex(*line_combined)
+    px, py = line_combined
+    cross = line_combined.cross_sums()
+
+    # Ring b2 -> bt -> I -> p[k] -> ... -> p[0] -> b2, with b2 = bt and no bund
+    b2_x, b2_y = (b_x[2], b_y[2]) if bund_height > 0 else (bt_x, bt_y)
+    fixed = (b2_x*bt_y - b2_y*bt_x) + (px[0]*b2_y - py[0]*b2_x)
+
+    n = len(runout_angles)
+    capacity, ix, iy = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan)
+    with stage('fan'):
+        for a, runout_angle in enumerate(runout_angles):
+            if right: runout_angle = 180-runout_angle
+            dx, dy = math.cos(math.radians(runout_angle)), math.sin(math.radians(runout_angle))
+            hit = line_combined.first_hit(bt_x, bt_y, dx, dy, RUNOUT_LENGTH)
+            if hit is None:
+                continue
+            k, t = hit
+            x, y = bt_x+t*dx, bt_y+t*dy
+            s = fixed + (bt_x*y - bt_y*x) + (x*py[k] - y*px[k]) + cross[k]
+            capacity[a], ix[a], iy[a] = 0.5*abs(s), x, y
+
+    return capacity, ix, iy
+
+# Catch capacity of a batch of bund/run-out/profile combinations. Profiles
+# px, py have shape (..., n) and everything else broadcasts against the
+# leading dimensions; dx, dy is the run-out direction. The catch polygon is
+# the same ring as catch_geometry, with its shoelace terms along the profile
+# taken from a prefix sum so no profile is rebuilt per combination. NaN where
+# the run-out line misses the profile.
+def catch_capacity_rays(px, py, bt_x, bt_y, b2_x, b2_y, dx, dy):
+    dx, dy = np.asarray(dx)[..., None], np.asarray(dy)[..., None]
+
+    # Shoelace terms of the profile walked back from node k to the toe
+    seg_cross = px[..., 1:]*py[..., :-1] - py[..., 1:]*px[..., :-1]
+    profile_cross = np.concatenate([np.zeros(seg_cross.shape[:-1] + (1,)), np.cumsum(seg_cross, axis=-1)], axis=-1)
+
+    # Ray/segment intersections for every combination at once
+    ex, ey = np.diff(px, axis=-1), np.diff(py, axis=-1)
+    wx, wy = px[..., :-1]-np.asarray(bt_x)[..., None], py[..., :-1]-np.asarray(bt_y)[..., None]
+    denom = dx*ey - dy*ex
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (wx*ey - wy*ex)/denom
+        u = (wx*dy - wy*dx)/denom
+    hit = (denom != 0) & (t >= 0) & (t <= RUNOUT_LENGTH) & (u >= 0) & (u <= 1)
+
+    # First hit along the run-out line from the bund crest
+    found = hit.any(axis=-1)
+    k = np.where(hit, t, np.inf).argmin(axis=-1)[..., None]
+    def at_k(v):
+        return np.take_along_axis(np.broadcast_to(v, hit.shape[:-1] + v.shape[-1:]), k, axis=-1)[..., 0]
+    t, px_k, py_k, profile_k = at_k(t), at_k(px), at_k(py), at_k(profile_cross)
+    dx, dy = dx[..., 0], dy[..., 0]
+    ix, iy = bt_x+t*dx, bt_y+t*dy
+
+    # Ring b2 -> bt -> I -> p[k] -> ... -> p[0] -> b2
+    s = (b2_x*bt_y - b2_y*bt_x) + (bt_x*iy - bt_y*ix) + (ix*py_k - iy*px_k) \
+        + profile_k + (px[..., 0]*b2_y - py[..., 0]*b2_x)
+    return np.where(found, 0.5*np.abs(s), np.nan)
+
+# Bund crest (bt) and back toe (b2) x co-ordinates for arrays of standoff
+# and bund height. Crest and toes coincide with no bund.
+def bund_points(toe_x, standoffs, bund_heights, right):
+    side = -1 if right else 1
+    bund_width = 2*np.maximum(bund_heights, 0)/math.tan(math.radians(BUND_ANGLE))
+    b0_x = toe_x - side*standoffs
+    return b0_x + side*0.5*bund_width, b0_x + side*bund_width
+
+# Catch capacity for every combination of standoff, bund height and run-out
+# angle, shape (len(standoffs), len(bund_heights), len(runout_angles)). NaN
+# where the run-out line misses the profile.
+def catch_capacity_grid(line_combined, toe_x, toe_y, standoffs, bund_heights, runout_angles, right):
+    px, py = (np.asarray(v, dtype=float) for v in line_combined)
+    standoffs = np.asarray(standoffs, dtype=float)[:, None]
+    bund_heights = np.asarray(bund_heights, dtype=float)[None, :]
+
+    bt_x, b2_x = bund_points(toe_x, standoffs, bund_heights, right)
+    bt_y = toe_y + np.maximum(bund_heights, 0) + 0*standoffs
+
+    # One run-out angle at a time keeps memory to (S, B, n) for long profiles
+    cc = np.empty(bt_x.shape + (len(runout_angles),))
+    for a, runout_angle in enumerate(runout_angles):
+        if right: runout_angle = 180-runout_angle
+        dx, dy = math.cos(math.radians(runout_angle)), math.sin(math.radians(runout_angle))
+        cc[..., a] = catch_capacity_rays(px, py, bt_x, bt_y, b2_x, toe_y, dx, dy)
+
+    return cc
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - gunicorn settings
+
+Read by gunicorn from the working directory, so the Procfile command stays
+'gunicorn app:server'. The app is imported once in the master and warmed
+there (app.warm: geometry engine, figure template, login figure) before the
+workers are forked, so a new worker serves its first request without
+paying for any of it. Nothing opened on import is shared across the fork:
+the result cache and job store connect on first use in each process.
+
+See startup.py for the import and initialisation cost this saves.
+
+"""
+
+preload_app = True
+
+# Runs in the master before the app is loaded: drop the metrics saved by
+# the workers of an earlier run (see metrics.py)
+def on_starting(server):
+    import metrics
+    metrics.clear()
+
+# Runs in the master once the app is loaded, before any worker is forked
+def when_ready(server):
+    if server.cfg.preload_app:
+        import app
+        app.warm()
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - background jobs
+
+Sweeps, Monte Carlo runs, multi-section batches and reports take too long
+to run inside a Dash callback without tying up a gunicorn worker (and
+running into its timeout). They run as jobs instead: the callback submits
+one and returns straight away, and the page polls its progress until the
+result is ready. Single-section updates keep running in the web workers as before.
+
+Jobs are rows in a SQLite file, so there is no broker to run and every
+gunicorn worker on the host sees the same queue. Worker processes claim
+queued jobs one at a time and report progress as they go; a job is
+cancelled at its next progress report. Workers run at a lower priority
+(RUNOUT_JOB_NICE, default 10) so interactive requests come first.
+
+The first submission starts RUNOUT_JOB_WORKERS worker processes (default 2,
+0 to leave it to workers run separately), which exit after RUNOUT_JOB_IDLE
+seconds without work (default 300). To run the workers on their own, e.g.
+as a Procfile worker:
+
+    python jobs.py --workers 4
+
+Set RUNOUT_JOBS to the SQLite file (default runout-jobs.sqlite in the
+temporary directory). Finished jobs are removed after RUNOUT_JOB_TTL
+seconds (default 3600).
+
+"""
+import argparse
+import multiprocessing
+import os
+import pickle
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+# Job states
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# Seconds between queue polls and between worker heartbeats, and after
+# which a worker without a heartbeat is taken to have died
+POLL = 0.2
+HEARTBEAT = 2
+STALE = 15
+
+# Least time between progress writes of a job (s)
+PROGRESS_INTERVAL = 0.2
+
+# Standoff rows of a sweep per progress report
+SWEEP_ROWS = 4
+
+# Raised inside a job by its progress callback once it has been cancelled
+class JobCancelled(Exception):
+    pass
+
+# A job as the app sees it
+@dataclass
+class Job:
+    id: str
+    kind: str
+    status: str
+    progress: float
+    message: str
+    created: float
+    started: float
+    finished: float
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    # Seconds the job has run for (so far)
+    @property
+    def seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+# Queue of jobs and the workers serving it, in a SQLite file shared by
+# every process on the host. The connection is opened on first use in each
+# process, like cache.SQLiteCache.
+class JobStore:
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.connection is None or self.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT, params BLOB, status TEXT, progress REAL, message TEXT, '
+                               'result BLOB, cancel INTEGER, worker TEXT, created REAL, started REAL, finished REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, created)')
+            connection.execute('CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, seen REAL)')
+            self.connection, self.pid = connection, os.getpid()
+        return self.connection
+
+    def execute(self, sql, args=()):
+        with self.lock:
+            return self.connect().execute(sql, args).fetchall()
+
+    def submit(self, kind, params):
+        job_id = uuid.uuid4().hex
+        self.execute('INSERT INTO jobs VALUES (?, ?, ?, ?, 0, ?, NULL, 0, NULL, ?, NULL, NULL)',
+                     (job_id, kind, pickle.dumps(params), QUEUED, 'Queued', time.time()))
+        return job_id
+
+    # Oldest queued job as (id, kind, params), now running on worker
+    def claim(self, worker):
+        with self.lock:
+            db = self.connect()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute('SELECT id, kind, params FROM jobs WHERE status = ? ORDER BY created LIMIT 1', (QUEUED,)).fetchone()
+                if row is not None:
+                    db.execute('UPDATE jobs SET status = ?, message = ?, worker = ?, started = ? WHERE id = ?', (RUNNING, 'Started', worker, time.time(), row[0]))
+                db.execute('COMMIT')
+            except sqlite3.Error:
+                db.execute('ROLLBACK')
+                raise
+        return None if row is None else (row[0], row[1], pickle.loads(row[2]))
+
+    # Record progress; True if the job has been cancelled
+    def progress(self, job_id, fraction, message):
+        self.execute('UPDATE jobs SET progress = ?, message = ? WHERE id = ?', (fraction, message, job_id))
+        return bool(self.execute('SELECT cancel FROM jobs WHERE id = ?', (job_id,))[0][0])
+
+    def finish(self, job_id, status, message, result=None):
+        self.execute('UPDATE jobs SET status = ?, message = ?, result = ?, finished = ?, progress = CASE WHEN ? THEN 1 ELSE progress END WHERE id = ?',
+                     (status, message, None if result is None else pickle.dumps(result), time.time(), status == DONE, job_id))
+
+    # Cancel a queued job now, a running one at its next progress report
+    def cancel(self, job_id):
+        self.execute('UPDATE jobs SET status = ?, message = ?, finished = ? WHERE id = ? AND status = ?', (CANCELLED, 'Cancelled', time.time(), job_id, QUEUED))
+        self.execute('UPDATE jobs SET cancel = 1, message = ? WHERE id = ? AND status = ?', ('Cancelling', job_id, RUNNING))
+
+    # Job status, None if unknown or removed. A running job whose worker has
+    # stopped sending heartbeats is marked failed.
+    def job(self, job_id):
+        rows = self.execute('SELECT id, kind, status, progress, message, created, started, finished, worker FROM jobs WHERE id = ?', (job_id,))
+        if not rows:
+            return None
+        row = rows[0]
+        if row[2] == RUNNING and not self.execute('SELECT 1 FROM workers WHERE id = ? AND seen > ?', (row[8], time.time()-STALE)):
+            self.finish(job_id, FAILED, 'Worker stopped')
+            return self.job(job_id)
+        return Job(*row[:8])
+
+    def result(self, job_id):
+        rows = self.execute('SELECT result FROM jobs WHERE id = ? AND status = ?', (job_id, DONE))
+        return pickle.loads(rows[0][0]) if rows and rows[0][0] is not None else None
+
+    def heartbeat(self, worker):
+        self.execute('INSERT OR REPLACE INTO workers VALUES (?, ?)', (worker, time.time()))
+
+    def remove_worker(self, worker):
+        self.execute('DELETE FROM workers WHERE id = ?', (worker,))
+
+    def live_workers(self):
+        return self.execute('SELECT COUNT(*) FROM workers WHERE seen > ?', (time.time()-STALE,))[0][0]
+
+    # Drop jobs finished more than ttl seconds ago, and dead workers
+    def purge(self, ttl):
+        now = time.time()
+        self.execute('DELETE FROM jobs WHERE finished < ?', (now-ttl,))
+        self.execute('DELETE FROM workers WHERE seen < ?', (now-STALE,))
+
+# Job store selected by RUNOUT_JOBS, opened on first use
+_store = []
+
+def job_store():
+    if not _store:
+        _store.append(JobStore(os.environ.get('RUNOUT_JOBS', os.path.join(tempfile.gettempdir(), 'runout-jobs.sqlite'))))
+    return _store[0]
+
+# Queue a job of one of the KINDS and return its id, starting workers if
+# none are running
+def submit(kind, params):
+    if kind not in KINDS:
+        raise ValueError('Unknown job kind {0}'.format(kind))
+    store = job_store()
+    store.purge(float(os.environ.get('RUNOUT_JOB_TTL', 3600)))
+    job_id = store.submit(kind, params)
+    start_workers()
+    return job_id
+
+def job(job_id):
+    return job_store().job(job_id)
+
+def cancel(job_id):
+    job_store().cancel(job_id)
+
+def result(job_id):
+    return job_store().result(job_id)
+
+# Time workers were last started by this process, so a burst of
+# submissions doesn't start more while the first are still importing
+_started = [0.0]
+
+# Start RUNOUT_JOB_WORKERS workers (less those already running), each in
+# its own process that exits when idle
+def start_workers():
+    workers = int(os.environ.get('RUNOUT_JOB_WORKERS', 2))
+    if workers <= 0 or time.time()-_started[0] < STALE:
+        return
+    missing = workers - job_store().live_workers()
+    if missing <= 0:
+        return
+    _started[0] = time.time()
+    command = [sys.executable, os.path.abspath(__file__), '--workers', '1', '--idle', os.environ.get('RUNOUT_JOB_IDLE', '300')]
+    options = {'start_new_session': True} if os.name == 'posix' else {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    for _ in range(missing):
+        subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **options)
+
+# Run one claimed job, recording its result, error or cancellation
+def run_job(store, job_id, kind, params):
+    last = [0.0]
+
+    # Progress callback handed to the job: fraction done and a message
+    def progress(fraction, message=''):
+        now = time.time()
+        if now-last[0] < PROGRESS_INTERVAL and fraction < 1:
+            return
+        last[0] = now
+        if store.progress(job_id, fraction, message):
+            raise JobCancelled()
+
+    try:
+        result = KINDS[kind](params, progress)
+    except JobCancelled:
+        store.finish(job_id, CANCELLED, 'Cancelled')
+    except Exception as e:
+        store.finish(job_id, FAILED, '{0}: {1}'.format(type(e).__name__, e))
+    else:
+        store.finish(job_id, DONE, 'Done', result)
+
+# Worker loop: claim and run jobs until idle for idle seconds (forever if
+# None). A thread keeps the heartbeat going through long jobs.
+def work(idle=None):
+    if hasattr(os, 'nice'):
+        os.nice(int(os.environ.get('RUNOUT_JOB_NICE', 10)))
+    store = job_store()
+    worker = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+    stopped = threading.Event()
+
+    def beat():
+        while not stopped.wait(HEARTBEAT):
+            store.heartbeat(worker)
+    store.heartbeat(worker)
+    threading.Thread(target=beat, daemon=True).start()
+
+    last_job = time.time()
+    try:
+        while idle is None or time.time()-last_job < idle:
+            claimed = store.claim(worker)
+            if claimed is None:
+                time.sleep(POLL)
+                continue
+            run_job(store, *claimed)
+            last_job = time.time()
+    finally:
+        stopped.set()
+        store.remove_worker(worker)
+
+# Sweep of standoff and bund height (sweep.sweep_runout arguments, with the
+# standoffs given as 'standoffs' and the rest as 'args'), a few standoff
+# rows at a time
+def sweep_job(params, progress):
+    import numpy as np
+    from sweep import sweep_runout
+
+    standoffs = np.asarray(params['standoffs'], dtype=float)
+    rows = []
+    for start in range(0, len(standoffs), SWEEP_ROWS):
+        res = sweep_runout(standoffs[start:start+SWEEP_ROWS], *params['args'])
+        rows.append(res.catch_capacity)
+        progress(min(start+SWEEP_ROWS, len(standoffs))/len(standoffs), 'Standoff {0:.1f} m'.format(standoffs[min(start+SWEEP_ROWS, len(standoffs))-1]))
+    res.standoffs, res.catch_capacity = standoffs, np.concatenate(rows)
+    return res
+
+# Monte Carlo overtopping probability (montecarlo.overtopping_probability
+# keyword arguments). The samples themselves aren't kept with the result.
+def montecarlo_job(params, progress):
+    from montecarlo import overtopping_probability
+
+    params = dict(params)
+    params.setdefault('batch', max(10000, params.get('n', 100000)//20))
+    res = overtopping_probability(progress=lambda done, n: progress(done/n, '{0:,} of {1:,} samples'.format(done, n)), **params)
+    res.margin = None
+    return res
+
+# Multi-section batch (batch.py) of an uploaded long-format CSV/TSV file:
+# 'text', 'filename', 'defaults' and optionally 'engine' and 'workers'.
+# Returns the results CSV as {'content', 'filename'} with the status counts.
+# The results are also added to the RUNOUT_RESULTS store, if set.
+def batch_job(params, progress):
+    import batch
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, os.path.basename(params.get('filename') or 'sections.csv'))
+        with open(source, 'w', newline='') as f:
+            f.write(params['text'])
+        sections = batch.read_sections(source)
+        progress(0, '0 of {0} sections'.format(len(sections)))
+
+        output = os.path.join(directory, 'results.csv')
+        writer = ProgressWriter(batch.CSVWriter(output), len(sections), progress)
+        if os.environ.get('RUNOUT_RESULTS'):
+            writer = batch.StoreWriter(os.environ['RUNOUT_RESULTS'], writer)
+        workers = params.get('workers') or max(1, (os.cpu_count() or 2)-1)
+        counts = batch.run_batch(sections, writer, params['defaults'], workers, params.get('engine'), progress=False)
+        with open(output, newline='') as f:
+            content = f.read()
+
+    name = os.path.splitext(os.path.basename(params.get('filename') or 'sections'))[0]
+    return dict(counts, content=content, filename='{0}-results.csv'.format(name))
+
+# Report (report.py) of an uploaded long-format CSV/TSV file, as for
+# batch_job with the page 'format'. Returns the self-contained HTML report
+# as {'content', 'filename'} with the status counts.
+def report_job(params, progress):
+    import batch
+    import report
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, os.path.basename(params.get('filename') or 'sections.csv'))
+        with open(source, 'w', newline='') as f:
+            f.write(params['text'])
+        sections = batch.read_sections(source)
+
+        output = os.path.join(directory, 'report.html')
+        name = os.path.splitext(os.path.basename(params.get('filename') or 'sections'))[0]
+        workers = params.get('workers') or max(1, (os.cpu_count() or 2)-1)
+        counts = report.export_report(sections, [params['defaults']], report.HTMLReport(output, params['format'], 'Run-out report: {0}'.format(name)),
+                                      params['format'], workers, params.get('engine'),
+                                      lambda i, n, row: progress(i/n, '{0} of {1} pages'.format(i, n)))
+        with open(output, encoding='utf-8') as f:
+            content = f.read()
+
+    return dict(counts, content=content, filename='{0}-report.html'.format(name))
+
+# Batch writer that reports progress as each section's row is written
+class ProgressWriter:
+    def __init__(self, writer, total, progress):
+        self.writer, self.total, self.progress = writer, total, progress
+        self.count = 0
+
+    def write(self, row, stored=None):
+        self.writer.write(row, stored)
+        self.count += 1
+        self.progress(self.count/self.total, '{0} of {1} sections'.format(self.count, self.total))
+
+    def close(self):
+        self.writer.close()
+
+# Job kinds, as functions of (params, progress) returning the result
+KINDS = {
+    'sweep': sweep_job,
+    'montecarlo': montecarlo_job,
+    'batch': batch_job,
+    'report': report_job,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run background job workers for the run-out calculator.')
+    parser.add_argument('--workers', type=int, default=2, help='worker processes (default: 2)')
+    parser.add_argument('--idle', type=float, default=None, help='exit after this many seconds without a job (default: never)')
+    args = parser.parse_args(argv)
+
+    if args.workers == 1:
+        work(args.idle)
+        return 0
+    processes = [multiprocessing.Process(target=work, args=(args.idle,)) for _ in range(args.workers)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
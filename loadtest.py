@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - load test
+
+Starts the app under gunicorn, logs in through /login and replays Update
+Graph requests (_dash-update-component, built from the app's own
+/_dash-dependencies) from a number of concurrent users, each sending its
+next request as soon as the last one returns. Sections are the app's
+default plus synthetic ones (synthetic.py) in both input modes.
+
+Every combination of worker count, worker class and threads is started in
+turn and loaded at each concurrency. The report gives throughput and
+p50/p95/p99 latency for each, and the gunicorn command line the Procfile
+should use: the highest throughput at the top concurrency, preferring the
+lower p95 and then fewer workers among configurations within 5% of it.
+
+By default every request has a slightly different standoff, so nothing is
+served from the result cache (cache.py); --hit-rate replays that fraction
+of requests unchanged. The load is generated on the same host, so leave
+some cores free for it when sweeping many workers.
+
+Usage:
+    python loadtest.py
+    python loadtest.py --workers 1 2 4 8 --worker-classes sync gthread --threads 1 4 --concurrency 1 8 32
+    python loadtest.py --duration 30 --save loadtest.json
+
+"""
+import argparse
+import http.client
+import importlib.util
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+import synthetic
+
+# Login used for the test (users.py)
+USERNAME, PASSWORD = 'BMA', '25'
+
+# The app's default section, as the page first loads
+DEFAULT_CASE = (18, 1.3, 2, 37, "0.0\t0.0\n3.5\t5.2\n6.4\t11.6\n7.1\t16.5\n9.0\t21.6\n12.4\t27.7\n16.5\t32.3\n22.1\t35.6\n28.8\t36.0",
+                "6.4\t11.6\n14.3\t17.7\n18.6\t22.9\n22.1\t35.6", 'left', 'yes', 'manual', 36, 65, 10, 12, 35, 'no', 5)
+
+# Update Graph states in callback order, for the 16 compute_runout arguments
+STATES = ['standoff', 'swellfactor', 'bundheight', 'runoutangle', 'spxy', 'fsxy', 'direction', 'project', 'manual',
+          'slopeheight', 'slopeangle', 'crestwidth', 'failureheight', 'failureangle', 'backscarp', 'backscarpdist']
+
+# Throughput within this fraction of the best counts as a tie in the recommendation
+TIE = 0.05
+
+# Free local port for the server
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# Worker classes gunicorn can run here (gevent and eventlet are optional installs)
+def available_worker_class(worker_class):
+    return worker_class not in ('gevent', 'eventlet', 'tornado') or importlib.util.find_spec(worker_class) is not None
+
+# Start gunicorn with one configuration and wait until it serves the page
+def start_server(port, workers, worker_class, threads, timeout=60):
+    command = [sys.executable, '-m', 'gunicorn', 'app:server', '--bind', '127.0.0.1:{0}'.format(port),
+               '--workers', str(workers), '--worker-class', worker_class, '--threads', str(threads), '--log-level', 'warning']
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited with status {0}'.format(process.returncode))
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError('gunicorn did not start within {0} s'.format(timeout))
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+# Session cookie from logging in through the form
+def login(port):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    body = urllib.parse.urlencode({'username': USERNAME, 'password': PASSWORD})
+    connection.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = connection.getresponse()
+    response.read()
+    cookie = response.getheader('Set-Cookie')
+    if not cookie or not cookie.startswith('custom-auth-session='):
+        raise RuntimeError('Login failed (status {0})'.format(response.status))
+    return cookie.split(';')[0]
+
+# The Update Graph callback as declared by the running app (its output is the
+# figure, or runout-store with RUNOUT_RENDER=client)
+def update_graph_callback(port):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    connection.request('GET', '/_dash-dependencies')
+    for callback in json.loads(connection.getresponse().read()):
+        if 'custom-auth-frame-1.children' in callback['output']:
+            return callback
+    raise RuntimeError('No update_graph callback found')
+
+# Callback state values for compute_runout arguments, as the page holds them
+# (the project and tension crack switches are checklists)
+def state_values(args):
+    values = dict(zip(STATES, args))
+    values['project'] = ['yes'] if values['project'] == 'yes' else []
+    values['backscarp'] = ['no'] if values['backscarp'] == 'yes' else []
+    values['cascade'], values['windrowheight'] = [], 0
+    values['failureshape'], values['failuredepth'], values['spiralangle'], values['curvetolerance'] = 'planar', 3, 20, 0.1
+    values['simplifymethod'], values['simplifytolerance'] = 'none', 0.05
+    return values
+
+# _dash-update-component body for one click of Update Graph
+def update_payload(callback, args, n_clicks):
+    values = state_values(args)
+    outputs = [dict(zip(['id', 'property'], o.split('.'))) for o in callback['output'].strip('.').split('...')]
+    inputs = [dict(i, value=n_clicks) for i in callback['inputs']]
+    state = [dict(s, value=values[s['id'].replace('-state', '')]) for s in callback['state']]
+    return json.dumps({'output': callback['output'], 'outputs': outputs, 'inputs': inputs, 'state': state,
+                       'changedPropIds': ['{0}.{1}'.format(i['id'], i['property']) for i in callback['inputs']]})
+
+# Sections replayed by the users: the default section and synthetic ones
+def cases(sizes):
+    yield DEFAULT_CASE
+    for name, n, args in synthetic.corpus(sizes):
+        yield args
+
+# Closed-loop load from concurrency users for warmup + duration seconds.
+# Returns the latencies (s) of the requests that started after the warmup
+# and finished in time, and the number of failed requests.
+def run_load(port, cookie, callback, sections, concurrency, duration, warmup=2.0, hit_rate=0.0, seed=0):
+    start = time.monotonic()
+    measure_from, deadline = start + warmup, start + warmup + duration
+    latencies, failures = [], [0]
+    lock = threading.Lock()
+
+    def user(index):
+        rng = random.Random(seed + index)
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        headers = {'Content-Type': 'application/json', 'Cookie': cookie}
+        done, clicks = [], 0
+        while time.monotonic() < deadline:
+            args = list(rng.choice(sections))
+            if rng.random() >= hit_rate:
+                args[0] = round(args[0] + rng.uniform(-2, 2), 2)
+            clicks += 1
+            body = update_payload(callback, args, clicks)
+            sent = time.monotonic()
+            try:
+                connection.request('POST', '/_dash-update-component', body, headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                ok = False
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+            received = time.monotonic()
+            if sent >= measure_from and received <= deadline:
+                if ok:
+                    done.append(received - sent)
+                else:
+                    with lock:
+                        failures[0] += 1
+        with lock:
+            latencies.extend(done)
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, failures[0]
+
+# Throughput and latency percentiles of one run
+def summarise(latencies, failures, duration):
+    lat = np.array(latencies)
+    p50, p95, p99 = np.percentile(lat, [50, 95, 99]) if len(lat) else (np.nan,)*3
+    return {'requests': len(lat), 'failures': failures, 'throughput': len(lat)/duration, 'p50': p50, 'p95': p95, 'p99': p99}
+
+# Gunicorn configurations of the sweep, as (workers, worker class, threads).
+# Threads only apply to gthread; gunicorn runs a sync worker with threads as gthread.
+def configurations(workers, worker_classes, threads):
+    for w, k in itertools.product(workers, worker_classes):
+        for t in (threads if k == 'gthread' else [1]):
+            yield w, k, t
+
+# Gunicorn command line for a configuration
+def command_line(workers, worker_class, threads):
+    line = 'gunicorn app:server --workers {0} --worker-class {1}'.format(workers, worker_class)
+    return line + (' --threads {0}'.format(threads) if worker_class == 'gthread' else '')
+
+# Best configuration at the top concurrency: the highest throughput without
+# failures, then the lowest p95 and the fewest workers among the near ties
+def recommend(results):
+    top = max(r['concurrency'] for r in results)
+    candidates = [r for r in results if r['concurrency'] == top and r['failures'] == 0 and r['requests'] > 0]
+    if not candidates:
+        return None
+    best = max(r['throughput'] for r in candidates)
+    ties = [r for r in candidates if r['throughput'] >= (1 - TIE)*best]
+    return min(ties, key=lambda r: (r['p95'], r['workers'], r['threads']))
+
+def print_report(results, recommended, out=sys.stdout):
+    print('{0:>7s} {1:>8s} {2:>7s} {3:>11s} {4:>9s} {5:>9s} {6:>9s} {7:>9s} {8:>8s}'.format(
+        'workers', 'class', 'threads', 'concurrency', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'failures'), file=out)
+    for r in results:
+        print('{workers:7d} {worker_class:>8s} {threads:7d} {concurrency:11d} {throughput:9.1f} {0:9.1f} {1:9.1f} {2:9.1f} {failures:8d}'.format(
+            1e3*r['p50'], 1e3*r['p95'], 1e3*r['p99'], **r), file=out)
+    print(file=out)
+    if recommended is None:
+        print('No configuration ran without failures at the top concurrency.', file=out)
+        return
+    print('Recommended Procfile ({0:.1f} req/s, p95 {1:.0f} ms at {2} concurrent users):'.format(
+        recommended['throughput'], 1e3*recommended['p95'], recommended['concurrency']), file=out)
+    print('    web: ' + command_line(recommended['workers'], recommended['worker_class'], recommended['threads']), file=out)
+    if recommended['workers'] > 1:
+        print('With several workers, set RUNOUT_CACHE to a SQLite file and RUNOUT_METRICS_DIR so the result cache '
+              'and /metrics are shared across them.', file=out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the app under gunicorn and recommend a Procfile configuration.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, os.cpu_count() or 1], help='worker counts to sweep')
+    parser.add_argument('--worker-classes', nargs='+', default=['sync', 'gthread'], help='worker classes to sweep (sync, gthread, gevent, eventlet)')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4], help='threads per gthread worker to sweep')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='concurrent users')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds at each concurrency')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds before each measurement')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='synthetic profile sizes (vertices) in the replayed sections')
+    parser.add_argument('--hit-rate', type=float, default=0.0, help='fraction of requests replayed unchanged (result cache hits)')
+    parser.add_argument('--save', default=None, help='save the results as JSON')
+    args = parser.parse_args(argv)
+
+    worker_classes = [k for k in args.worker_classes if available_worker_class(k)]
+    for k in sorted(set(args.worker_classes) - set(worker_classes)):
+        print('Skipping the {0} worker class ({0} is not installed)'.format(k), file=sys.stderr)
+    sections = list(cases(args.sizes))
+    workers = sorted(set(args.workers))
+
+    results = []
+    for w, k, t in configurations(workers, worker_classes, sorted(set(args.threads))):
+        port = free_port()
+        process = start_server(port, w, k, t)
+        try:
+            cookie = login(port)
+            callback = update_graph_callback(port)
+            for c in sorted(set(args.concurrency)):
+                latencies, failures = run_load(port, cookie, callback, sections, c, args.duration, args.warmup, args.hit_rate)
+                r = dict(summarise(latencies, failures, args.duration), workers=w, worker_class=k, threads=t, concurrency=c)
+                results.append(r)
+                print('{0}, {1} users: {2:.1f} req/s, p95 {3:.0f} ms'.format(command_line(w, k, t), c, r['throughput'], 1e3*r['p95']), file=sys.stderr)
+        finally:
+            stop_server(process)
+
+    recommended = recommend(results)
+    print_report(results, recommended)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'results': results, 'recommended': recommended and command_line(recommended['workers'], recommended['worker_class'], recommended['threads'])},
+                      f, indent=1, default=float)
+    return 0 if recommended else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
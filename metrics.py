@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - timing and error metrics
+
+Times each stage of a run-out calculation (parsing, profile generation,
+simplification, snapping, failure volume polygon, run-out intersection,
+catch capacity polygon, figure) into histograms, and counts the fallback
+branches taken (no slope profile, intersection error, ...). Served in
+Prometheus text format on /metrics.
+
+Stages are timed with
+
+    with metrics.stage('snap'):
+        ...
+
+and grouped into one calculation (for the calculation histogram and the
+log) by metrics.calculation().
+
+Settings:
+    RUNOUT_METRICS_LOG - file to append one JSON line per calculation to ('-' for stderr)
+    RUNOUT_METRICS_DIR - directory where each worker process saves its metrics,
+                         so /metrics on any gunicorn worker reports them all
+
+The metrics of workers that have exited are folded into retired.json, so
+the counters keep counting up after a worker is restarted. The directory
+is cleared when the gunicorn master starts (gunicorn.conf.py).
+
+"""
+import bisect
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds (s)
+BUCKETS = [1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Seconds between saves of this worker's metrics to RUNOUT_METRICS_DIR
+SAVE_INTERVAL = 1.0
+
+# Stage and calculation histograms, as [bucket counts..., sum, count], and error counters
+class Metrics:
+    def __init__(self):
+        self.histograms = {'stage': {}, 'calculation': {}}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def observe(self, kind, name, seconds):
+        with self.lock:
+            h = self.histograms[kind].get(name)
+            if h is None:
+                h = self.histograms[kind][name] = [0]*(len(BUCKETS) + 3)
+            h[bisect.bisect_left(BUCKETS, seconds)] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def count_error(self, branch):
+        with self.lock:
+            self.errors[branch] = self.errors.get(branch, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {'histograms': {k: {n: list(h) for n, h in v.items()} for k, v in self.histograms.items()}, 'errors': dict(self.errors)}
+
+METRICS = Metrics()
+_local = threading.local()
+_saved = [0.0]
+
+# This process's pid and start time (set on first save, so a forked worker
+# gets its own), naming its file: a worker that reuses the pid of one that
+# has exited doesn't overwrite its metrics
+_process = [None, None]
+
+# Metrics of the workers that have exited, and the lock for folding them in
+RETIRED = 'retired.json'
+RETIRED_LOCK = 'retired.lock'
+
+# Time a stage, adding it to the calculation in progress on this thread
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        METRICS.observe('stage', name, elapsed)
+        record = getattr(_local, 'record', None)
+        if record is not None:
+            record['stages'][name] = record['stages'].get(name, 0.0) + elapsed
+
+# Count a fallback branch; detail (e.g. an exception message) goes into the
+# log line of the calculation in progress
+def error(branch, detail=None):
+    METRICS.count_error(branch)
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record['errors'].append(branch)
+        if detail is not None:
+            record.setdefault('details', {})[branch] = detail
+
+# Group the stages timed on this thread into one calculation; extra fields
+# go into its log line
+@contextmanager
+def calculation(name, **fields):
+    record = dict(fields, event=name, time=time.time(), stages={}, errors=[])
+    outer = getattr(_local, 'record', None)
+    _local.record = record
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        _local.record = outer
+        METRICS.observe('calculation', name, record['seconds'])
+        log(record)
+        save()
+
+# Append a calculation to the JSON lines log, if one is set
+def log(record):
+    path = os.environ.get('RUNOUT_METRICS_LOG')
+    if not path:
+        return
+    line = json.dumps(dict(record, stages={k: round(v, 6) for k, v in record['stages'].items()}, seconds=round(record['seconds'], 6))) + '\n'
+    if path == '-':
+        sys.stderr.write(line)
+    else:
+        with open(path, 'a') as f:
+            f.write(line)
+
+# Save this worker's metrics for the others to report, at most once per SAVE_INTERVAL
+def save(force=False):
+    directory = os.environ.get('RUNOUT_METRICS_DIR')
+    now = time.monotonic()
+    if not directory or (not force and now - _saved[0] < SAVE_INTERVAL):
+        return
+    _saved[0] = now
+    os.makedirs(directory, exist_ok=True)
+    path = saved_path(directory)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(METRICS.snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+# File this process saves its metrics to
+def saved_path(directory):
+    if _process[0] != os.getpid():
+        _process[:] = [os.getpid(), time.time_ns()]
+    return os.path.join(directory, '{0}-{1}.json'.format(*_process))
+
+# Whether a process is still running (assumed so where it can't be checked)
+def alive(pid):
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Saved metrics of workers that have exited: those whose process is gone,
+# and older files of a pid that has been reused
+def stale(paths):
+    started = {}
+    for path in paths:
+        try:
+            pid, start = map(int, os.path.basename(path)[:-5].split('-'))
+        except ValueError:
+            continue
+        started.setdefault(pid, []).append((start, path))
+    old = []
+    for pid, files in started.items():
+        files.sort()
+        old += [path for start, path in (files if not alive(pid) else files[:-1])]
+    return old
+
+def read_saved(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Add the metrics other into merged
+def merge(merged, other):
+    for kind, histograms in other['histograms'].items():
+        for name, h in histograms.items():
+            mine = merged['histograms'].setdefault(kind, {}).setdefault(name, [0]*len(h))
+            merged['histograms'][kind][name] = [a + b for a, b in zip(mine, h)]
+    for branch, n in other['errors'].items():
+        merged['errors'][branch] = merged['errors'].get(branch, 0) + n
+
+# Fold the metrics of exited workers into retired.json (under its lock)
+def retire(directory, paths):
+    retired = read_saved(os.path.join(directory, RETIRED)) or {'histograms': {}, 'errors': {}}
+    for path in paths:
+        other = read_saved(path)
+        if other is not None:
+            merge(retired, other)
+    path = os.path.join(directory, RETIRED)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(retired, f)
+    os.replace(path + '.tmp', path)
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# This worker's metrics merged with those saved by the others and the
+# exited workers
+def collect():
+    from results import locked
+
+    merged = METRICS.snapshot()
+    directory = os.environ.get('RUNOUT_METRICS_DIR')
+    if not directory or not os.path.isdir(directory):
+        return merged
+    own = saved_path(directory)
+    with locked(os.path.join(directory, RETIRED_LOCK)):
+        paths = [path for path in glob.glob(os.path.join(directory, '*.json')) if path != own]
+        old = [p for p in stale([p for p in paths if os.path.basename(p) != RETIRED] + [own]) if p != own]
+        if old:
+            retire(directory, old)
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            other = None if path == own else read_saved(path)
+            if other is not None:
+                merge(merged, other)
+    return merged
+
+# Remove every saved file, when the gunicorn master starts
+def clear():
+    directory = os.environ.get('RUNOUT_METRICS_DIR')
+    if not directory:
+        return
+    for path in glob.glob(os.path.join(directory, '*.json')) + glob.glob(os.path.join(directory, '*.tmp')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# Metrics in Prometheus text exposition format
+def render():
+    metrics = collect()
+    lines = []
+    for kind, label, help_text in [('stage', 'stage', 'Time spent in each stage of a run-out calculation'),
+                                   ('calculation', 'calculation', 'Time of whole run-out calculations')]:
+        name = 'runout_{0}_seconds'.format(kind)
+        lines += ['# HELP {0} {1}'.format(name, help_text), '# TYPE {0} histogram'.format(name)]
+        for value, h in sorted(metrics['histograms'][kind].items()):
+            cumulative = 0
+            for le, n in zip(BUCKETS + ['+Inf'], h[:-2]):
+                cumulative += n
+                lines.append('{0}_bucket{{{1}="{2}",le="{3}"}} {4}'.format(name, label, value, le, cumulative))
+            lines.append('{0}_sum{{{1}="{2}"}} {3!r}'.format(name, label, value, h[-2]))
+            lines.append('{0}_count{{{1}="{2}"}} {3}'.format(name, label, value, h[-1]))
+    lines += ['# HELP runout_errors_total Fallback branches taken by run-out calculations', '# TYPE runout_errors_total counter']
+    for branch, n in sorted(metrics['errors'].items()):
+        lines.append('runout_errors_total{{branch="{0}"}} {1}'.format(branch, n))
+    return '\n'.join(lines) + '\n'
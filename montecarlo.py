@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - Monte Carlo overtopping probability
+
+Samples the uncertain inputs of the parameterised geometry (swell factor,
+run-out angle, basal structure angle and daylighting height), evaluates the
+failure volume and catch capacity of every sample in vectorised batches and
+reports the probability that the swelled failure volume overtops the bund.
+
+Each uncertain input is either a number (fixed) or a distribution tuple:
+    ('normal', mean, sd)
+    ('uniform', low, high)
+    ('triangular', low, mode, high)
+    ('lognormal', mean, sd)        - mean and sd of the underlying normal
+
+"""
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+import geometry
+
+# Result of a Monte Carlo run. margin holds the spare catch capacity (m³/m)
+# of every valid sample; it is +inf where the run-out line passes over the crest.
+@dataclass
+class MonteCarloResult:
+    n: int
+    n_valid: int
+    n_overtopping: int
+    probability: float
+    ci_low: float
+    ci_high: float
+    margin: np.ndarray
+    hist_counts: np.ndarray
+    hist_edges: np.ndarray
+
+# Draw n samples from a fixed value or distribution tuple
+def sample(spec, n, rng):
+    if np.isscalar(spec):
+        return np.full(n, float(spec))
+    kind, params = spec[0], spec[1:]
+    if kind == 'normal':
+        return rng.normal(params[0], params[1], n)
+    if kind == 'uniform':
+        return rng.uniform(params[0], params[1], n)
+    if kind == 'triangular':
+        return rng.triangular(params[0], params[1], params[2], n)
+    if kind == 'lognormal':
+        return rng.lognormal(params[0], params[1], n)
+    raise ValueError('Unknown distribution: {0}'.format(kind))
+
+# Wilson score interval for a binomial proportion
+def wilson_interval(k, n, z=1.96):
+    if n == 0:
+        return float('nan'), float('nan')
+    p = k/n
+    centre = (p + z**2/(2*n))/(1 + z**2/n)
+    half = z*math.sqrt(p*(1-p)/n + z**2/(4*n**2))/(1 + z**2/n)
+    return max(centre-half, 0.0), min(centre+half, 1.0)
+
+# Parameterised slope profile, failure volume and post-failure surface for
+# arrays of inputs, following runout.parameterised_geometry branch by branch.
+# Returns the surface the run-out is cast onto as (N, n) arrays, the failure
+# volume (N,) and a mask of samples with a usable geometry.
+def parameterised_sections(slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, project):
+    sh, fh = np.asarray(slopeheight, dtype=float), np.asarray(failureheight, dtype=float)
+    tan_sa = np.tan(np.radians(slopeangle))
+    adj = sh/tan_sa
+    dl_x = fh/tan_sa
+    m = np.tan(np.radians(failureangle))
+    c = fh-m*dl_x
+
+    crest_x = (sh-c)/m
+    bkp_x = adj+backscarpdist
+    bkp_y1 = m*bkp_x + c
+    bkp_y2 = tan_sa*bkp_x
+    end_x = adj+crestwidth
+
+    # Tension crack behind the crest, or on the slope face
+    crack = (bkp == 'yes') & (bkp_x < crest_x)
+    face = crack & (backscarpdist < 0)
+    behind = crack & ~face
+
+    # Slope profile nodes 2 and 3, and the failure surface middle and end nodes
+    x2, y2 = np.where(face, bkp_x, adj), np.where(face, bkp_y2, sh)
+    x3 = np.where(face, adj, np.where(behind, bkp_x, crest_x))
+    fm_x, fm_y = np.where(crack, bkp_x, crest_x), np.where(crack, bkp_y1, sh)
+    fe_x, fe_y = np.where(face, x2, x3), np.where(face, y2, sh)
+
+    zero = np.zeros_like(dl_x)
+    ones = np.ones_like(dl_x)
+    fv_x = np.stack([dl_x, x2, fe_x, fm_x], axis=-1)
+    fv_y = np.stack([fh, y2, fe_y, fm_y], axis=-1)
+    failure_volume = 0.5*np.abs(np.sum(fv_x*np.roll(fv_y, -1, axis=-1) - fv_y*np.roll(fv_x, -1, axis=-1), axis=-1))
+
+    if project == 'yes':
+        n4_x, n4_y = np.where(face, x3, end_x), sh*ones
+        px = np.stack([zero, dl_x, fm_x, fe_x, n4_x, end_x*ones], axis=-1)
+        py = np.stack([zero, fh, fm_y, fe_y, n4_y, sh*ones], axis=-1)
+    else:
+        px = np.stack([zero, dl_x, x2, x3, end_x*ones], axis=-1)
+        py = np.stack([zero, fh, y2, sh*ones, sh*ones], axis=-1)
+
+    valid = (fh >= 0) & (fh < sh) & (failureangle > 0) & (failureangle < slopeangle) & np.isfinite(failure_volume)
+    return px, py, failure_volume, valid
+
+# Spare catch capacity of a batch of parameterised sections with a fixed bund
+def parameterised_margin(standoff, bund_height, slopeheight, slopeangle, crestwidth, bkp, backscarpdist, project, swell_factor, runout_angle, failureangle, failureheight):
+    px, py, failure_volume, valid = parameterised_sections(slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, project)
+
+    bt_x, b2_x = geometry.bund_points(0.0, standoff, bund_height, False)
+    bt_y = max(bund_height, 0)
+    dx, dy = np.cos(np.radians(runout_angle)), np.sin(np.radians(runout_angle))
+    catch_capacity = geometry.catch_capacity_rays(px, py, bt_x, bt_y, b2_x, 0.0, dx, dy)
+
+    # A run-out line that misses the profile either passes over the crest
+    # (nothing reaches the slope) or starts inside the slope (no capacity)
+    over_crest = bt_y + np.tan(np.radians(runout_angle))*(px[..., -1]-bt_x) > py[..., -1]
+    catch_capacity = np.where(np.isnan(catch_capacity), np.where(over_crest, np.inf, 0.0), catch_capacity)
+
+    return catch_capacity - failure_volume*swell_factor, valid
+
+# Probability that the swelled failure volume overtops the bund. progress,
+# if given, is called with the samples done and n after each batch.
+def overtopping_probability(standoff, bund_height, slopeheight, slopeangle, crestwidth, bkp, backscarpdist, project, swell_factor, runout_angle, failureangle, failureheight, n=100000, seed=None, batch=100000, bins=50, progress=None):
+    rng = np.random.default_rng(seed)
+
+    margins = []
+    for start in range(0, n, batch):
+        size = min(batch, n-start)
+        margin, valid = parameterised_margin(standoff, bund_height, slopeheight, slopeangle, crestwidth, bkp, backscarpdist, project,
+                                             sample(swell_factor, size, rng), sample(runout_angle, size, rng),
+                                             sample(failureangle, size, rng), sample(failureheight, size, rng))
+        margins.append(margin[valid])
+        if progress is not None:
+            progress(start+size, n)
+
+    margin = np.concatenate(margins)
+    n_overtopping = int(np.count_nonzero(margin < 0))
+    ci_low, ci_high = wilson_interval(n_overtopping, len(margin))
+
+    finite = margin[np.isfinite(margin)]
+    if len(finite):
+        hist_counts, hist_edges = np.histogram(finite, bins=bins)
+    else:
+        hist_counts, hist_edges = np.zeros(0, dtype=int), np.zeros(0)
+
+    return MonteCarloResult(n, len(margin), n_overtopping, n_overtopping/len(margin) if len(margin) else float('nan'),
+                            ci_low, ci_high, margin, hist_counts, hist_edges)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - uploaded profile store
+
+Slope profiles and failure surfaces imported from CSV/TSV files are parsed
+once into float64 arrays and kept server-side under a short hash of their
+content. The app then puts only the handle in the co-ordinate text area,
+
+    @3f2a9c1b0d4e5f67 section.csv (1520 points)
+
+so callbacks post a few bytes instead of the whole section, and
+runout.textarea_to_list reads the co-ordinates back from the store.
+
+Files have x and y columns, comma, tab, semicolon or space delimited, with
+an optional header row. With a header, the columns named x and y are used
+(else the first two), and a part column (as in batch.py's long format)
+picks out the slope or failure rows.
+
+The store is a bounded LRU cache (cache.py). By default it's a SQLite file
+in the temporary directory, so every gunicorn worker on the host can read a
+section uploaded through any of them. Set RUNOUT_PROFILES to another file
+or 'memory', and RUNOUT_PROFILES_SIZE to the number of sections kept
+(default 64). A handle that has been evicted has to be uploaded again.
+
+"""
+import base64
+import csv
+import hashlib
+import io
+import os
+import tempfile
+
+import numpy as np
+
+from cache import open_cache
+from runout import HANDLE_PREFIX
+
+# Characters of the content hash in a handle
+HANDLE_LENGTH = 16
+
+# Store of uploaded sections, opened on first use
+_store = []
+
+def profile_store():
+    if not _store:
+        backend = os.environ.get('RUNOUT_PROFILES', os.path.join(tempfile.gettempdir(), 'runout-profiles.sqlite'))
+        _store.append(open_cache(backend, int(os.environ.get('RUNOUT_PROFILES_SIZE', 64))))
+    return _store[0]
+
+# Rows of a CSV/TSV file, with the delimiter guessed from the first line
+def read_rows(text):
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        raise ValueError('The file is empty')
+    first = lines[0]
+    delimiter = next((d for d in '\t,;' if d in first), None)
+    if delimiter is None:
+        return [line.split() for line in lines]
+    return [[v.strip() for v in row] for row in csv.reader(lines, delimiter=delimiter)]
+
+# x and y of one part of a section file, rounded like textarea_to_list
+def read_section(text, part='slope'):
+    rows = read_rows(text)
+    ix, iy, ipart = 0, 1, None
+    try:
+        float(rows[0][0])
+    except ValueError:
+        header = [h.lower() for h in rows.pop(0)]
+        ix = header.index('x') if 'x' in header else 0
+        iy = header.index('y') if 'y' in header else 1
+        ipart = header.index('part') if 'part' in header else None
+    if ipart is not None:
+        rows = [row for row in rows if row[ipart].strip().lower() == part]
+    if len(rows) < 2:
+        raise ValueError('Need at least 2 {0} points'.format(part))
+    x = np.round(np.array([row[ix] for row in rows], dtype=float), 1)
+    y = np.round(np.array([row[iy] for row in rows], dtype=float), 1)
+    return x, y
+
+# Co-ordinates of a dcc.Upload file ('data:...;base64,...')
+def read_upload(contents, part='slope'):
+    data = base64.b64decode(contents.split(',', 1)[1])
+    return read_section(data.decode('utf-8-sig'), part)
+
+# Store co-ordinates and return their handle text
+def save_profile(x, y, name=''):
+    data = np.concatenate([x, y]).astype('<f8').tobytes()
+    digest = hashlib.sha1(data).hexdigest()[:HANDLE_LENGTH]
+    profile_store().put(digest, data)
+    label = ' {0}'.format(name) if name else ''
+    return '{0}{1}{2} ({3} points)'.format(HANDLE_PREFIX, digest, label, len(x))
+
+# Content hash of a handle text
+def handle_digest(handle):
+    return handle[len(HANDLE_PREFIX):].split()[0]
+
+# Co-ordinates of a handle, as lists like textarea_to_list returns
+def load_profile(handle):
+    data = profile_store().get(handle_digest(handle))
+    if data is None:
+        raise ValueError('Uploaded profile {0} has expired, upload it again'.format(handle_digest(handle)))
+    xy = np.frombuffer(data, dtype='<f8')
+    n = len(xy)//2
+    return xy[:n].tolist(), xy[n:].tolist()
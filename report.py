@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - batch report export
+
+Draws the run-out figure of many sections, for one or more parameter sets,
+and assembles them into a report with a summary table of failure volume,
+catch capacity and margin per page. Figures are styled as in the app
+(figures.py) and rendered in a pool of worker processes. Pages are written
+in order as they come back, with only a few in flight at a time, so memory
+stays flat over wall-length batches of hundreds of sections.
+
+Input is as for batch.py. Every combination of the --standoff,
+--bund-height, --swell-factor and --runout-angle values is a parameter set;
+a section's own parameter columns still take precedence. Output is either
+
+    report.html - one self-contained file: the summary table, then a page
+                  per section and parameter set
+    report/     - a directory of page files, summary.csv and an index.html
+                  with the summary table linking to the pages
+
+Formats svg, png and pdf are static images from plotly's kaleido renderer
+(pip install kaleido); pdf pages need directory output. Format html embeds
+interactive figures and needs nothing extra.
+
+Usage:
+    python report.py sections.csv -o report.html --format svg
+    python report.py sections/ -o report/ --format pdf --standoff 10 18 25
+
+"""
+import argparse
+import base64
+import html
+import importlib.util
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import batch
+import runout
+
+# Page formats and the file extension of each
+FORMATS = {'svg': '.svg', 'png': '.png', 'pdf': '.pdf', 'html': '.html'}
+
+# Figure size in pixels (png is rendered at twice this)
+WIDTH, HEIGHT = 1100, 650
+
+# Pages in flight per worker
+WINDOW = 2
+
+# Columns of the summary table, with their headings
+SUMMARY = [('section_id', 'Section'), ('chainage', 'Chainage'), ('standoff', 'Standoff (m)'), ('bund_height', 'Bund height (m)'),
+           ('swell_factor', 'Swell factor'), ('runout_angle', 'Runout angle (°)'), ('swelled_volume', 'Failure volume (m³/m)'),
+           ('catch_capacity', 'Catch capacity (m³/m)'), ('margin', 'Margin (m³/m)'), ('status', 'Status')]
+
+# Raised when a static format is asked for without kaleido installed
+class RendererMissing(RuntimeError):
+    pass
+
+def check_renderer(fmt):
+    if fmt != 'html' and importlib.util.find_spec('kaleido') is None:
+        raise RendererMissing('{0} pages need kaleido (pip install kaleido), or use --format html'.format(fmt))
+
+# Parameter sets: every combination of the given values of each parameter
+def parameter_sets(values):
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+# Figure of one page as bytes (svg, png, pdf) or an HTML fragment
+def render_figure(fig, fmt, width=WIDTH, height=HEIGHT):
+    if fmt == 'html':
+        return fig.to_html(full_html=False, include_plotlyjs=False, default_width=width, default_height=height)
+    import plotly.io as pio
+    return pio.to_image(fig, format=fmt, width=width, height=height, scale=2 if fmt == 'png' else 1)
+
+# Summary row and rendered figure of one section and parameter set. Runs in
+# a worker process.
+def render_page(section, parameters, fmt, engine=None, width=WIDTH, height=HEIGHT):
+    from figures import runout_figure
+
+    row, res = batch.section_result(section, parameters, engine)
+    if res is None:
+        return row, None
+    fig = runout_figure(res, row['standoff'], row['bund_height'])
+    fig.update_layout(title_text='{0}: {1}'.format(row['section_id'], fig.layout.title.text))
+    return row, render_figure(fig, fmt, width, height)
+
+# Results of fn over items, in order, keeping at most window in flight.
+# Closing it early drops the pages not started yet.
+def ordered_map(pool, fn, items, window):
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(pool.submit(fn, *item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+# Summary value as text
+def cell(row, key):
+    value = row.get(key)
+    if value is None or value == '':
+        return ''
+    if isinstance(value, float):
+        return '{0:.1f}'.format(value)
+    return str(value)
+
+# Summary table as HTML, each section linking to its page (link(row, i))
+def summary_table(rows, link):
+    lines = ['<table><tr>' + ''.join('<th>{0}</th>'.format(html.escape(heading)) for key, heading in SUMMARY) + '</tr>']
+    for i, row in enumerate(rows, 1):
+        cells = [html.escape(cell(row, key)) for key, heading in SUMMARY]
+        cells[0] = '<a href="{0}">{1}</a>'.format(html.escape(link(row, i)), cells[0])
+        style = ' class="over"' if isinstance(row.get('margin'), float) and row['margin'] < 0 else ''
+        lines.append('<tr{0}>'.format(style) + ''.join('<td>{0}</td>'.format(c) for c in cells) + '</tr>')
+    return '\n'.join(lines + ['</table>'])
+
+HTML_HEAD = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>{script}
+<style>
+body {{font-family: Verdana, sans-serif; font-size: 12px; background: #f8f5f0}}
+table {{border-collapse: collapse}} th, td {{border: 1px solid #ccc; padding: 2px 6px; text-align: right}}
+tr.over td {{color: #ee3b34}} .page {{page-break-before: always; margin-top: 20px}}
+.page img, .page svg {{max-width: 100%; height: auto}}
+</style></head><body>
+<h2>{title}</h2>
+'''
+
+# Self-contained HTML report. Pages are spooled to a temporary file as they
+# arrive and copied in after the summary table, which needs every row.
+class HTMLReport:
+    def __init__(self, path, fmt, title='Run-out report'):
+        if fmt == 'pdf':
+            raise ValueError('pdf pages need a directory output')
+        self.path, self.fmt, self.title = path, fmt, title
+        self.rows = []
+        self.pages = tempfile.TemporaryFile('w+', encoding='utf-8')
+
+    def write(self, row, page):
+        self.rows.append(row)
+        n = len(self.rows)
+        self.pages.write('<div class="page" id="page-{0}">'.format(n))
+        if page is None:
+            self.pages.write('<h3>{0}: {1}</h3>'.format(html.escape(str(row['section_id'])), html.escape(row.get('errors') or 'error')))
+        elif self.fmt == 'png':
+            self.pages.write('<img src="data:image/png;base64,{0}">'.format(base64.b64encode(page).decode()))
+        elif self.fmt == 'svg':
+            svg = page.decode('utf-8')
+            self.pages.write(svg[svg.index('<svg'):])
+        else:
+            self.pages.write(page)
+        self.pages.write('</div>\n')
+
+    def close(self):
+        script = ''
+        if self.fmt == 'html':
+            from plotly.offline import get_plotlyjs
+            script = '<script type="text/javascript">{0}</script>'.format(get_plotlyjs())
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(HTML_HEAD.format(title=html.escape(self.title), script=script))
+            f.write(summary_table(self.rows, lambda row, i: '#page-{0}'.format(i)))
+            self.pages.seek(0)
+            shutil.copyfileobj(self.pages, f)
+            f.write('</body></html>\n')
+        self.pages.close()
+
+# Directory of page files, summary.csv and index.html
+class DirectoryReport:
+    def __init__(self, path, fmt, title='Run-out report'):
+        self.path, self.fmt, self.title = path, fmt, title
+        os.makedirs(path, exist_ok=True)
+        self.rows = []
+        self.summary = batch.CSVWriter(os.path.join(path, 'summary.csv'))
+        if fmt == 'html':
+            from plotly.offline import get_plotlyjs
+            with open(os.path.join(path, 'plotly.min.js'), 'w', encoding='utf-8') as f:
+                f.write(get_plotlyjs())
+
+    def page_name(self, row, i):
+        safe = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in str(row['section_id']))
+        return 'page-{0:04d}-{1}{2}'.format(i, safe, FORMATS[self.fmt])
+
+    def write(self, row, page):
+        self.rows.append(row)
+        self.summary.write(row)
+        if page is None:
+            return
+        mode, encoding = ('w', 'utf-8') if self.fmt == 'html' else ('wb', None)
+        with open(os.path.join(self.path, self.page_name(row, len(self.rows))), mode, encoding=encoding) as f:
+            if self.fmt == 'html':
+                f.write(HTML_HEAD.format(title=html.escape(str(row['section_id'])), script='<script src="plotly.min.js"></script>'))
+                f.write(page + '</body></html>\n')
+            else:
+                f.write(page)
+
+    def close(self):
+        self.summary.close()
+        with open(os.path.join(self.path, 'index.html'), 'w', encoding='utf-8') as f:
+            f.write(HTML_HEAD.format(title=html.escape(self.title), script=''))
+            f.write(summary_table(self.rows, self.page_name))
+            f.write('</body></html>\n')
+
+# Render a page per section and parameter set over a process pool, writing
+# each to the report as it comes back. progress, if given, is called with
+# the pages done, the page count and the last row. Returns the number of
+# pages with status ok, warning and error.
+def export_report(sections, sets, report, fmt, workers=None, engine=None, progress=None):
+    check_renderer(fmt)
+    pages = [(section, parameters, fmt, engine) for section in sections for parameters in sets]
+    counts = {'ok': 0, 'warning': 0, 'error': 0}
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = ordered_map(pool, render_page, pages, WINDOW*workers)
+        try:
+            for i, (row, page) in enumerate(results, 1):
+                counts[row['status']] += 1
+                report.write(row, page)
+                if progress is not None:
+                    progress(i, len(pages), row)
+        finally:
+            results.close()
+    report.close()
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export a report of run-out figures for many cross-sections.')
+    parser.add_argument('input', help='long-format CSV/TSV file or directory of section files')
+    parser.add_argument('-o', '--output', default='report.html', help='report file (.html) or directory')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='svg', help='page format (default: svg)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--engine', choices=sorted(runout.ENGINES), default=None, help='geometry engine (default: {0})'.format(runout.ENGINE))
+    parser.add_argument('--standoff', type=float, nargs='+', default=[18])
+    parser.add_argument('--swell-factor', type=float, nargs='+', default=[1.3])
+    parser.add_argument('--bund-height', type=float, nargs='+', default=[2])
+    parser.add_argument('--runout-angle', type=float, nargs='+', default=[37])
+    parser.add_argument('--direction', choices=['left', 'right'], default='left')
+    parser.add_argument('--project', choices=['yes', 'no'], default='yes', help='project run-out to backscarp')
+    parser.add_argument('--title', default='Run-out report')
+    parser.add_argument('--quiet', action='store_true', help='no per-page progress')
+    args = parser.parse_args(argv)
+
+    try:
+        check_renderer(args.format)
+    except RendererMissing as e:
+        raise SystemExit(str(e))
+    if args.format == 'pdf' and args.output.lower().endswith('.html'):
+        raise SystemExit('pdf pages need a directory output')
+
+    sets = parameter_sets({'standoff': args.standoff, 'swell_factor': args.swell_factor, 'bund_height': args.bund_height,
+                           'runout_angle': args.runout_angle, 'direction': [args.direction], 'project': [args.project]})
+    sections = batch.read_sections(args.input)
+    if args.output.lower().endswith('.html'):
+        report = HTMLReport(args.output, args.format, args.title)
+    else:
+        report = DirectoryReport(args.output, args.format, args.title)
+
+    start = time.time()
+    def progress(i, n, row):
+        if not args.quiet:
+            message = ' ({0})'.format(row['errors']) if row.get('errors') else ''
+            print('[{0}/{1} {2:.1f}s] {3} {4}{5}'.format(i, n, time.time()-start, row['section_id'], row['status'], message), file=sys.stderr)
+
+    counts = export_report(sections, sets, report, args.format, args.workers, args.engine, progress)
+    print('{0} pages: {1} ok, {2} with warnings, {3} errors -> {4}'.format(sum(counts.values()), counts['ok'], counts['warning'], counts['error'], args.output), file=sys.stderr)
+    return 1 if counts['error'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - results store
+
+On-disk columnar store of run-out results, so pit-wide questions ("which
+sections overtop?", "what bund height is needed at chainage 1250?") are
+answered from earlier runs instead of recomputing them. batch.py writes
+to it with --store, and the app adds every result it calculates when
+RUNOUT_RESULTS names a store.
+
+A store is a directory of one raw little-endian file per column, memory
+mapped on demand, and a small JSON manifest with the row count. Text and
+polygon columns are ragged: a data file plus an offsets file (rows + 1
+int64). Polygons are float32 x, y pairs relative to the toe of the slope,
+which is kept in float64. Reopening a store reads the manifest only, so it
+takes about a millisecond whatever the number of results.
+
+Rows are appended under a lock file, data before the manifest, so readers
+only ever see whole rows. A result whose inputs hash is already stored is
+skipped. Sorted permutations of the keys and chainages make the index;
+rows appended since it was last built are scanned directly, and it is
+rebuilt once they pass INDEX_TAIL.
+
+Usage:
+    python results.py store/ --info
+    python results.py store/ --where "margin<0" --columns section_id chainage margin
+    python results.py store/ --bund-height-at 1250 --where standoff=18
+
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# Fixed width columns and their dtypes
+COLUMNS = {
+    'key': 'S20',
+    'time': '<f8',
+    'chainage': '<f8',
+    'standoff': '<f8',
+    'swell_factor': '<f8',
+    'bund_height': '<f8',
+    'runout_angle': '<f8',
+    'direction': 'u1',
+    'project': 'u1',
+    'status': 'u1',
+    'failure_volume': '<f8',
+    'swelled_volume': '<f8',
+    'catch_capacity': '<f8',
+    'margin': '<f8',
+    'ix': '<f8',
+    'iy': '<f8',
+    'toe_x': '<f8',
+    'toe_y': '<f8',
+}
+
+# Ragged columns: utf-8 text, and polygons as float32 x, y pairs
+TEXT = ['section_id', 'errors']
+POLYGONS = ['fv', 'cc']
+
+# Codes of the small categorical columns
+CODES = {'direction': ['left', 'right'], 'project': ['no', 'yes'], 'status': ['ok', 'warning', 'error']}
+
+# Rows appended since the index was built before it is rebuilt
+INDEX_TAIL = 4096
+
+MANIFEST = 'manifest.json'
+VERSION = 1
+
+# Inputs hash of a section and its run-out parameters (sha1, as hex);
+# extra values (e.g. the simplify tolerance) are hashed in too
+def section_key(sp_x, sp_y, fs_x, fs_y, parameters, extra=()):
+    digest = hashlib.sha1()
+    for values in (sp_x, sp_y, fs_x or [], fs_y or []):
+        digest.update(np.asarray(values, dtype='<f8').tobytes())
+        digest.update(b'|')
+    inputs = [float(parameters[name]) for name in ('standoff', 'swell_factor', 'bund_height', 'runout_angle')]
+    digest.update(json.dumps([VERSION, inputs, parameters['direction'], parameters['project'], list(extra)]).encode())
+    return digest.hexdigest()
+
+# Polygons of a RunoutResult and the toe they are stored relative to
+def result_shapes(res):
+    if not res.profile_ok:
+        return {}
+    return {'toe_x': res.sp_x[0], 'toe_y': res.sp_y[0],
+            'fv': (res.fv_x, res.fv_y) if res.volume_ok else None,
+            'cc': (res.cc_x, res.cc_y) if res.catch_ok else None}
+
+# Store record of a result row: batch.py's output row with its store fields
+# ('key' and the result_shapes of its RunoutResult)
+def row_record(row):
+    record = {name: row.get(name) for name in list(COLUMNS) + POLYGONS}
+    record.update(time=row.get('time') or time.time(), section_id=str(row.get('section_id') or ''), errors=row.get('errors') or '')
+    return record
+
+# Column value as stored: floats with None as NaN, codes for categories
+def encode(name, value):
+    if name == 'key':
+        return bytes.fromhex(value) if isinstance(value, str) else value
+    if name in CODES:
+        return CODES[name].index(value) if value in CODES[name] else 255
+    return np.nan if value is None or value == '' else float(value)
+
+# Exclusive lock on a file, for appends from several processes
+@contextmanager
+def locked(path):
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+class ResultStore:
+    def __init__(self, path, create=True):
+        self.path = path
+        if not os.path.exists(os.path.join(path, MANIFEST)):
+            if not create:
+                raise FileNotFoundError('No results store at {0}'.format(path))
+            os.makedirs(path, exist_ok=True)
+            with locked(os.path.join(path, 'lock')):
+                if not os.path.exists(os.path.join(path, MANIFEST)):
+                    self.write_manifest({'version': VERSION, 'rows': 0, 'indexed': 0})
+        self.refresh()
+
+    # Re-read the manifest, picking up rows appended by other processes
+    def refresh(self):
+        with open(os.path.join(self.path, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest['version'] != VERSION:
+            raise ValueError('Results store version {0}, expected {1}'.format(manifest['version'], VERSION))
+        self.rows, self.indexed = manifest['rows'], manifest['indexed']
+        self.maps = {}
+
+    def write_manifest(self, manifest):
+        temp = os.path.join(self.path, MANIFEST + '.tmp')
+        with open(temp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temp, os.path.join(self.path, MANIFEST))
+
+    def __len__(self):
+        return self.rows
+
+    # Memory map of count items of a column file (empty if there are none)
+    def mapped(self, name, dtype, count):
+        if (name, count) not in self.maps:
+            if count == 0:
+                self.maps[name, count] = np.zeros(0, dtype=dtype)
+            else:
+                self.maps[name, count] = np.memmap(os.path.join(self.path, name), dtype=dtype, mode='r', shape=(count,))
+        return self.maps[name, count]
+
+    # Fixed width column, memory mapped
+    def column(self, name):
+        return self.mapped(name, COLUMNS[name], self.rows)
+
+    def offsets(self, name):
+        return self.mapped(name + '.offsets', '<i8', self.rows+1 if self.rows else 0)
+
+    def text(self, name, i):
+        offsets = self.offsets(name)
+        data = self.mapped(name + '.data', 'u1', int(offsets[-1]))
+        return bytes(data[offsets[i]:offsets[i+1]]).decode('utf-8')
+
+    # Polygon of row i as absolute x, y arrays, None if not stored
+    def polygon(self, name, i):
+        offsets = self.offsets(name)
+        if offsets[i] == offsets[i+1]:
+            return None
+        xy = self.mapped(name + '.data', '<f4', int(offsets[-1]))[offsets[i]:offsets[i+1]].astype(float)
+        return xy[0::2] + self.column('toe_x')[i], xy[1::2] + self.column('toe_y')[i]
+
+    # Column values decoded for output
+    def value(self, name, i):
+        if name in TEXT:
+            return self.text(name, i)
+        if name in POLYGONS:
+            return self.polygon(name, i)
+        value = self.column(name)[i]
+        if name == 'key':
+            return value.hex()
+        if name in CODES:
+            return CODES[name][value] if value < len(CODES[name]) else None
+        return None if np.isnan(value) else float(value)
+
+    def records(self, indices, columns=None):
+        columns = columns or list(COLUMNS) + TEXT
+        return [{name: self.value(name, int(i)) for name in columns} for i in indices]
+
+    # Index (sorted permutation) of a column, and the rows it covers
+    def index(self, name):
+        order = self.mapped(name + '.index', '<i8', self.indexed)
+        return order, self.column(name)[:self.indexed]
+
+    # Row of an inputs hash, None if it isn't stored
+    def find(self, key):
+        key = encode('key', key)
+        order, keys = self.index('key')
+        i = int(keys.searchsorted(key, sorter=order)) if len(order) else 0
+        if i < len(order) and keys[order[i]] == key:
+            return int(order[i])
+        tail = np.flatnonzero(self.column('key')[self.indexed:] == key)
+        return int(self.indexed + tail[0]) if len(tail) else None
+
+    # Rows matching every filter: column=value, or column=(op, value) with
+    # op one of < <= > >= == != or ('between', low, high)
+    def where(self, **filters):
+        return self.matching(None, filters)
+
+    # Those of rows (None for all) matching filters
+    def matching(self, rows, filters):
+        mask = np.ones(self.rows if rows is None else len(rows), dtype=bool)
+        for name, condition in filters.items():
+            if not isinstance(condition, tuple):
+                condition = ('==', condition)
+            op, values = condition[0], [encode(name, v) for v in condition[1:]]
+            column = self.column(name) if rows is None else self.column(name)[rows]
+            if op == 'between':
+                mask &= (column >= values[0]) & (column <= values[1])
+            elif op in ('==', '='):
+                mask &= np.isclose(column, values[0]) if column.dtype.kind == 'f' else column == values[0]
+            else:
+                mask &= {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal, '!=': np.not_equal}[op](column, values[0])
+        return np.flatnonzero(mask) if rows is None else rows[mask]
+
+    # Rows at the stored chainage nearest to chainage
+    def nearest_chainage(self, chainage):
+        order, chainages = self.index('chainage')
+        tail = self.column('chainage')[self.indexed:]
+        candidates = []
+        if len(order):
+            i = int(chainages.searchsorted(chainage, sorter=order))
+            candidates += [chainages[order[j]] for j in (i-1, i) if 0 <= j < len(order)]
+        if len(tail) and not np.isnan(tail).all():
+            candidates.append(tail[np.nanargmin(np.abs(tail-chainage))])
+        candidates = [c for c in candidates if not np.isnan(c)]
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+        nearest = min(candidates, key=lambda c: abs(c-chainage))
+        first = chainages.searchsorted(nearest, side='left', sorter=order) if len(order) else 0
+        last = chainages.searchsorted(nearest, side='right', sorter=order) if len(order) else 0
+        return np.concatenate([np.sort(order[first:last]), self.indexed + np.flatnonzero(tail == nearest)]).astype(np.int64)
+
+    # Least stored bund height whose result holds the swelled volume at the
+    # section nearest chainage, among rows matching filters (see where).
+    # Returns (bund height, row), or None if no stored result holds it.
+    def bund_height_needed(self, chainage, **filters):
+        rows = self.matching(self.nearest_chainage(chainage), filters)
+        rows = rows[self.column('margin')[rows] >= 0]
+        if not len(rows):
+            return None
+        i = int(rows[np.argmin(self.column('bund_height')[rows])])
+        return float(self.column('bund_height')[i]), i
+
+    # Append records (see row_record) not stored yet. Returns the number added.
+    def append(self, records):
+        with locked(os.path.join(self.path, 'lock')):
+            self.refresh()
+            keys = set()
+            new = []
+            for record in records:
+                key = encode('key', record['key'])
+                if key not in keys and self.find(key) is None:
+                    keys.add(key)
+                    new.append(record)
+            if new:
+                self.write_rows(new)
+                manifest = {'version': VERSION, 'rows': self.rows + len(new), 'indexed': self.indexed}
+                self.write_manifest(manifest)
+                self.refresh()
+                if self.rows - self.indexed > INDEX_TAIL:
+                    self.reindex()
+            return len(new)
+
+    def write_rows(self, records):
+        for name, dtype in COLUMNS.items():
+            values = np.array([encode(name, r.get(name)) for r in records], dtype=dtype)
+            self.append_file(name, self.rows*values.itemsize, values)
+        for name in TEXT + POLYGONS:
+            start = int(self.offsets(name)[-1]) if self.rows else 0
+            chunks = [self.ragged(name, r) for r in records]
+            ends = start + np.cumsum([len(c) for c in chunks])
+            if not self.rows:
+                ends = np.concatenate([[0], ends])
+            self.append_file(name + '.data', start*chunks[0].itemsize, np.concatenate(chunks))
+            self.append_file(name + '.offsets', 8*(self.rows+1 if self.rows else 0), ends.astype('<i8'))
+
+    # Items of a ragged column for one record (bytes, or float32 x, y pairs)
+    @staticmethod
+    def ragged(name, record):
+        if name in TEXT:
+            return np.frombuffer(record.get(name, '').encode('utf-8'), dtype='u1')
+        polygon = record.get(name)
+        if polygon is None or polygon[0] is None:
+            return np.zeros(0, dtype='<f4')
+        x = np.asarray(polygon[0], dtype=float) - record['toe_x']
+        y = np.asarray(polygon[1], dtype=float) - record['toe_y']
+        return np.column_stack([x, y]).astype('<f4').ravel()
+
+    # Append values to a column file after its first size bytes, dropping
+    # anything an earlier writer left past the stored rows
+    def append_file(self, name, size, values):
+        path = os.path.join(self.path, name)
+        with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+            f.truncate(size)
+            f.seek(size)
+            f.write(values.tobytes())
+
+    # Rebuild the sorted permutations of the keys and chainages
+    def reindex(self):
+        for name in ('key', 'chainage'):
+            order = np.argsort(self.column(name), kind='stable').astype('<i8')
+            temp = os.path.join(self.path, name + '.index.tmp')
+            order.tofile(temp)
+            os.replace(temp, os.path.join(self.path, name + '.index'))
+        self.write_manifest({'version': VERSION, 'rows': self.rows, 'indexed': self.rows})
+        self.refresh()
+
+# Store named by RUNOUT_RESULTS (or path), None if neither is set
+def open_store(path=None, create=True):
+    path = path or os.environ.get('RUNOUT_RESULTS')
+    if not path:
+        return None
+    return ResultStore(path, create)
+
+# Filter expressions like margin<0, standoff=18 or chainage=100..200 as
+# where() keyword arguments
+def parse_filters(expressions):
+    filters = {}
+    for expression in expressions or []:
+        match = re.match(r'^\s*(\w+)\s*(<=|>=|!=|==|<|>|=)\s*(.+?)\s*$', expression)
+        if not match:
+            raise ValueError('Bad filter: {0}'.format(expression))
+        name, op, value = match.groups()
+        if name not in COLUMNS:
+            raise ValueError('Unknown column: {0}'.format(name))
+        if '..' in value and op == '=':
+            low, high = value.split('..')
+            filters[name] = ('between', float(low), float(high))
+        else:
+            filters[name] = (op, value if name in CODES or name == 'key' else float(value))
+    return filters
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query a run-out results store.')
+    parser.add_argument('store', help='results store directory')
+    parser.add_argument('--info', action='store_true', help='print the number of results and columns')
+    parser.add_argument('--where', nargs='+', default=[], metavar='FILTER', help='filters such as margin<0, standoff=18 or chainage=100..200')
+    parser.add_argument('--columns', nargs='+', default=['section_id', 'chainage', 'standoff', 'bund_height', 'swelled_volume', 'catch_capacity', 'margin', 'status'])
+    parser.add_argument('--bund-height-at', type=float, metavar='CHAINAGE', help='least stored bund height that holds the failure at the nearest section')
+    parser.add_argument('--reindex', action='store_true', help='rebuild the index')
+    args = parser.parse_args(argv)
+
+    try:
+        store = ResultStore(args.store, create=False)
+        filters = parse_filters(args.where)
+    except (FileNotFoundError, ValueError) as e:
+        raise SystemExit(str(e))
+
+    if args.reindex:
+        with locked(os.path.join(store.path, 'lock')):
+            store.refresh()
+            store.reindex()
+    if args.info:
+        print('{0} results ({1} indexed) in {2}'.format(len(store), store.indexed, store.path))
+        print('columns: ' + ', '.join(list(COLUMNS) + TEXT + POLYGONS))
+        return 0
+    if args.bund_height_at is not None:
+        found = store.bund_height_needed(args.bund_height_at, **filters)
+        if found is None:
+            print('No stored result holds the failure near chainage {0}'.format(args.bund_height_at))
+            return 1
+        height, i = found
+        record = store.records([i])[0]
+        print('Bund height {0:.1f} m at {1} (chainage {2}, standoff {3} m, margin {4:.1f} m³/m)'.format(
+              height, record['section_id'], record['chainage'], record['standoff'], record['margin']))
+        return 0
+
+    writer = csv.DictWriter(sys.stdout, fieldnames=args.columns, extrasaction='ignore')
+    writer.writeheader()
+    for record in store.records(store.where(**filters), args.columns):
+        writer.writerow(record)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
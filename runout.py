@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - geometry and volume calculations
+
+Headless core of the calculator. Everything in here returns numbers and
+co-ordinate arrays only, so batch scripts can use it without building
+plotly figures. The Dash app renders the result in app.py.
+
+"""
+import importlib.util
+import math
+import os
+from dataclasses import dataclass, field
+
+import numpy as np
+
+import geometry
+from curves import curved_surface
+from geometry import BUND_ANGLE, RUNOUT_LENGTH
+from simplify import simplify_section
+import metrics
+from metrics import stage
+
+# shapely is only needed for the 'shapely' geometry engine, and is imported
+# by its functions on first use (or by load_engine) to keep startup short
+SHAPELY = importlib.util.find_spec('shapely') is not None
+
+# Geometry engine used when compute_runout isn't given one ('shapely' or 'numpy')
+ENGINE = os.environ.get('RUNOUT_ENGINE', 'shapely' if SHAPELY else 'numpy')
+
+# Start of an uploaded profile's handle in a text area (see profiles.py)
+HANDLE_PREFIX = '@'
+
+# Text area delimiter
+def textarea_to_list(textarea_string):
+    if textarea_string.startswith(HANDLE_PREFIX):
+        from profiles import load_profile
+        return load_profile(textarea_string)
+    list0 = textarea_string.replace('\t',',').replace('\n',',').split(',')
+    list0_float = [round(float(x),1) for x in list0]
+    spx = list0_float[::2]
+    spy = list0_float[1::2]
+    return spx, spy
+
+# Returns index of point on slope profile that is closest to the defined point
+def minimum_distance(x0, y0, xl, yl):
+    return geometry.nearest_node(x0, y0, np.asarray(xl, dtype=float), np.asarray(yl, dtype=float))
+
+# Converts two lists into tuple pairs
+def merge(list1, list2):
+    merged_list = tuple(zip(list1, list2))
+    return merged_list
+
+# Convert shapely polygon into 2D numpy array for plotting purposes
+def polygon_to_patch(polygon):
+    x, y = polygon.exterior.xy
+    xn, yn = np.array(x), np.array(y)
+    return xn, yn
+
+# Result of a single run-out calculation. Geometry that could not be
+# calculated is left as None and the matching *_ok flag is False.
+@dataclass
+class RunoutResult:
+    # Slope profile and failure surface (as entered / generated)
+    sp_x: list = None
+    sp_y: list = None
+    fs_x: list = None
+    fs_y: list = None
+
+    # Bund outline and the bund crest the run-out line is cast from
+    b_x: list = None
+    b_y: list = None
+    bt_x: float = None
+    bt_y: float = None
+
+    # Failure volume polygon and areas (m³/m)
+    fv_x: np.ndarray = None
+    fv_y: np.ndarray = None
+    failure_volume: float = None
+    swelled_volume: float = None
+
+    # Catch capacity polygon, area (m³/m) and run-out intersection point
+    cc_x: np.ndarray = None
+    cc_y: np.ndarray = None
+    catch_capacity: float = None
+    ix: float = None
+    iy: float = None
+
+    # Status flags, one per stage of the calculation
+    profile_ok: bool = False
+    failure_ok: bool = False
+    volume_ok: bool = False
+    catch_ok: bool = False
+    errors: list = field(default_factory=list)
+
+    # Area between the entered and simplified geometry (m²/m), if simplified
+    simplify_error: float = None
+
+    # Spare catch capacity after the swelled failure volume is placed (m³/m)
+    @property
+    def margin(self):
+        if self.catch_capacity is None or self.swelled_volume is None:
+            return None
+        return self.catch_capacity - self.swelled_volume
+
+# Slope profile and failure surface from the parameterised inputs. With a
+# curve (see curves.py), the basal structure is bent into a circular or
+# log-spiral slip surface below it.
+def parameterised_geometry(slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, curve=None):
+    adj = slopeheight/math.tan(math.radians(slopeangle))
+    dl_x = failureheight/math.tan(math.radians(slopeangle))
+    m = math.tan(math.radians(failureangle))
+    c = failureheight-m*dl_x
+
+    crest_x = (slopeheight-c)/m
+    bkp_x = adj+backscarpdist
+    bkp_y1 = m*bkp_x + c
+    bkp_y2 = math.tan(math.radians(slopeangle))*bkp_x
+
+    if bkp == 'yes' and bkp_x < crest_x:
+        if backscarpdist >= 0:
+            sp_x, sp_y = [0, dl_x, adj, bkp_x, adj+crestwidth], [0, failureheight, slopeheight, slopeheight, slopeheight]
+            fs_x, fs_y = [dl_x, bkp_x, bkp_x], [failureheight, bkp_y1, slopeheight]
+        else:
+            sp_x, sp_y = [0, dl_x, bkp_x, adj, adj+crestwidth], [0, failureheight, bkp_y2, slopeheight, slopeheight]
+            fs_x, fs_y = [dl_x, bkp_x, bkp_x], [failureheight, bkp_y1, bkp_y2]
+    else:
+        sp_x, sp_y = [0, dl_x, adj, crest_x, adj+crestwidth], [0, failureheight, slopeheight, slopeheight, slopeheight]
+        fs_x, fs_y = [dl_x, crest_x], [failureheight, slopeheight]
+
+    if curve is not None:
+        fs_x, fs_y = curved_surface(curve, fs_x, fs_y)
+    return sp_x, sp_y, fs_x, fs_y
+
+# Slope profile and failure surface from the textareas or the parameterised inputs
+def section_geometry(spxy, fsxy, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, curve=None):
+    if manual == 'manual':
+        sp_x, sp_y = textarea_to_list(spxy)
+        fs_x, fs_y = textarea_to_list(fsxy)
+        return sp_x, sp_y, fs_x, fs_y
+    return parameterised_geometry(slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, curve)
+
+# Bund co-ordinates at the toe of the slope, and the point the run-out starts from
+def bund_geometry(sp_x, sp_y, standoff, bund_height, right):
+    bund_width = 2*bund_height/math.tan(math.radians(BUND_ANGLE))
+
+    if right:
+        b_x = [standoff+sp_x[0]]
+    else:
+        b_x = [-standoff+sp_x[0]]
+
+    b_y = [sp_y[0]]
+
+    # Start of run-out
+    if bund_height > 0:
+        if right:
+            b_x.extend([b_x[0]-0.5*bund_width,
+                   b_x[0]-1.0*bund_width])
+        else:
+            b_x.extend([b_x[0]+0.5*bund_width,
+                   b_x[0]+1.0*bund_width])
+
+        b_y.extend([b_y[0]+bund_height, b_y[0]])
+
+        bt_x, bt_y = b_x[1], b_y[1]
+    else:
+        bt_x, bt_y = b_x[0], b_y[0]
+
+    return b_x, b_y, bt_x, bt_y
+
+# Failure volume polygon and the post-failure surface the run-out is cast onto
+def failure_geometry(sp_x, sp_y, fs_x, fs_y, project):
+    from shapely.ops import split, linemerge
+    from shapely.geometry import LineString, Polygon, Point
+
+    fs_x, fs_y = list(fs_x), list(fs_y)
+
+    # Snap failure surface end points to slope profile nodes
+    with stage('snap'):
+        i_start = minimum_distance(fs_x[0], fs_y[0], sp_x, sp_y)
+        i_end = minimum_distance(fs_x[-1], fs_y[-1], sp_x, sp_y)
+
+    # Intersection point 1
+    ix1, iy1 = sp_x[i_start], sp_y[i_start]
+    fs_x[0], fs_y[0] = ix1, iy1
+    i1 = Point(ix1, iy1)
+
+    # Interseciton point 2
+    ix2, iy2 = sp_x[i_end], sp_y[i_end]
+    fs_x[-1], fs_y[-1] = ix2, iy2
+    i2 = Point(ix2, iy2)
+
+    with stage('failure_polygon'):
+        # Failure surface as LineString
+        fs_ls = LineString(merge(fs_x, fs_y))
+
+        # Slope profile as line string
+        sp_ls = LineString(merge(sp_x, sp_y))
+
+        # Check if first point of failure surface co-incides with first point of slope profile
+        bool1 = (ix1 == sp_x[0] and iy1 == sp_y[0])
+        bool2 = (ix2 == sp_x[-1] and iy2 == sp_y[-1])
+        if bool1 and bool2:
+            sp_lsf = sp_ls
+            linestrings = [fs_ls]
+        elif bool1:
+            sp_lsf, sp_lsc = split(sp_ls, i2).geoms
+            linestrings = [fs_ls, sp_lsc]
+        elif bool2:
+            sp_lsc, sp_lsf = split(sp_ls, i1).geoms
+            linestrings = [sp_lsc, fs_ls]
+        else:
+            sp_ls1, sp_ls2 = split(sp_ls, i1).geoms
+            sp_lsf, sp_ls3 = split(sp_ls2, i2).geoms
+            linestrings = [sp_ls1, fs_ls, sp_ls3]
+
+        # Linestring with slope profile and failure surface combined
+        if project == 'yes':
+            line_combined = LineString(linemerge(linestrings))
+        else:
+            line_combined = sp_ls
+
+        failure_volume = Polygon(linemerge([sp_lsf, fs_ls]))
+        fv_x, fv_y = polygon_to_patch(failure_volume)
+    return fv_x, fv_y, failure_volume.area, line_combined
+
+# Catch capacity polygon between the bund, the run-out line and the surface behind it
+def catch_geometry(line_combined, b_x, b_y, bt_x, bt_y, bund_height, runout_angle, right):
+    from shapely.ops import linemerge, substring
+    from shapely.geometry import LineString, Polygon, Point
+
+    #  Find intersection point between run-out line and combined surface
+    if right: runout_angle = 180-runout_angle
+    with stage('intersection'):
+        ro_x = [bt_x, bt_x+RUNOUT_LENGTH*math.cos(math.radians(runout_angle))]
+        ro_y = [bt_y, bt_y+RUNOUT_LENGTH*math.sin(math.radians(runout_angle))]
+        line_runout = LineString(merge(ro_x, ro_y))
+
+        intersect = line_runout.intersection(line_combined)
+
+        # Runout line may encounter more than one intersection point; material
+        # stops at the first one along the line from the bund crest
+        points = [g for g in getattr(intersect, 'geoms', [intersect]) if g.geom_type == 'Point']
+        crest = Point(bt_x, bt_y)
+        intersect = min(points, key=crest.distance)
+        ix, iy = intersect.x, intersect.y
+
+    # Run-out line starting on the toe of the profile catches nothing
+    distance = line_combined.project(intersect)
+    if distance == 0:
+        return np.array([bt_x, ix]), np.array([bt_y, iy]), 0.0, ix, iy
+
+    # Calculate catch capacity, from the profile cut at the intersection
+    with stage('catch_polygon'):
+        line_profile = substring(line_combined, 0, distance)
+        line_profile = LineString(list(line_profile.coords)[:-1] + [(ix, iy)])
+        if bund_height > 0:
+            line_profile2 = LineString([(b_x[2], b_y[2]), (bt_x, bt_y), (ix, iy)])
+        else:
+            line_profile2 = LineString([(bt_x, bt_y), (ix, iy)])
+        catch_capacity = Polygon(linemerge([line_profile, line_profile2]))
+        cc_x, cc_y = polygon_to_patch(catch_capacity)
+    return cc_x, cc_y, catch_capacity.area, ix, iy
+
+# Slope profile as line string, used when the failure surface can't be combined with it
+def profile_line(sp_x, sp_y):
+    from shapely.geometry import LineString
+    return LineString(merge(sp_x, sp_y))
+
+# Failure volume, catch capacity and fallback profile functions of each geometry engine
+ENGINES = {
+    'shapely': (failure_geometry, catch_geometry, profile_line),
+    'numpy': (geometry.failure_geometry, geometry.catch_geometry, geometry.profile_line),
+}
+
+# Import what an engine needs ahead of its first calculation (see app.warm)
+def load_engine(engine=None):
+    if (engine or ENGINE) == 'shapely':
+        import shapely.geometry
+        import shapely.ops
+
+# Run-out calculation for one section given as co-ordinate lists. fs_x and
+# fs_y are None if no failure surface could be read. With a tolerance, the
+# geometry is simplified first (see simplify.py).
+def compute_section(standoff, swell_factor, bund_height, runout_angle, sp_x, sp_y, fs_x, fs_y, right, project, engine=None, tolerance=None, simplify_method='dp'):
+
+    failure_fn, catch_fn, profile_fn = ENGINES[engine or ENGINE]
+    res = RunoutResult()
+
+    # Simplify dense profiles before the geometry stage
+    if tolerance:
+        try:
+            with stage('simplify'):
+                sp_x, sp_y, fs_x, fs_y, res.simplify_error = simplify_section(sp_x, sp_y, fs_x, fs_y, tolerance, simplify_method)
+        except Exception:
+            res.errors.append('Simplification error')
+            metrics.error('simplification')
+
+    # Slope profile and bund
+    try:
+        res.b_x, res.b_y, res.bt_x, res.bt_y = bund_geometry(sp_x, sp_y, standoff, bund_height, right)
+        res.sp_x, res.sp_y = sp_x, sp_y
+        res.profile_ok = True
+    except Exception:
+        res.errors.append('No slope profile entered')
+        metrics.error('no_slope_profile')
+        return res
+
+    if fs_x is not None:
+        res.fs_x, res.fs_y = fs_x, fs_y
+        res.failure_ok = True
+    else:
+        res.errors.append('No failure surface entered')
+        metrics.error('no_failure_surface')
+
+    # FAILURE VOLUME calculations
+    try:
+        res.fv_x, res.fv_y, res.failure_volume, line_combined = failure_fn(sp_x, sp_y, fs_x, fs_y, project)
+        res.swelled_volume = res.failure_volume*swell_factor
+        res.volume_ok = True
+    except Exception:
+        res.errors.append('Intersection error')
+        metrics.error('intersection')
+        # Use the slope profile, as combined surface with failure surface didn't work out
+        line_combined = profile_fn(sp_x, sp_y)
+
+    # CATCH CAPACITY calculations
+    try:
+        res.cc_x, res.cc_y, res.catch_capacity, res.ix, res.iy = catch_fn(line_combined, res.b_x, res.b_y, res.bt_x, res.bt_y, bund_height, runout_angle, right)
+        res.catch_ok = True
+    except Exception:
+        res.errors.append('Catch capacity error')
+        metrics.error('catch_capacity')
+
+    return res
+
+# Main function. curve bends the parameterised failure surface (curves.py).
+def compute_runout(standoff, swell_factor, bund_height, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, engine=None, tolerance=None, simplify_method='dp', curve=None):
+
+    right = direction == 'right' and manual == 'manual'
+
+    # Slope profile and failure surface
+    fs_x = fs_y = None
+    try:
+        if manual == 'manual':
+            with stage('parse'):
+                sp_x, sp_y = textarea_to_list(spxy)
+        else:
+            with stage('profile'):
+                sp_x, sp_y, fs_x, fs_y = parameterised_geometry(slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist)
+    except Exception:
+        res = RunoutResult()
+        res.errors.append('No slope profile entered')
+        metrics.error('no_slope_profile')
+        return res
+
+    if manual == 'manual':
+        try:
+            with stage('parse'):
+                fs_x, fs_y = textarea_to_list(fsxy)
+        except Exception:
+            pass
+
+    # A curve that doesn't fit (too deep for the basal structure) leaves no failure surface
+    curve_error = None
+    if curve is not None and manual != 'manual':
+        try:
+            with stage('curve'):
+                fs_x, fs_y = curved_surface(curve, fs_x, fs_y)
+        except ValueError as e:
+            fs_x = fs_y = None
+            curve_error = str(e)
+            metrics.error('failure_curve')
+
+    res = compute_section(standoff, swell_factor, bund_height, runout_angle, sp_x, sp_y, fs_x, fs_y, right, project, engine, tolerance, simplify_method)
+    if curve_error:
+        res.errors.insert(0, curve_error)
+    return res
+
+# Compares the shapely and numpy engines on one set of inputs. Returns the
+# names of the results that differ by more than tol (m or m³/m).
+def compare_engines(*args, tol=1e-6):
+    a = compute_runout(*args, engine='shapely')
+    b = compute_runout(*args, engine='numpy')
+    mismatches = []
+    for name in ['profile_ok', 'failure_ok', 'volume_ok', 'catch_ok']:
+        if getattr(a, name) != getattr(b, name):
+            mismatches.append(name)
+    for name in ['failure_volume', 'swelled_volume', 'catch_capacity', 'ix', 'iy']:
+        va, vb = getattr(a, name), getattr(b, name)
+        if (va is None) != (vb is None) or (va is not None and abs(va-vb) > tol):
+            mismatches.append(name)
+    return mismatches
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - profile simplification
+
+Thins dense (drone / LiDAR) slope profiles and failure surfaces before the
+geometry stage. The nodes the failure surface snaps to are kept as fixed
+vertices so the failure volume is cut at the same points, and the area
+between the original and simplified polylines is reported as the error
+introduced (m²/m, i.e. m³/m of volume).
+
+Methods:
+    'dp' - Douglas-Peucker, tolerance is the maximum offset of a dropped node (m)
+    'vw' - Visvalingam-Whyatt, tolerance is the smallest triangle area kept (m²)
+
+"""
+import heapq
+
+import numpy as np
+
+from geometry import nearest_node
+
+# Distances of points from the segment (x0, y0) - (x1, y1)
+def segment_distance(px, py, x0, y0, x1, y1):
+    dx, dy = x1-x0, y1-y0
+    length2 = dx*dx + dy*dy
+    if length2 == 0:
+        return np.hypot(px-x0, py-y0)
+    t = np.clip(((px-x0)*dx + (py-y0)*dy)/length2, 0, 1)
+    return np.hypot(px-(x0+t*dx), py-(y0+t*dy))
+
+# Indices of the nodes kept by Douglas-Peucker. End points and fixed nodes are always kept.
+def douglas_peucker(x, y, tolerance, fixed=()):
+    keep = np.zeros(len(x), dtype=bool)
+    keep[[0, -1]] = True
+    keep[list(fixed)] = True
+
+    anchors = np.flatnonzero(keep)
+    stack = list(zip(anchors[:-1], anchors[1:]))
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        d = segment_distance(x[i+1:j], y[i+1:j], x[i], y[i], x[j], y[j])
+        k = int(np.argmax(d))
+        if d[k] > tolerance:
+            k += i+1
+            keep[k] = True
+            stack.extend([(i, k), (k, j)])
+    return np.flatnonzero(keep)
+
+# Indices of the nodes kept by Visvalingam-Whyatt. End points and fixed nodes are always kept.
+def visvalingam(x, y, tolerance, fixed=()):
+    n = len(x)
+    fixed = set(fixed) | {0, n-1}
+    prev, nxt = list(range(-1, n-1)), list(range(1, n+1))
+    removed = [False]*n
+
+    # Initial triangle areas in one pass, then plain floats for the heap loop
+    areas = np.full(n, np.inf)
+    areas[1:-1] = 0.5*np.abs((x[:-2]-x[1:-1])*(y[2:]-y[1:-1]) - (x[2:]-x[1:-1])*(y[:-2]-y[1:-1]))
+    areas = areas.tolist()
+    x, y = x.tolist(), y.tolist()
+
+    def area(i):
+        a, b = prev[i], nxt[i]
+        return 0.5*abs((x[a]-x[i])*(y[b]-y[i]) - (x[b]-x[i])*(y[a]-y[i]))
+
+    heap = [(areas[i], i) for i in range(1, n-1) if i not in fixed and areas[i] < tolerance]
+    heapq.heapify(heap)
+    while heap:
+        a, i = heapq.heappop(heap)
+        if removed[i] or a != areas[i]:
+            continue
+        removed[i] = True
+        p, q = prev[i], nxt[i]
+        nxt[p], prev[q] = q, p
+        for j in (p, q):
+            if j not in fixed:
+                areas[j] = area(j)
+                if areas[j] < tolerance:
+                    heapq.heappush(heap, (areas[j], j))
+    return np.flatnonzero(~np.array(removed))
+
+# Area between a polyline and its simplification through the kept nodes.
+# Each segment is measured against the chord it was dropped to, in the
+# chord's own frame (trapezoids down to the chord), and split where it
+# crosses the chord; the runs on either side are lobes, whose areas are
+# added as absolute values so that lobes either side of a chord don't cancel.
+def area_error(x, y, kept):
+    k = np.arange(len(x)-1)
+    span = np.searchsorted(kept, k, side='right') - 1
+    a, b = kept[span], kept[span+1]
+
+    # Unit chord directions (along x for a closed span)
+    dx, dy = x[b]-x[a], y[b]-y[a]
+    length = np.hypot(dx, dy)
+    closed = length == 0
+    length[closed] = 1
+    ex, ey = np.where(closed, 1.0, dx/length), np.where(closed, 0.0, dy/length)
+
+    u0, v0 = (x[k]-x[a])*ex + (y[k]-y[a])*ey, (y[k]-y[a])*ex - (x[k]-x[a])*ey
+    u1, v1 = (x[k+1]-x[a])*ex + (y[k+1]-y[a])*ey, (y[k+1]-y[a])*ex - (x[k+1]-x[a])*ey
+
+    # Segments crossing the chord are split at the crossing
+    crossing = v0*v1 < 0
+    uc = u0 + (u1-u0)*v0/np.where(crossing, v0-v1, 1)
+    first = np.where(crossing, 0.5*(uc-u0)*v0, 0.5*(u1-u0)*(v0+v1))
+    second = np.where(crossing, 0.5*(u1-uc)*v1, 0.0)
+    side0 = np.where(crossing, np.sign(v0), np.sign(v0+v1))
+    side1 = np.where(crossing, np.sign(v1), side0)
+
+    # Runs of pieces on the same side of the same chord
+    areas = np.column_stack([first, second]).ravel()
+    sides = np.column_stack([side0, side1]).ravel()
+    spans = np.repeat(span, 2)
+    starts = np.flatnonzero(np.concatenate([[True], (sides[1:] != sides[:-1]) | (spans[1:] != spans[:-1])]))
+    return float(np.sum(np.abs(np.add.reduceat(areas, starts))))
+
+# Simplified copy of a polyline and the area error introduced
+def simplify_line(x, y, tolerance, fixed=(), method='dp'):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if len(x) < 3:
+        return x, y, 0.0
+    if method == 'dp':
+        kept = douglas_peucker(x, y, tolerance, fixed)
+    elif method == 'vw':
+        kept = visvalingam(x, y, tolerance, fixed)
+    else:
+        raise ValueError('Unknown simplification method: {0}'.format(method))
+    return x[kept], y[kept], area_error(x, y, kept)
+
+# Simplify a slope profile and failure surface, keeping the profile nodes the
+# failure surface snaps to. Returns the simplified co-ordinate lists and the
+# total area error (m²/m).
+def simplify_section(sp_x, sp_y, fs_x, fs_y, tolerance, method='dp'):
+    fixed = ()
+    if fs_x is not None and len(fs_x):
+        fixed = (nearest_node(fs_x[0], fs_y[0], np.asarray(sp_x), np.asarray(sp_y)),
+                 nearest_node(fs_x[-1], fs_y[-1], np.asarray(sp_x), np.asarray(sp_y)))
+    sp_x, sp_y, error = simplify_line(sp_x, sp_y, tolerance, fixed, method)
+
+    if fs_x is not None:
+        fs_x, fs_y, fs_error = simplify_line(fs_x, fs_y, tolerance, method=method)
+        fs_x, fs_y = fs_x.tolist(), fs_y.tolist()
+        error += fs_error
+
+    return sp_x.tolist(), sp_y.tolist(), fs_x, fs_y, error
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - minimum standoff / bund height solver
+
+Finds the smallest standoff (for a given bund height) or the smallest bund
+height (for a given standoff) at which catch capacity equals the swelled
+failure volume. The failure polygon is built once and the margin is solved
+with a bracketing root-finder over the catch capacity calculation.
+
+"""
+import math
+from dataclasses import dataclass, field
+
+import runout
+from runout import section_geometry, bund_geometry
+
+# Result of a solve. value is the smallest parameter found to contain the
+# swelled failure volume (None if it isn't contained within the bracket);
+# history holds every (parameter, margin) evaluation in order.
+@dataclass
+class SolveResult:
+    parameter: str
+    value: float = None
+    converged: bool = False
+    status: str = ''
+    failure_volume: float = None
+    swelled_volume: float = None
+    catch_capacity: float = None
+    history: list = field(default_factory=list)
+
+# Illinois (modified regula falsi) root finder for an increasing function f
+# on [lo, hi]. Returns the smallest x found with f(x) >= 0, whether it is
+# within tol of the root, and a status.
+def bracket_root(f, lo, hi, tol=0.01, maxiter=50):
+    a, b = lo, hi
+    fa, fb = f(a), f(b)
+    if fa >= 0:
+        return a, True, 'Contained at lower bound'
+    if fb < 0:
+        return None, False, 'Not contained within upper bound'
+
+    side = 0
+    for i in range(maxiter):
+        if fb == float('inf'):
+            c = 0.5*(a + b)
+        else:
+            c = (a*fb - b*fa)/(fb - fa)
+
+        # Keep steps at least tol/2 inside the bracket so both ends close in
+        c = min(max(c, a + 0.5*tol), b - 0.5*tol)
+        fc = f(c)
+        if fc >= 0:
+            b, fb = c, fc
+            if side == 1: fa /= 2
+            side = 1
+        else:
+            a, fa = c, fc
+            if side == -1: fb /= 2
+            side = -1
+
+        if b - a <= tol:
+            return b, True, 'Converged'
+
+    return b, False, 'Maximum iterations reached'
+
+# Margin (catch capacity - swelled failure volume) as a function of standoff
+# or bund height, with everything else fixed
+def margin_function(parameter, fixed, swell_factor, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, engine=None, curve=None):
+    failure_fn, catch_fn, profile_fn = runout.ENGINES[engine or runout.ENGINE]
+    right = direction == 'right' and manual == 'manual'
+
+    sp_x, sp_y, fs_x, fs_y = section_geometry(spxy, fsxy, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, curve)
+    _, _, failure_volume, line_combined = failure_fn(sp_x, sp_y, fs_x, fs_y, project)
+    swelled_volume = failure_volume*swell_factor
+
+    # A run-out line that misses the profile either passes over the crest
+    # (nothing reaches the slope, infinite capacity) or starts inside the
+    # slope (no capacity)
+    gradient = math.tan(math.radians(180-runout_angle if right else runout_angle))
+    def catch_capacity(x):
+        standoff, bund_height = (x, fixed) if parameter == 'standoff' else (fixed, x)
+        b_x, b_y, bt_x, bt_y = bund_geometry(sp_x, sp_y, standoff, bund_height, right)
+        try:
+            return catch_fn(line_combined, b_x, b_y, bt_x, bt_y, bund_height, runout_angle, right)[2]
+        except Exception:
+            if bt_y + gradient*(sp_x[-1]-bt_x) > sp_y[-1]:
+                return float('inf')
+            return 0.0
+
+    return catch_capacity, failure_volume, swelled_volume
+
+# Solve for the smallest standoff or bund height that contains the swelled failure volume
+def solve_runout(parameter, fixed, bounds, swell_factor, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, tol=0.01, engine=None, curve=None):
+    res = SolveResult(parameter)
+    catch_capacity, res.failure_volume, res.swelled_volume = margin_function(parameter, fixed, swell_factor, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, engine, curve)
+
+    def margin(x):
+        m = catch_capacity(x) - res.swelled_volume
+        res.history.append((x, m))
+        return m
+
+    res.value, res.converged, res.status = bracket_root(margin, bounds[0], bounds[1], tol)
+    if res.value is not None:
+        res.catch_capacity = catch_capacity(res.value)
+    return res
+
+# Smallest standoff for a given bund height
+def solve_standoff(bund_height, swell_factor, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, bounds=(0, 50), tol=0.01, engine=None, curve=None):
+    return solve_runout('standoff', bund_height, bounds, swell_factor, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, tol, engine, curve)
+
+# Smallest bund height for a given standoff
+def solve_bund_height(standoff, swell_factor, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, bounds=(0, 5), tol=0.01, engine=None, curve=None):
+    return solve_runout('bund_height', standoff, bounds, swell_factor, runout_angle, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, tol, engine, curve)
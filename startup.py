@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - startup report
+
+Breaks down how long a fresh worker takes to become ready: interpreter
+start, the heavy imports (each timed on top of the ones before it), the
+rest of the app module, the work app.warm does, and the first requests a
+worker serves (the page, its layout, logging in and the first Update
+Graph calculation). Each run is a fresh interpreter, so nothing is cached.
+
+Two cases are reported:
+
+    cold    - a worker importing the app itself, as gunicorn does without
+              preload_app: everything is paid before or on first use
+    preload - the gunicorn master imports and warms the app once
+              (gunicorn.conf.py), then forks; the worker only pays for the
+              fork and its first requests
+
+Worker ready is the time until the page layout is served. The target is
+under a second; the exit status is 1 when a case misses it.
+
+Usage:
+    python startup.py
+    python startup.py --runs 5 --target 1.0 --save startup.json
+
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Heavy third-party imports, timed in this order before the app
+IMPORTS = ['numpy', 'flask', 'plotly.graph_objects', 'dash', 'dash_bootstrap_components']
+
+# Stage timings of one process, as (stage, seconds)
+class Timer:
+    def __init__(self):
+        self.stages = []
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages.append((stage, now-self.last))
+        self.last = now
+
+# First requests of a worker, timed into timer
+def first_requests(app, timer):
+    from loadtest import USERNAME, PASSWORD, DEFAULT_CASE
+
+    client = app.server.test_client()
+    client.get('/')
+    timer.mark('GET /')
+    client.get('/_dash-layout')
+    client.get('/_dash-dependencies')
+    timer.mark('GET /_dash-layout')
+    client.post('/login', data={'username': USERNAME, 'password': PASSWORD})
+    timer.mark('POST /login')
+
+    app.plot_runout(*DEFAULT_CASE)
+    timer.mark('first Update Graph')
+
+# Stage timings of one fresh interpreter (runs in the child, started at
+# the time given): cold, or preloaded and forked
+def measure(mode, started):
+    timer = Timer()
+    timer.stages.append(('python start', time.time()-started))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    for name in IMPORTS:
+        __import__(name)
+        timer.mark('import ' + name)
+    import app
+    timer.mark('import app (rest)')
+
+    if mode == 'cold':
+        first_requests(app, timer)
+        return timer.stages
+
+    app.load_engine(app.ENGINE)
+    timer.mark('warm: geometry engine')
+    app.page_layout()
+    timer.mark('warm: figure template')
+    app.login_figure()
+    timer.mark('warm: login figure')
+    app.server.test_client().get('/')
+    timer.mark('warm: Dash setup')
+
+    # Fork as gunicorn does and time the worker's side
+    read, write = os.pipe()
+    forked = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        worker = Timer()
+        worker.last = forked
+        worker.mark('worker: fork')
+        first_requests(app, worker)
+        with os.fdopen(write, 'w') as f:
+            json.dump([['worker: ' + stage if not stage.startswith('worker') else stage, seconds] for stage, seconds in worker.stages], f)
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        stages = json.load(f)
+    os.waitpid(pid, 0)
+    return timer.stages + [tuple(stage) for stage in stages]
+
+# Stage timings of a fresh interpreter in the given mode
+def run(mode):
+    environment = dict(os.environ, PYTHONWARNINGS='ignore')
+    started = time.time()
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, str(started)],
+                            env=environment, capture_output=True, text=True, check=True).stdout
+    return [tuple(stage) for stage in json.loads(output.splitlines()[-1])]
+
+# Time to a ready worker: everything up to the page layout, from the fork
+# for a preloaded worker
+def ready(mode, stages):
+    names = [stage for stage, seconds in stages]
+    end = names.index(('worker: ' if mode == 'preload' else '') + 'GET /_dash-layout') + 1
+    start = names.index('worker: fork') if mode == 'preload' else 0
+    return sum(seconds for stage, seconds in stages[start:end])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report the import and initialisation cost of starting a worker.')
+    parser.add_argument('--runs', type=int, default=3, help='fresh interpreters per case (median reported)')
+    parser.add_argument('--modes', nargs='+', choices=['cold', 'preload'], default=['cold', 'preload'] if hasattr(os, 'fork') else ['cold'])
+    parser.add_argument('--target', type=float, default=1.0, help='worker ready target (s)')
+    parser.add_argument('--save', default=None, help='save results as JSON')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        mode, started = args.child
+        print(json.dumps(measure(mode, float(started))))
+        return 0
+
+    results, missed = {}, 0
+    for mode in args.modes:
+        runs = [run(mode) for i in range(args.runs)]
+        stages = [(stage, statistics.median(r[i][1] for r in runs)) for i, (stage, seconds) in enumerate(runs[0])]
+        results[mode] = {'stages': stages, 'ready': statistics.median(ready(mode, r) for r in runs)}
+
+        print('{0} ({1} runs, median)'.format(mode, args.runs))
+        for stage, seconds in stages:
+            print('  {0:<32} {1:8.1f} ms'.format(stage, 1000*seconds))
+        ok = results[mode]['ready'] <= args.target
+        missed += not ok
+        print('  {0:<32} {1:8.1f} ms  {2}\n'.format('worker ready', 1000*results[mode]['ready'], 'ok' if ok else 'over the {0:.1f} s target'.format(args.target)))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    return 1 if missed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - along-strike volume integration
+
+Integrates per-metre failure volume and catch capacity (m³/m) of an ordered
+set of sections along strike by average end area, giving total volumes
+(m³) between sections and a chainage-vs-margin profile that flags the
+stretches where the bund is under capacity.
+
+Sections are read in the batch.py format with a chainage column and run
+in parallel. Section results are cached by a hash of their inputs, so
+re-running after editing one section only recomputes that section and the
+two integration terms either side of it. Sections that can't be read (or
+have no chainage) are listed as errors and left out of the integration,
+which runs between the sections either side of them.
+
+Usage:
+    python strike.py wall.csv -o profile.csv --cache wall_cache.json
+
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import batch
+
+# Columns of the section and interval profiles
+SECTION_FIELDS = ['section_id', 'chainage', 'status', 'failure_volume', 'swelled_volume', 'catch_capacity', 'margin', 'under_capacity', 'errors']
+INTERVAL_FIELDS = ['from_section', 'to_section', 'from_chainage', 'to_chainage', 'length', 'failure_volume', 'swelled_volume', 'catch_capacity', 'margin', 'shortfall']
+
+# Result of an along-strike integration. Section rows are in chainage
+# order; interval volumes are in m³; stretches are (start, end) chainages
+# where the margin is negative. Skipped holds the error rows of the
+# sections left out.
+@dataclass
+class StrikeResult:
+    sections: list
+    intervals: list
+    stretches: list
+    totals: dict
+    recomputed: list = field(default_factory=list)
+    skipped: list = field(default_factory=list)
+
+# Error message of a section that can't be integrated, or None
+def section_error(section):
+    if 'error' in section:
+        return section['error']
+    if section['parameters'].get('chainage') is None:
+        return 'Section has no chainage'
+    return None
+
+# Hash of everything a section result depends on
+def section_hash(section, defaults, engine):
+    parameters = dict(defaults, **section['parameters'])
+    parameters.pop('chainage', None)
+    key = json.dumps([section['slope'], section['failure'], sorted(parameters.items()), engine, section.get('error')])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+# Part of the interval [c1, c2] where a linearly varying margin m1 -> m2 is
+# negative, and the integral of the negative part (m³, as a positive shortfall)
+def negative_part(c1, c2, m1, m2):
+    if m1 >= 0 and m2 >= 0:
+        return None, 0.0
+    if m1 < 0 and m2 < 0:
+        return (c1, c2), -0.5*(m1 + m2)*(c2 - c1)
+    c0 = c1 + (c2 - c1)*m1/(m1 - m2)
+    if m1 < 0:
+        return (c1, c0), -0.5*m1*(c0 - c1)
+    return (c0, c2), -0.5*m2*(c2 - c0)
+
+# Average end area integration term between two section result rows
+def interval_term(a, b):
+    length = b['chainage'] - a['chainage']
+    term = {'from_section': a['section_id'], 'to_section': b['section_id'],
+            'from_chainage': a['chainage'], 'to_chainage': b['chainage'], 'length': length}
+    for name in ('failure_volume', 'swelled_volume', 'catch_capacity', 'margin'):
+        va, vb = a.get(name), b.get(name)
+        term[name] = None if va is None or vb is None else 0.5*(va + vb)*length
+
+    term['negative'], term['shortfall'] = None, None
+    if a.get('margin') is not None and b.get('margin') is not None:
+        term['negative'], term['shortfall'] = negative_part(a['chainage'], b['chainage'], a['margin'], b['margin'])
+    return term
+
+# Keeps section results and integration terms between runs so that only
+# edited sections and their neighbours' terms are recomputed
+class StrikeIntegrator:
+    def __init__(self, defaults, engine=None, workers=None):
+        self.defaults, self.engine, self.workers = defaults, engine, workers
+        self.results = {}
+        self.terms = {}
+
+    # Run the sections whose inputs changed, then integrate along strike
+    def update(self, sections):
+        skipped = [{'section_id': s['section_id'], 'chainage': s['parameters'].get('chainage'), 'status': 'error',
+                    'under_capacity': None, 'errors': section_error(s)} for s in sections if section_error(s)]
+        sections = [s for s in sections if not section_error(s)]
+
+        hashes = {s['section_id']: section_hash(s, self.defaults, self.engine) for s in sections}
+        changed = [s for s in sections if self.results.get(s['section_id'], (None,))[0] != hashes[s['section_id']]]
+        if self.workers == 1 or len(changed) <= 1:
+            rows = [batch.run_section(s, self.defaults, self.engine) for s in changed]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                rows = list(pool.map(batch.run_section, changed, [self.defaults]*len(changed), [self.engine]*len(changed)))
+        for section, row in zip(changed, rows):
+            self.results[section['section_id']] = (hashes[section['section_id']], row)
+
+        # Chainage comes from the current inputs, which may move a section without changing its result
+        ordered = sorted(sections, key=lambda s: s['parameters']['chainage'])
+        rows = []
+        for section in ordered:
+            row = dict(self.results[section['section_id']][1], chainage=section['parameters']['chainage'])
+            row['under_capacity'] = None if row.get('margin') is None else row['margin'] < 0
+            rows.append(row)
+
+        # Integration terms, reused unless either end was recomputed or moved
+        changed_ids = {s['section_id'] for s in changed}
+        terms = {}
+        for a, b in zip(rows[:-1], rows[1:]):
+            key = (a['section_id'], b['section_id'], a['chainage'], b['chainage'])
+            if key in self.terms and a['section_id'] not in changed_ids and b['section_id'] not in changed_ids:
+                terms[key] = self.terms[key]
+            else:
+                terms[key] = interval_term(a, b)
+        self.terms = terms
+        intervals = list(terms.values())
+
+        return StrikeResult(rows, intervals, under_capacity_stretches(rows, intervals), strike_totals(intervals), sorted(changed_ids), skipped)
+
+    # Section results are saved with their input hashes; terms are cheap to rebuild
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({k: [h, row] for k, (h, row) in self.results.items()}, f)
+
+    def load(self, path):
+        if os.path.exists(path):
+            with open(path) as f:
+                self.results = {k: (h, row) for k, (h, row) in json.load(f).items()}
+
+# Merge the negative parts of the intervals (and isolated negative sections)
+# into contiguous (start, end) stretches of chainage
+def under_capacity_stretches(rows, intervals):
+    ranges = [t['negative'] for t in intervals if t['negative'] is not None]
+    ranges += [(r['chainage'], r['chainage']) for r in rows if r['under_capacity']]
+    stretches = []
+    for start, end in sorted(ranges):
+        if stretches and start <= stretches[-1][1]:
+            stretches[-1] = (stretches[-1][0], max(stretches[-1][1], end))
+        else:
+            stretches.append((start, end))
+    return stretches
+
+# Total volumes along strike (m³), over the intervals where both ends were calculated
+def strike_totals(intervals):
+    totals = {}
+    for name in ('length', 'failure_volume', 'swelled_volume', 'catch_capacity', 'margin', 'shortfall'):
+        totals[name] = sum(t[name] for t in intervals if t[name] is not None)
+    totals['incomplete_intervals'] = sum(1 for t in intervals if t['margin'] is None)
+    return totals
+
+# Write the section and interval profiles as CSV
+def write_profile(result, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SECTION_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(result.sections)
+        writer.writerows(result.skipped)
+    stem, ext = os.path.splitext(path)
+    with open(stem + '_intervals' + (ext or '.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=INTERVAL_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(result.intervals)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Integrate run-out volumes along strike across sequential sections.')
+    parser.add_argument('input', help='long-format CSV/TSV file or directory of section files, with a chainage column')
+    parser.add_argument('-o', '--output', default='profile.csv', help='section profile CSV (intervals go to <output>_intervals.csv)')
+    parser.add_argument('--cache', default=None, help='section result cache, so unchanged sections are not recomputed')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--engine', choices=sorted(batch.runout.ENGINES), default=None)
+    parser.add_argument('--standoff', type=float, default=18)
+    parser.add_argument('--swell-factor', type=float, default=1.3)
+    parser.add_argument('--bund-height', type=float, default=2)
+    parser.add_argument('--runout-angle', type=float, default=37)
+    parser.add_argument('--direction', choices=['left', 'right'], default='left')
+    parser.add_argument('--project', choices=['yes', 'no'], default='yes', help='project run-out to backscarp')
+    args = parser.parse_args(argv)
+
+    defaults = {'standoff': args.standoff, 'swell_factor': args.swell_factor, 'bund_height': args.bund_height,
+                'runout_angle': args.runout_angle, 'direction': args.direction, 'project': args.project}
+
+    integrator = StrikeIntegrator(defaults, args.engine, args.workers)
+    if args.cache:
+        integrator.load(args.cache)
+    result = integrator.update(batch.read_sections(args.input))
+    if args.cache:
+        integrator.save(args.cache)
+    write_profile(result, args.output)
+
+    totals = result.totals
+    print('{0} sections ({1} recomputed) over {2:.1f} m'.format(len(result.sections), len(result.recomputed), totals['length']), file=sys.stderr)
+    print('Swelled failure volume {0:.0f} m³, catch capacity {1:.0f} m³, shortfall {2:.0f} m³'.format(totals['swelled_volume'], totals['catch_capacity'], totals['shortfall']), file=sys.stderr)
+    for start, end in result.stretches:
+        print('Under capacity: chainage {0:.1f} - {1:.1f}'.format(start, end), file=sys.stderr)
+    if totals['incomplete_intervals']:
+        print('{0} intervals skipped: section calculation failed at one end'.format(totals['incomplete_intervals']), file=sys.stderr)
+    for row in result.skipped:
+        print('Section {0} left out: {1}'.format(row['section_id'], row['errors']), file=sys.stderr)
+    return 1 if result.skipped else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - live response surface
+
+Sections through the response of the parameterised geometry along each of
+its sliders (slope height, slope angle, crest width, daylighting height,
+basal structure angle, crack distance), with the other inputs held at their
+current values. The app sends these to the browser, which interpolates them
+while a slider is dragged and only asks the server for an exact result when
+it is released.
+
+Each section is sampled evenly over the slider's range. The numpy engine is
+used for the samples whatever the app's engine is, as it is the fastest.
+
+"""
+import numpy as np
+
+from runout import compute_runout
+
+# Slider ranges and steps of the parameterised inputs, as in the app's inputs
+SLIDERS = {
+    'slopeheight': (1, 100, 1),
+    'slopeangle': (1, 90, 1),
+    'crestwidth': (1, 100, 1),
+    'failureheight': (0, 100, 1),
+    'failureangle': (1, 90, 1),
+    'backscarpdist': (-100, 100, 1),
+}
+
+# Samples along each slider
+SAMPLES = 25
+
+# Slider values the response is sampled at (snapped to the slider steps)
+def slider_samples(name, samples=SAMPLES):
+    low, high, step = SLIDERS[name]
+    values = np.unique(np.round(np.linspace(low, high, samples)/step)*step)
+    return [float(v) for v in values]
+
+# Run-out results along each slider through the given parameterised inputs
+# (curve as for runout.compute_runout), as {slider: [(value, RunoutResult), ...]}
+def slider_sections(standoff, swell_factor, bund_height, runout_angle, project, bkp, params, samples=SAMPLES, engine='numpy', curve=None):
+    sections = {}
+    for name in SLIDERS:
+        section = []
+        for value in slider_samples(name, samples):
+            p = dict(params, **{name: value})
+            res = compute_runout(standoff, swell_factor, bund_height, runout_angle, '', '', 'left', project, 'parameterised',
+                                 p['slopeheight'], p['slopeangle'], p['crestwidth'], p['failureheight'], p['failureangle'], bkp, p['backscarpdist'],
+                                 engine=engine, curve=curve)
+            section.append((value, res))
+        sections[name] = section
+    return sections
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - parameter sweeps
+
+Evaluates one slope/failure geometry over a grid of standoff, bund height,
+run-out angle and swell factor. The geometry is parsed and the failure
+polygon is built once; catch capacity for the whole grid comes from
+geometry.catch_capacity_grid.
+
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+import geometry
+from runout import section_geometry
+
+# Result of a parameter sweep. catch_capacity has shape
+# (standoffs, bund_heights, runout_angles) and NaN where the run-out line
+# misses the profile.
+@dataclass
+class SweepResult:
+    standoffs: np.ndarray
+    bund_heights: np.ndarray
+    runout_angles: np.ndarray
+    swell_factors: np.ndarray
+    failure_volume: float
+    catch_capacity: np.ndarray
+
+    # Swelled failure volume per swell factor (m³/m)
+    @property
+    def swelled_volume(self):
+        return self.failure_volume*self.swell_factors
+
+    # Spare catch capacity, shape (standoffs, bund_heights, runout_angles, swell_factors)
+    @property
+    def margin(self):
+        return self.catch_capacity[..., None] - self.swelled_volume
+
+# Sweep one geometry over arrays of the plot_runout parameters (curve as
+# for runout.compute_runout)
+def sweep_runout(standoffs, swell_factors, bund_heights, runout_angles, spxy, fsxy, direction, project, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, curve=None):
+    standoffs = np.atleast_1d(np.asarray(standoffs, dtype=float))
+    swell_factors = np.atleast_1d(np.asarray(swell_factors, dtype=float))
+    bund_heights = np.atleast_1d(np.asarray(bund_heights, dtype=float))
+    runout_angles = np.atleast_1d(np.asarray(runout_angles, dtype=float))
+    right = direction == 'right' and manual == 'manual'
+
+    sp_x, sp_y, fs_x, fs_y = section_geometry(spxy, fsxy, manual, slopeheight, slopeangle, crestwidth, failureheight, failureangle, bkp, backscarpdist, curve)
+
+    # Failure volume is the same for every combination
+    try:
+        _, _, failure_volume, line_combined = geometry.failure_geometry(sp_x, sp_y, fs_x, fs_y, project)
+    except ValueError:
+        failure_volume, line_combined = np.nan, geometry.profile_line(sp_x, sp_y)
+
+    catch_capacity = geometry.catch_capacity_grid(line_combined, sp_x[0], sp_y[0], standoffs, bund_heights, runout_angles, right)
+    return SweepResult(standoffs, bund_heights, runout_angles, swell_factors, failure_volume, catch_capacity)
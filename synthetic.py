@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Run-out calculator - synthetic sections
+
+Generates benched slope profiles and failure surfaces with a controlled
+number of vertices, in the manual (co-ordinate text) and parameterised
+forms the app takes. Used by benchmark.py for timing, and as a correctness
+corpus for comparing geometry engines (runout.compare_engines).
+
+Profiles are pit walls of benches (face + berm) with a little waviness and
+jitter. The vertex spacing is kept above the 0.1 m co-ordinate rounding, so
+large profiles are tall walls rather than dense copies of a small one.
+
+"""
+import itertools
+import math
+
+import numpy as np
+
+# Profile sizes (vertices)
+SIZES = [10, 100, 1000, 10000]
+
+# Bench geometry (m, degrees) and the target vertex spacing along the profile (m)
+BENCH_HEIGHT = 12
+BENCH_ANGLE = 65
+BERM_WIDTH = 8
+SPACING = 0.5
+
+# Benched slope profile of exactly n vertices from the toe at (0, 0), rising
+# to the right (or to the left when right is True, as the app expects for a
+# slope facing right)
+def slope_profile(n, right=False, seed=0):
+    rng = np.random.default_rng(seed)
+    face = BENCH_HEIGHT/math.sin(math.radians(BENCH_ANGLE))
+    bench_length = face + BERM_WIDTH
+    benches = max(1, round((n-1)*SPACING/bench_length))
+
+    # Distance along the profile of each vertex, mapped onto the benches
+    s = np.linspace(0, benches*bench_length, n)
+    bench, along = np.divmod(s, bench_length)
+    bench[-1], along[-1] = benches-1, bench_length
+    on_face = along < face
+    x = bench*(BENCH_HEIGHT/math.tan(math.radians(BENCH_ANGLE)) + BERM_WIDTH) + np.where(on_face, along*math.cos(math.radians(BENCH_ANGLE)), BENCH_HEIGHT/math.tan(math.radians(BENCH_ANGLE)) + along - face)
+    y = bench*BENCH_HEIGHT + np.where(on_face, along*math.sin(math.radians(BENCH_ANGLE)), BENCH_HEIGHT)
+
+    # Waviness and jitter, small against the spacing so x stays increasing
+    spacing = s[1] - s[0]
+    y = y + 0.3*np.sin(s/3.7)*np.sin(np.pi*s/s[-1]) + rng.normal(0, 0.05*spacing, n)*(np.arange(n) > 0)
+    return (-x if right else x), y
+
+# Failure surface of n vertices under the lowest benches of a profile: from
+# two thirds of the way up the first face to the back of the berm of bench 3
+# (or the last bench), sagging into the slope. With backscarp, it rises to
+# the berm up a vertical scarp.
+def failure_surface(sp_x, sp_y, n, backscarp=False):
+    sp_x, sp_y = np.asarray(sp_x), np.asarray(sp_y)
+    ax = np.abs(sp_x)
+    benches = max(1, int(round(sp_y[-1]/BENCH_HEIGHT)))
+    top = min(benches, 3)*BENCH_HEIGHT
+
+    # Start on the first face, end at the last vertex at berm level
+    i0 = int(np.argmin(np.abs(sp_y[sp_y < BENCH_HEIGHT] - 2*BENCH_HEIGHT/3)))
+    i1 = int(np.flatnonzero(np.abs(sp_y - top) < 1)[-1])
+
+    x0, y0, x1, y1 = ax[i0], sp_y[i0], ax[i1], sp_y[i1]
+    scarp = 0.3*(y1 - y0) if backscarp else 0.0
+    m = n-1 if backscarp else n
+    t = np.linspace(0, 1, m)
+    length = math.hypot(x1-x0, y1-y0-scarp)
+    x = x0 + t*(x1-x0)
+    y = y0 + t*(y1-scarp-y0) - 0.2*length*np.sin(np.pi*t)*(1-t if backscarp else 1)
+    if backscarp:
+        x, y = np.append(x, x1), np.append(y, y1)
+    return (-x if sp_x[-1] < 0 else x), y
+
+# Co-ordinates as the tab separated text pasted into the app
+def to_textarea(x, y):
+    return '\n'.join('{0:.1f}\t{1:.1f}'.format(a, b) for a, b in zip(x, y))
+
+# Manual mode section as compute_runout arguments
+def manual_case(n, right=False, bunded=True, backscarp=False, standoff=3, seed=0):
+    sp_x, sp_y = slope_profile(n, right, seed)
+    fs_x, fs_y = failure_surface(sp_x, sp_y, max(4, n//10), backscarp)
+    return (standoff, 1.3, 2 if bunded else 0, 37, to_textarea(sp_x, sp_y), to_textarea(fs_x, fs_y),
+            'right' if right else 'left', 'yes', 'manual', 36, 65, 10, 12, 35, 'no', 5)
+
+# Parameterised mode section as compute_runout arguments
+def parameterised_case(bunded=True, backscarp=False, backscarpdist=5, standoff=18):
+    return (standoff, 1.3, 2 if bunded else 0, 37, '', '', 'left', 'yes', 'parameterised',
+            36, 65, 10, 12, 35, 'yes' if backscarp else 'no', backscarpdist)
+
+# Named cases over every size and variant: (name, n, compute_runout arguments)
+def corpus(sizes=SIZES):
+    for n, right, bunded, backscarp in itertools.product(sizes, [False, True], [True, False], [False, True]):
+        name = 'manual-n{0}-{1}-{2}{3}'.format(n, 'right' if right else 'left', 'bunded' if bunded else 'unbunded', '-backscarp' if backscarp else '')
+        yield name, n, manual_case(n, right, bunded, backscarp)
+    for bunded, backscarp in itertools.product([True, False], [False, True]):
+        name = 'parameterised-{0}{1}'.format('bunded' if bunded else 'unbunded', '-backscarp' if backscarp else '')
+        yield name, 5, parameterised_case(bunded, backscarp)